@@ -0,0 +1,461 @@
+"""
+Controller channel for CMSnet.
+
+Carries CMS messages (JSON objects) to the controller without ever blocking
+a CMS command on it. Messages are put on a bounded queue and written by a
+background sender thread, which:
+
+    frames      each message, either as a JSON object followed by a newline
+                ("newline", what the POX messenger reads) or as a 4-byte
+                big-endian length followed by the JSON object ("length")
+    batches     all messages queued at the time of a write into that one
+                write (sendall), so a burst of events costs a few syscalls
+    reconnects  whenever the connection fails, with exponential backoff;
+                the batch being written is kept and written again
+
+When the queue is full (controller slow or away), new messages are dropped
+and counted rather than waited for.
+
+On every (re)connection, a handshake function may talk to the controller
+before any queued message is written; CMSnet uses this to catch the
+controller up (see CMSnet._controller_handshake). Messages from the
+controller (JSON objects) are then read by a reader thread and passed to a
+message function, e.g. to process acknowledgments.
+
+ControllerChannel: the channel. See stats() for its counters.
+
+EventJournal: sequence-numbered journal of the VM events sent, from which
+a reconnecting controller gets the events after the last one it
+acknowledged.
+
+EventCoalescer: holds VM events for a time window and collapses the events
+of each VM into its net change (e.g. migrated, migrated, destroyed into one
+destroyed from where the controller last saw the VM), so that the controller
+load scales with net changes rather than with operations.
+"""
+
+import json
+import socket
+import select
+import struct
+from collections import deque
+from threading import Thread, Event, Lock, Timer
+from Queue import Queue, Full, Empty
+from time import time
+
+from mininet.log import info, warn, debug
+
+
+FRAMINGS = ("newline", "length")
+
+decoder = json.JSONDecoder()
+
+
+class MessageReader( object ):
+    "Reads JSON objects, separated by whitespace or not, from a socket."
+
+    def __init__( self, sock ):
+        self.sock = sock
+        self.buf = ""
+
+    def read( self, timeout=None ):
+        """Return the next message, or None after timeout seconds.
+           Raises socket.error when the connection is closed."""
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            data = self.buf.lstrip()
+            if data:
+                try:
+                    msg, end = decoder.raw_decode(data)
+                    self.buf = data[end:]
+                    return msg
+                except ValueError:
+                    pass                # Incomplete; read more.
+            self.buf = data
+            wait = None if deadline is None else max(0, deadline - time())
+            if not select.select([self.sock], [], [], wait)[0]:
+                return None
+            data = self.sock.recv(4096)
+            if not data:
+                raise socket.error("connection closed")
+            self.buf += data
+
+
+class ControllerChannel( object ):
+    "Asynchronous, framed and batched connection to the controller."
+
+    def __init__( self, ip, port, framing="newline", max_queue=10000,
+                  max_batch=1000, backoff_min=0.1, backoff_max=10.0,
+                  timeout=5.0, handshake=None, on_message=None ):
+        """
+        Intialization
+
+        ip: Controller IP
+        port: Controller TCP port
+        framing: Message framing ("newline" or "length")
+        max_queue: Maximum number of messages waiting to be sent
+        max_batch: Maximum number of messages per write
+        backoff_min: First delay before reconnecting (s)
+        backoff_max: Maximum delay before reconnecting (s)
+        timeout: Timeout of connecting and writing (s)
+        handshake: Function run on each new connection, before queued
+                   messages are written, as handshake(send, read): send(msg)
+                   writes a message, read(timeout) returns the next message
+                   from the controller (or None on timeout)
+        on_message: Function taking each later message from the controller
+        """
+        assert framing in FRAMINGS
+        self.ip = ip
+        self.port = port
+        self.framing = framing
+        self.max_batch = max_batch
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.handshake = handshake
+        self.on_message = on_message
+
+        self.queue = Queue(max_queue)
+        self.sock = None
+        self.broken = Event()    # Set by the reader when the peer is gone
+        self.backoff = backoff_min
+        self.next_connect = 0.0  # Time of the next connection attempt
+        self.thread = None
+        self.stopped = Event()
+        self.idle = Event()      # Set while nothing is queued or in flight
+        self.idle.set()
+        self.stats_lock = Lock()
+        self.counters = {"queued": 0,       # Messages accepted
+                         "sent": 0,         # Messages written
+                         "dropped": 0,      # Messages refused (queue full)
+                         "writes": 0,       # Batches written
+                         "bytes": 0,        # Bytes written
+                         "connects": 0,     # Successful connections
+                         "failures": 0,     # Failed connects and writes
+                         "received": 0,     # Messages from the controller
+                         "max_depth": 0}    # Longest queue seen
+
+    # Sending
+
+    def send( self, msg ):
+        """Queue a message (dict) for the controller without blocking.
+           returns: False if it was dropped"""
+        try:
+            self.queue.put_nowait(msg)
+        except Full:
+            self._count("dropped")
+            return False
+        self.idle.clear()
+        with self.stats_lock:
+            self.counters["queued"] += 1
+            depth = self.queue.qsize()
+            if depth > self.counters["max_depth"]:
+                self.counters["max_depth"] = depth
+        return True
+
+    def frame( self, msg ):
+        "Return the bytes of a framed message."
+        data = json.dumps(msg)
+        if self.framing == "length":
+            return struct.pack("!I", len(data)) + data
+        return data + "\n"
+
+    def _count( self, counter, n=1 ):
+        with self.stats_lock:
+            self.counters[counter] += n
+
+    # Connection
+
+    def _connect( self ):
+        "Connect to the controller and run the handshake. True if done."
+        sock = None
+        try:
+            sock = socket.create_connection((self.ip, self.port),
+                                            self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = MessageReader(sock)
+            if self.handshake:
+                send = lambda msg: sock.sendall(self.frame(msg))
+                self.handshake(send, reader.read)
+        except socket.error as e:
+            if sock:
+                sock.close()
+            if self.counters["connects"] == 0 and \
+               self.counters["failures"] == 0:
+                warn("\nCannot connect to controller: %s (retrying)\n" % e)
+            self._count("failures")
+            return False
+        self.sock = sock
+        self.broken.clear()
+        self._count("connects")
+        t = Thread(target=self._read, args=(reader,), name="cms-channel-rx")
+        t.daemon = True
+        t.start()
+        debug("Connected to controller %s:%s\n" % (self.ip, self.port))
+        return True
+
+    def _ensure_connected( self ):
+        "Connect if needed, with backoff between attempts. True if connected."
+        if self.sock is not None and not self.broken.is_set():
+            return True
+        self._disconnect()
+        if time() < self.next_connect:
+            return False
+        if self._connect():
+            self.backoff = self.backoff_min
+            return True
+        self.next_connect = time() + self.backoff
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+        return False
+
+    def _disconnect( self ):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass  # If other side already shut down, leave it.
+            self.sock.close()
+            self.sock = None
+
+    def connected( self ):
+        "Test if the channel is connected to the controller."
+        return self.sock is not None and not self.broken.is_set()
+
+    def _read( self, reader ):
+        "Pass messages from the controller on until the connection ends."
+        while True:
+            try:
+                msg = reader.read()
+            except (socket.error, ValueError):
+                break
+            self._count("received")
+            if self.on_message:
+                try:
+                    self.on_message(msg)
+                except Exception as e:
+                    warn("\nBad message from controller: %s\n" % e)
+        self.broken.set()
+
+    # Sender thread
+
+    def _next_batch( self ):
+        "Wait for messages; return up to max_batch of them (or [])."
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except Empty:
+            if self.queue.empty():
+                self.idle.set()
+            return []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _write( self, data ):
+        "Write data, reconnecting as needed. False if stopped first."
+        while not self.stopped.is_set():
+            if not self._ensure_connected():
+                self.stopped.wait(max(0.0, self.next_connect - time()))
+                continue
+            try:
+                self.sock.sendall(data)
+                return True
+            except socket.error as e:
+                debug("Controller connection lost: %s\n" % e)
+                self._count("failures")
+                self._disconnect()
+        return False
+
+    def _run( self ):
+        "Send batches until stopped."
+        while not self.stopped.is_set():
+            batch = self._next_batch()
+            if not batch:
+                self._ensure_connected()    # Catch up a returning controller.
+                continue
+            data = "".join([self.frame(msg) for msg in batch])
+            if not self._write(data):
+                break
+            with self.stats_lock:
+                self.counters["sent"] += len(batch)
+                self.counters["writes"] += 1
+                self.counters["bytes"] += len(data)
+        self._disconnect()
+
+    def start( self ):
+        "Start the sender thread (which connects to the controller)."
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, name="cms-channel")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def flush( self, timeout=None ):
+        """Wait until all queued messages are written.
+           returns: True if they were"""
+        return self.idle.wait(timeout) or self.idle.is_set()
+
+    def stop( self, timeout=1.0 ):
+        "Stop the channel, giving queued messages timeout seconds to go."
+        if self.thread is None:
+            return
+        if not self.flush(timeout):
+            info("*** %i CMS messages not sent to the controller\n" %
+                 self.queue.qsize())
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def stats( self ):
+        "Return dict of the counters, with the current queue depth."
+        with self.stats_lock:
+            stats = dict(self.counters)
+        stats["depth"] = self.queue.qsize()
+        stats["connected"] = self.connected()
+        return stats
+
+
+class EventCoalescer( object ):
+    "Collapses the VM events of a time window into net changes."
+
+    def __init__( self, window, flush_fn ):
+        """
+        Intialization
+
+        window: Time events are held, from the first one held (s)
+        flush_fn: Function taking the list of collapsed events
+        """
+        self.window = window
+        self.flush_fn = flush_fn
+        self.lock = Lock()
+        self.hostToEvent = {}    # VM name to its collapsed event
+        self.hosts = []          # VM names in order of first event
+        self.timer = None
+        self.received = 0
+        self.flushed = 0
+
+    @staticmethod
+    def merge( prev, event ):
+        """Return the event equivalent to prev followed by event (both of
+           the same VM), or None if they cancel out."""
+        prev_cmd, cmd = prev["cmd"], event["cmd"]
+        merged = dict(event)
+        if prev_cmd == "instantiated":
+            if cmd == "destroyed":
+                return None            # Never seen by the controller.
+            if cmd == "migrated":
+                merged["cmd"] = "instantiated"
+                for key in EventCoalescer.OLD_KEYS:
+                    merged.pop(key, None)
+        elif prev_cmd == "migrated":
+            if cmd in ("migrated", "destroyed"):
+                EventCoalescer._keep_old(prev, merged)
+        elif prev_cmd == "destroyed":
+            if cmd == "instantiated":
+                merged["cmd"] = "migrated"
+                EventCoalescer._keep_old(prev, merged)
+        return merged
+
+    # Fields telling where the VM was before the event: in a collapsed
+    # event, they must all come from the first event (where the controller
+    # last saw the VM), never from intermediate ones.
+    OLD_KEYS = ("old_hv", "old_dpid")
+
+    @staticmethod
+    def _keep_old( prev, merged ):
+        "Give merged the old location of prev (the earlier event)."
+        for key in EventCoalescer.OLD_KEYS:
+            if prev.get(key) is not None:
+                merged[key] = prev[key]
+            else:
+                merged.pop(key, None)
+
+    def add( self, event ):
+        "Hold a VM event, collapsing it with earlier ones of the VM."
+        with self.lock:
+            self.received += 1
+            host = event["host"]
+            if host in self.hostToEvent:
+                merged = self.merge(self.hostToEvent[host], event)
+                if merged is None:
+                    del self.hostToEvent[host]
+                    self.hosts.remove(host)
+                else:
+                    self.hostToEvent[host] = merged
+            else:
+                self.hostToEvent[host] = event
+                self.hosts.append(host)
+            if self.timer is None:
+                self.timer = Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush( self, urgent=() ):
+        """Pass on the collapsed events now, followed by the urgent events
+           (which are neither held nor collapsed). flush_fn is called under
+           the lock, so that events are passed on in order."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            events = [self.hostToEvent[host] for host in self.hosts]
+            events += urgent
+            self.hostToEvent = {}
+            self.hosts = []
+            self.received += len(urgent)
+            self.flushed += len(events)
+            if events:
+                self.flush_fn(events)
+
+    def stop( self ):
+        "Pass on the events held and stop."
+        self.flush()
+
+
+class EventJournal( object ):
+    "Sequence-numbered journal of the VM events sent to the controller."
+
+    def __init__( self, max_len=10000 ):
+        """
+        Intialization
+
+        max_len: Maximum number of unacknowledged events kept; a controller
+                 missing more than that gets a snapshot instead
+        """
+        self.max_len = max_len
+        self.lock = Lock()
+        self.seq = 0             # Sequence number of the last event
+        self.acked = 0           # Last sequence number acknowledged
+        self.events = deque()    # Events after acked, oldest first
+
+    def record( self, events ):
+        "Give events the next sequence numbers (as 'seq') and keep them."
+        with self.lock:
+            for event in events:
+                self.seq += 1
+                event['seq'] = self.seq
+                self.events.append(event)
+            while len(self.events) > self.max_len:
+                self.events.popleft()
+
+    def ack( self, seq ):
+        "Forget the events up to seq, which the controller has."
+        with self.lock:
+            self.acked = max(self.acked, min(seq, self.seq))
+            while self.events and self.events[0]['seq'] <= self.acked:
+                self.events.popleft()
+
+    def since( self, seq ):
+        """Return the events after seq, or None if the journal does not
+           hold them all (the controller then needs a snapshot)."""
+        with self.lock:
+            if seq is None or seq > self.seq:
+                return None         # Unknown to us (e.g. our restart).
+            if seq == self.seq:
+                return []
+            if not self.events or self.events[0]['seq'] > seq + 1:
+                return None
+            return [e for e in self.events if e['seq'] > seq]
@@ -36,7 +36,9 @@
 from mininet.util import quietRun, isShellBuiltin, dumpNodeConnections
 from mininet.util import checkInt
 
-from cmsnet.cms_comp import VirtualMachine, Hypervisor
+from cmsnet.cms_comp import VirtualMachine, Hypervisor, RESOURCES
+from cmsnet.cms_net import isNamePattern
+from cmsnet.cms_probe import ProbeHarness
 
 class CMSCLI( Cmd ):
     "Simple command-line interface to talk to VMs and hypervisors."
@@ -179,8 +181,8 @@ def _check_vm_name( self, vm_name, exp_exist=True, exp_running=None ):
         if not vm_name:      # Ignore if not set by input.
             return False     # NOTE: Already handled at parsing.
 
-        in_cn = vm_name in self.cn
-        comp = self.cn[vm_name] if in_cn else None
+        comp = self.cn.nameToComp.get(vm_name)
+        in_cn = comp is not None
         is_VM = isinstance(comp, VirtualMachine)
         is_HV = isinstance(comp, Hypervisor)
         err = False
@@ -214,14 +216,14 @@ def _check_hv_name( self, hv_name, exp_enabled=True ):
         Checks the correctness of the hypervisor of the given name.
 
         hv_name: Name of the hypervisor. If None, ignore and return.
-        exp_enabled: Expected result of HV enabled or not.
+        exp_enabled: Expected result of HV enabled or not. None if not matter.
         Returns True if error occured, False otherwise.
         """
         if not hv_name:      # Ignore if not set by input.
             return False     # NOTE: Already handled at parsing.
 
-        in_cn = hv_name in self.cn
-        comp = self.cn[hv_name] if in_cn else None
+        comp = self.cn.nameToComp.get(hv_name)
+        in_cn = comp is not None
         is_VM = isinstance(comp, VirtualMachine)
         is_HV = isinstance(comp, Hypervisor)
         err = False
@@ -235,7 +237,7 @@ def _check_hv_name( self, hv_name, exp_enabled=True ):
         elif not is_HV:
             error('No such hypervisor %s\n' % hv_name)
             err = True
-        elif is_HV:
+        elif is_HV and exp_enabled is not None:
             hv_enb = comp.is_enabled()
             if not hv_enb and exp_enabled:
                 error('Hypervisor %s is currently disabled\n' % hv_name)
@@ -246,6 +248,28 @@ def _check_hv_name( self, hv_name, exp_enabled=True ):
 
         return err
 
+    def _expand_vm_names( self, pattern ):
+        """
+        Expands a VM name pattern into VM names.
+
+        pattern: Range like vm1..vm500, or glob like vm* (existing VMs).
+        Returns list of names, or None if an error occured.
+        """
+        try:
+            vm_names = self.cn.expandVMNames(pattern)
+        except ValueError as e:
+            error('%s\n' % e)
+            return None
+        if not vm_names:
+            error('No VM matches %s\n' % pattern)
+            return None
+        return vm_names
+
+    def _check_vm_names( self, vm_names, **kwargs ):
+        "Checks each VM name (see _check_vm_name). True if any error."
+        errs = [self._check_vm_name(vm_name, **kwargs) for vm_name in vm_names]
+        return any(errs)
+
     def do_add( self, line, cmd_name='add' ):
         "Create a virtual machine image."
         args = line.split()
@@ -264,6 +288,13 @@ def do_add( self, line, cmd_name='add' ):
             error('invalid number of args: %s\n' % usage)
             return
 
+        if isNamePattern(vm_name):
+            vm_names = self._expand_vm_names(vm_name)
+            if vm_names and not self._check_vm_names(vm_names,
+                                                     exp_exist=False):
+                self.cn.createVMs(vm_names)
+            return
+
         err = self._check_vm_name(vm_name, exp_exist=False)
         # TODO: Check vm_script value.
         
@@ -308,6 +339,17 @@ def do_launch( self, line, cmd_name='launch' ):
             error('invalid number of args: %s\n' % usage)
             return
 
+        if isNamePattern(vm_name):
+            vm_names = self._expand_vm_names(vm_name)
+            if not vm_names:
+                return
+            err1 = self._check_vm_names(vm_names, exp_exist=True,
+                                        exp_running=False)
+            err2 = self._check_hv_name(hv_name, exp_enabled=True)
+            if not err1 and not err2:
+                self.cn.launchVMs(vm_names, hv_name)
+            return
+
         err1 = self._check_vm_name(vm_name, exp_exist=True, exp_running=False)
         err2 = self._check_hv_name(hv_name, exp_enabled=True)
 
@@ -328,6 +370,17 @@ def do_mv( self, line, cmd_name='mv' ):
             error('invalid number of args: %s\n' % usage)
             return
 
+        if isNamePattern(vm_name):
+            vm_names = self._expand_vm_names(vm_name)
+            if not vm_names:
+                return
+            err1 = self._check_vm_names(vm_names, exp_exist=True,
+                                        exp_running=True)
+            err2 = self._check_hv_name(hv_name, exp_enabled=True)
+            if not err1 and not err2:
+                self.cn.migrateVMs(vm_names, hv_name)
+            return
+
         err1 = self._check_vm_name(vm_name, exp_exist=True, exp_running=True)
         err2 = self._check_hv_name(hv_name, exp_enabled=True)
 
@@ -346,6 +399,14 @@ def do_stop( self, line, cmd_name='stop' ):
             error('invalid number of args: %s\n' % usage)
             return
 
+        if isNamePattern(vm_name):
+            vm_names = self._expand_vm_names(vm_name)
+            if vm_names and not self._check_vm_names(vm_names,
+                                                     exp_exist=True,
+                                                     exp_running=True):
+                self.cn.stopVMs(vm_names)
+            return
+
         err = self._check_vm_name(vm_name, exp_exist=True, exp_running=True)
         
         if not err:
@@ -376,7 +437,7 @@ def do_mode( self, line, cmd_name='mode' ):
 
         if len(args) == 0:
             out_str = "vm_dist_mode: %s" % self.cn.vm_dist_mode
-            if self.cn.vm_dist_mode == "packed":
+            if self.cn.vm_dist_mode in ("packed", "tenant"):
                 out_str += "\tvm_dist_limit: %s" % self.cn.vm_dist_limit
             output(out_str+"\n")
             return
@@ -397,7 +458,7 @@ def do_mode( self, line, cmd_name='mode' ):
             error('No such VM distribution mode: %s\n' % vm_dist_mode)
             return
         if vm_dist_limit is not None:
-            if vm_dist_mode != "packed":
+            if vm_dist_mode not in ("packed", "tenant"):
                 error('Mode %s should not have limit\n' % vm_dist_mode)
                 return
             if vm_dist_limit <= 0:
@@ -428,6 +489,69 @@ def do_level( self, line, cmd_name='level' ):
 
         self.cn.changeCMSMsgLevel(msg_level)
 
+    def do_migration( self, line, cmd_name='migration' ):
+        "Change the mode of moving VM links on launch/migrate/stop."
+        args = line.split()
+        migration_mode = None
+
+        if len(args) == 0:
+            out_str = "migration_mode: %s" % self.cn.migration_mode
+            output(out_str+"\n")
+            return
+        elif len(args) == 1:
+            migration_mode = args[0]
+        else:
+            usage = '%s migration_mode' % cmd_name
+            error('invalid number of args: %s\n' % usage)
+            return
+
+        if migration_mode not in self.cn.possible_migration_modes:
+            error('No such migration mode: %s\n' % migration_mode)
+            return
+
+        self.cn.changeMigrationMode(migration_mode)
+
+    def do_coalesce( self, line, cmd_name='coalesce' ):
+        "Change the time window of collapsing CMS messages (0 for none)."
+        args = line.split()
+
+        if len(args) == 0:
+            out_str = "msg_coalesce: %s" % self.cn.msg_coalesce
+            output(out_str+"\n")
+            return
+        elif len(args) != 1:
+            usage = '%s seconds' % cmd_name
+            error('invalid number of args: %s\n' % usage)
+            return
+
+        try:
+            msg_coalesce = float(args[0])
+        except ValueError:
+            msg_coalesce = -1
+        if msg_coalesce < 0:
+            error('Invalid time window: %s\n' % args[0])
+            return
+
+        self.cn.changeMsgCoalesce(msg_coalesce)
+
+    def do_channel( self, line, cmd_name='channel' ):
+        "Show the counters of the connection to the controller."
+        if line.split():
+            usage = '%s' % cmd_name
+            error('invalid number of args: %s\n' % usage)
+            return
+        channel = self.cn.controller_channel
+        if channel is None:
+            output("No controller connection\n")
+            return
+        stats = channel.stats()
+        coalescer = self.cn.coalescer
+        if coalescer:
+            stats["coalesced_in"] = coalescer.received
+            stats["coalesced_out"] = coalescer.flushed
+        for key in sorted(stats):
+            output("%s: %s\n" % (key, stats[key]))
+
     def do_enable( self, line, cmd_name='enable' ):
         "Enable a hypervisor."
         args = line.split()
@@ -462,6 +586,287 @@ def do_disable( self, line, cmd_name='disable' ):
         if not err:
             self.cn.disableHV(hv_name)
 
+    def _parse_resources( self, args ):
+        """
+        Parses resource amounts given as resource=amount arguments.
+
+        args: List of arguments, like ['cpu=2', 'mem=512'].
+        Returns dict of resource amounts, or None if an error occured.
+        """
+        amounts = {}
+        for arg in args:
+            resource, _sep, amount = arg.partition('=')
+            if resource not in RESOURCES:
+                error('No such resource: %s (not in %s)\n' %
+                      (resource, ', '.join(RESOURCES)))
+                return None
+            try:
+                amounts[resource] = float(amount)
+            except ValueError:
+                error('Invalid amount for %s: %s\n' % (resource, amount))
+                return None
+            if amounts[resource] < 0:
+                error('Invalid amount for %s: %s\n' % (resource, amount))
+                return None
+        return amounts
+
+    def _format_resources( self, amounts ):
+        "Formats resource amounts for output."
+        if not amounts:
+            return "none"
+        return " ".join("%s=%g" % (r, amounts[r])
+                        for r in RESOURCES if r in amounts)
+
+    def do_capacity( self, line, cmd_name='capacity' ):
+        "Show or set the resource capacities of a hypervisor."
+        args = line.split()
+        hv_name = None
+
+        if len(args) >= 1:
+            hv_name = args[0]
+        else:
+            usage = '%s hv_name [cpu=X] [mem=Y] [bw=Z]' % cmd_name
+            error('invalid number of args: %s\n' % usage)
+            return
+
+        err = self._check_hv_name(hv_name, exp_enabled=None)
+        if err:
+            return
+
+        if len(args) == 1:
+            hv = self.cn.nameToComp[hv_name]
+            out_str = "capacity: %s" % self._format_resources(hv.capacity)
+            out_str += "\tused: %s" % self._format_resources(hv.usage)
+            output(out_str+"\n")
+            return
+
+        capacity = self._parse_resources(args[1:])
+        if capacity is not None:
+            self.cn.setHVCapacity(hv_name, **capacity)
+
+    def do_demand( self, line, cmd_name='demand' ):
+        "Show or set the resource demands of a VM."
+        args = line.split()
+        vm_name = None
+
+        if len(args) >= 1:
+            vm_name = args[0]
+        else:
+            usage = '%s vm_name [cpu=X] [mem=Y] [bw=Z]' % cmd_name
+            error('invalid number of args: %s\n' % usage)
+            return
+
+        err = self._check_vm_name(vm_name, exp_exist=True)
+        if err:
+            return
+
+        if len(args) == 1:
+            vm = self.cn.nameToComp[vm_name]
+            output("demand: %s\n" % self._format_resources(vm.demand))
+            return
+
+        demand = self._parse_resources(args[1:])
+        if demand is not None:
+            self.cn.setVMDemand(vm_name, **demand)
+
+    def _parse_drain_args( self, line, cmd_name ):
+        """
+        Parses arguments of the drain/evict commands.
+
+        Returns (hv_names, policy, workers), or None if an error occured.
+        """
+        usage = '%s hv_name... [policy=mode] [workers=N]' % cmd_name
+        patterns = []
+        policy = None
+        workers = None
+        for arg in line.split():
+            key, sep, value = arg.partition('=')
+            if not sep:
+                patterns.append(arg)
+            elif key == 'policy':
+                if value not in self.cn.possible_modes:
+                    error('No such VM distribution mode: %s\n' % value)
+                    return None
+                policy = value
+            elif key == 'workers':
+                if not checkInt(value) or int(value) <= 0:
+                    error('Invalid number of workers: %s\n' % value)
+                    return None
+                workers = int(value)
+            else:
+                error('invalid args: %s\n' % usage)
+                return None
+        if not patterns:
+            error('invalid number of args: %s\n' % usage)
+            return None
+        try:
+            hv_names = self.cn.expandHVNames(patterns)
+        except ValueError as e:
+            error('%s\n' % e)
+            return None
+        if not hv_names:
+            error('No hypervisor matches %s\n' % ' '.join(patterns))
+            return None
+        if any(self._check_hv_name(hv_name, exp_enabled=None)
+               for hv_name in hv_names):
+            return None
+        return hv_names, policy, workers
+
+    def _output_drain_report( self, report ):
+        "Outputs the report of a drain/evict command."
+        downtime = report["downtime"]
+        for vm_name in report["vms"]:
+            out_str = "%s -> %s" % (vm_name,
+                                    self.cn.nameToComp[vm_name].hv_name)
+            if vm_name in downtime:
+                out_str += "\tdowntime: %.3f s" % downtime[vm_name]
+            output(out_str+"\n")
+        if report["stranded"]:
+            output("stranded: %s\n" % " ".join(report["stranded"]))
+        out_str = "migrated: %i\ttime: %.3f s" % (len(report["vms"]),
+                                                  report["time"])
+        if downtime:
+            out_str += "\tmax downtime: %.3f s" % max(downtime.values())
+        output(out_str+"\n")
+
+    def do_drain( self, line, cmd_name='drain' ):
+        "Disable hypervisors and migrate all their VMs away."
+        args = self._parse_drain_args(line, cmd_name)
+        if args:
+            self._output_drain_report(self.cn.drainHV(*args))
+
+    def do_evict( self, line, cmd_name='evict' ):
+        "Migrate all VMs away from hypervisors (which stay enabled)."
+        args = self._parse_drain_args(line, cmd_name)
+        if args:
+            self._output_drain_report(self.cn.evictVMs(*args))
+
+    def do_rebalance( self, line, cmd_name='rebalance' ):
+        """Rebalance VMs across hypervisors.
+           rebalance [plan|start [interval]|stop] [metric=M] [moves=K]
+                     [cooldown=S] [threshold=T]"""
+        args = line.split()
+        usage = ('%s [plan|start [interval]|stop] [metric=M] [moves=K] '
+                 '[cooldown=S] [threshold=T]' % cmd_name)
+        rb = self.cn.rebalancer
+        action = None
+        interval = 10.0
+        settings = {}
+
+        for arg in args:
+            key, sep, value = arg.partition('=')
+            if sep:
+                settings[key] = value
+            elif action is None and arg in ('plan', 'start', 'stop'):
+                action = arg
+            elif action == 'start':
+                try:
+                    interval = float(arg)
+                except ValueError:
+                    error('Invalid interval: %s\n' % arg)
+                    return
+            else:
+                error('invalid args: %s\n' % usage)
+                return
+
+        for key, value in settings.items():
+            if key == 'metric':
+                if value not in ('count', 'demand', 'traffic'):
+                    error('No such rebalancing metric: %s\n' % value)
+                    return
+                rb.metric = value
+            elif key in ('moves', 'cooldown', 'threshold'):
+                try:
+                    number = int(value) if key == 'moves' else float(value)
+                except ValueError:
+                    error('Invalid value for %s: %s\n' % (key, value))
+                    return
+                if number < 0:
+                    error('Invalid value for %s: %s\n' % (key, value))
+                    return
+                setattr(rb, 'max_moves' if key == 'moves' else key, number)
+            else:
+                error('No such rebalancing setting: %s\n' % key)
+                return
+
+        if action == 'start':
+            if interval <= 0:
+                error('Invalid interval: %s\n' % interval)
+                return
+            rb.start(interval)
+        elif action == 'stop':
+            rb.stop()
+        elif action == 'plan' or not settings:
+            moves = rb.rebalance(dry_run=(action == 'plan'))
+            for vm, src, dst in moves:
+                output("%s: %s -> %s\n" % (vm.name, src.name, dst.name))
+            out_str = "metric: %s\tmoves: %s\tcooldown: %s" % (
+                rb.metric, rb.max_moves, rb.cooldown)
+            out_str += "\trunning: %s" % rb.is_running()
+            output(out_str+"\n")
+
+    def do_probe( self, line, cmd_name='probe' ):
+        """Measure the data-plane cost of a VM operation.
+           probe launch|migrate|stop vm_name peer_name [hv_name...]
+                 [count=N] [interval=S] [settle=S]"""
+        usage = ('%s launch|migrate|stop vm_name peer_name [hv_name...] '
+                 '[count=N] [interval=S] [settle=S]' % cmd_name)
+        args = []
+        settings = {'count': '1'}
+        for arg in line.split():
+            key, sep, value = arg.partition('=')
+            if sep:
+                settings[key] = value
+            else:
+                args.append(arg)
+        if len(args) < 3 or args[0] not in ProbeHarness.OPS:
+            error('invalid args: %s\n' % usage)
+            return
+        op, vm_name, peer_name, hv_names = args[0], args[1], args[2], args[3:]
+        if op == 'migrate' and not hv_names:
+            error('invalid args: %s\n' % usage)
+            return
+
+        harness = ProbeHarness(self.cn)
+        for key, value in settings.items():
+            if key not in ('count', 'interval', 'settle'):
+                error('No such probe setting: %s\n' % key)
+                return
+            try:
+                number = int(value) if key == 'count' else float(value)
+            except ValueError:
+                number = 0
+            if number <= 0:
+                error('Invalid value for %s: %s\n' % (key, value))
+                return
+            settings[key] = number
+        harness.interval = settings.get('interval', harness.interval)
+        harness.settle = settings.get('settle', harness.settle)
+
+        err = self._check_vm_name(vm_name, exp_exist=True,
+                                  exp_running=(op != 'launch'))
+        err = err or any(self._check_hv_name(hv_name, exp_enabled=True)
+                         for hv_name in hv_names)
+        if peer_name not in self.cn.mn:
+            error('No such peer %s\n' % peer_name)
+            err = True
+        if err:
+            return
+
+        summary = harness.repeat(settings['count'], op, vm_name, peer_name,
+                                 hv_names)
+        if not summary['runs']:
+            return
+        output("runs: %i\n" % summary['runs'])
+        for key in ('op_time', 'blackout', 'lost', 'reordered', 'dup',
+                    'rtt_base', 'rtt_max', 'spikes', 'sent'):
+            stats = summary[key]
+            if not stats['values']:
+                continue
+            output("%-10s min %-10.6g median %-10.6g p90 %-10.6g max %.6g\n" %
+                   (key, stats['min'], stats['median'], stats['p90'],
+                    stats['max']))
+
     def do_qstart( self, line ):
         "Combination of add and launch."
         args = line.split()
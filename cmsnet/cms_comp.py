@@ -30,21 +30,28 @@
 import json
 defaultDecoder = json.JSONDecoder()
 
+# Resources of the capacity model: CPU (cores), memory (MB) and uplink
+# bandwidth (Mbit/s). Hypervisors have capacities and VMs have demands;
+# a resource missing from a capacity is unlimited.
+RESOURCES = ("cpu", "mem", "bw")
+
 class CMSComponent( object ):
     """A component of the cloud network. This is simply a wrapper for Node
        objects in Mininet."""
 
-    def __init__( self, node, config_folder="." ):
+    def __init__( self, node, config_folder=".", store=None ):
         """
         Intialization
 
         node: Mininet node
         config_folder: Folder containing configuration file
+        store: CMSStore to save configuration in (None for per-file)
         """
         assert isinstance(node, Node)
         assert isinstance(config_folder, basestring)
         self._node = node
         self._config_folder = config_folder
+        self._store = store
         self._have_comp_config = False
 
     @property
@@ -57,10 +64,7 @@ def name( self ):
 
     @name.setter
     def name( self, name ):
-        try:      # Remove old config file.
-            os.remove(self.get_config_file_name())
-        except:
-            pass
+        self.remove_comp_config()
         self.node.name = name
         self.update_comp_config()
 
@@ -78,6 +82,45 @@ def get_config_file_name( self ):
         # NOTE: This should be overridden.
         return self._config_folder+"/"+self.name+".config_cmscomp"
 
+    def get_store_key( self ):
+        "Return the key of the configuration in the state store."
+        # NOTE: This should be overridden.
+        return "comp/"+self.name
+
+    def read_comp_config( self ):
+        "Return the saved configuration dict, or None if there is none."
+        if self._store is not None:
+            return self._store.get(self.get_store_key())
+        try:
+            with open(self.get_config_file_name(), "r") as f:
+                config_raw = f.read()
+        except IOError as e:
+            return None
+        config = {}
+        if config_raw:
+            config, l = defaultDecoder.raw_decode(config_raw)
+        return config
+
+    def write_comp_config( self, config ):
+        "Save the configuration dict."
+        if self._store is not None:
+            self._store.put(self.get_store_key(), config)
+            return
+        f = open(self.get_config_file_name(), "w")
+        f.write(json.dumps(config))
+        f.flush()
+        f.close()
+
+    def remove_comp_config( self ):
+        "Remove the saved configuration."
+        if self._store is not None:
+            self._store.delete(self.get_store_key())
+            return
+        try:      # Remove old config file.
+            os.remove(self.get_config_file_name())
+        except:
+            pass
+
     def check_comp_config( self ):
         "Check for any previous configurations and adjust if necessary."
         # NOTE: This should be overridden.
@@ -95,17 +138,20 @@ class VirtualMachine( CMSComponent ):
 
     vm_uuid = 0  # UNUSED: For ID purposes? Maybe name is enough.
 
-    def __init__( self, node, config_folder=".", tenant_id=1 ):
+    def __init__( self, node, config_folder=".", tenant_id=1, store=None ):
         """
         Intialization
 
         node: Mininet node
         config_folder: Folder containing configuration file
+        tenant_id: Tenant owning this VM
+        store: CMSStore to save configuration in (None for per-file)
         """
         assert isinstance(node, Host)
-        CMSComponent.__init__( self, node, config_folder )
+        CMSComponent.__init__( self, node, config_folder, store )
 
         self._hv = None
+        self._demand = {}        # resource to amount (see RESOURCES)
         self.start_script = ""   # CHECK: Should these be modifiable?
         self.stop_script = ""
         self._tenant_id = tenant_id
@@ -150,9 +196,11 @@ def hv( self ):
     def hv( self, hv ):
         if self._hv:
             del self._hv.nameToVMs[self.name]
+            self._hv.release(self.demand)
         self._hv = hv
         if self._hv:
             self._hv.nameToVMs[self.name] = self
+            self._hv.reserve(self.demand)
             assert self.is_running()
         else:
             assert not self.is_running()
@@ -168,6 +216,20 @@ def hv_name( self ):
     def tenant_id( self ):
         return self._tenant_id
 
+    @property
+    def demand( self ):
+        return self._demand
+
+    @demand.setter
+    def demand( self, demand ):
+        demand = dict(demand) if demand else {}
+        assert all(r in RESOURCES and v >= 0 for r, v in demand.items())
+        if self._hv:
+            self._hv.release(self._demand)
+            self._hv.reserve(demand)
+        self._demand = demand
+        self.update_comp_config()
+
     def __repr__( self ):
         "More informative string representation"
         # TODO: This should be different.
@@ -177,29 +239,28 @@ def get_config_file_name( self ):
         "Return the file name of the configuration file."
         return self._config_folder+"/"+self.name+".config_vm"
 
+    def get_store_key( self ):
+        "Return the key of the configuration in the state store."
+        return "vm/"+self.name
+
     def check_comp_config( self ):
         "Check for any previous configurations and adjust if necessary."
         # See http://stackoverflow.com/questions/14574518/
-        try:
-            with open(self.get_config_file_name(), "r") as f:
-                config_raw = f.read()
-                config = {}
-                if config_raw:
-                    config, l = defaultDecoder.raw_decode(config_raw)
-                for attr in config:
-                    if isinstance(config[attr], basestring):
-                        setattr(self, attr, str(config[attr]))
-                    else:
-                        setattr(self, attr, config[attr])
-                f.close()                
-        except IOError as e:
+        config = self.read_comp_config()
+        if config is None:
             info("No config exists for VM %s\n" % self.name)
+            return
+        for attr in config:
+            value = config[attr]
+            if isinstance(value, basestring):
+                value = str(value)
+            if getattr(self, attr, None) != value:   # Skip no-op setters.
+                setattr(self, attr, value)
 
     def update_comp_config( self ):
         "Update the configurations for this component."
         if not self._have_comp_config:
             return
-        f = open(self.get_config_file_name(), "w")
         config = {}
         config["IP"] = self.IP
         config["MAC"] = self.MAC
@@ -207,9 +268,8 @@ def update_comp_config( self ):
         config["stop_script"] = self.stop_script
         config["config_hv_name"] = self.hv_name
         config["_tenant_id"] = self._tenant_id
-        f.write(json.dumps(config))
-        f.flush()
-        f.close()
+        config["demand"] = self._demand
+        self.write_comp_config(config)
 
     def is_running( self ):
         "Test if this VM image is running (or inactive) on any hypervisor."
@@ -223,15 +283,17 @@ def cloneTo( self, new_vm ):
         new_vm.start_script = self.start_script
         new_vm.stop_script = self.stop_script
         new_vm._tenant_id = self.tenant_id
+        new_vm._demand = dict(self.demand)
         # FIXME: Copy script image files in file system.
 
-    def launch( self, hv ):
+    def launch( self, hv, run_script=True ):
         "Initialize the VM on the input hypervisor."
         assert not self.is_running()
         assert hv is not None
         assert hv.is_enabled()
         self.hv = hv
-        self.node.cmd(self.start_script)
+        if run_script:
+            self.node.cmd(self.start_script)
 
     def moveTo( self, hv ):
         "Migrate the VM to the new input hypervisor."
@@ -240,11 +302,12 @@ def moveTo( self, hv ):
         assert hv.is_enabled()
         self.hv = hv
 
-    def stop( self ):
+    def stop( self, run_script=True ):
         "Stop running the VM."
         assert self.is_running()
         self.hv = None
-        self.node.cmd(self.stop_script)
+        if run_script:
+            self.node.cmd(self.stop_script)
 
     def shutdown( self ):
         "Shutdown VM when CMSnet is shutting down."
@@ -258,19 +321,25 @@ class Hypervisor( CMSComponent ):
     """A hypervisor that virtual machines run on. A wrapper class for the
        Switch class."""
 
-    def __init__( self, node, config_folder=".", vm_dist_limit=None):
+    def __init__( self, node, config_folder=".", vm_dist_limit=None,
+                  store=None, capacity=None ):
         """
         Intialization
 
         node: Mininet node
         config_folder: Folder containing configuration file
+        vm_dist_limit: Limit of number of VMs in packed mode (optional)
+        store: CMSStore to save configuration in (None for per-file)
+        capacity: Dict of resource capacities (see RESOURCES; optional)
         """
         assert isinstance(node, Switch)
-        CMSComponent.__init__( self, node, config_folder )
+        CMSComponent.__init__( self, node, config_folder, store )
 
-        self.nameToVMs = {}   # UNUSED: mapping for VMs in this hypervisor
+        self.nameToVMs = {}   # mapping for VMs running on this hypervisor
         self._enabled = True
         self._vm_dist_limit = vm_dist_limit
+        self._capacity = dict(capacity) if capacity else None
+        self.usage = dict.fromkeys(RESOURCES, 0)  # summed demands of VMs
 
         self.check_comp_config()
         self._have_comp_config = True
@@ -291,6 +360,37 @@ def vm_dist_limit( self, vm_dist_limit ):
         self._vm_dist_limit = vm_dist_limit
         self.update_comp_config()
 
+    @property
+    def capacity( self ):
+        return self._capacity if self._capacity else {}
+
+    @capacity.setter
+    def capacity( self, capacity ):
+        capacity = dict(capacity) if capacity else {}
+        assert all(r in RESOURCES and v >= 0 for r, v in capacity.items())
+        self._capacity = capacity
+        self.update_comp_config()
+
+    def reserve( self, demand ):
+        "Add a VM demand to the usage of this hypervisor."
+        for r, v in demand.items():
+            self.usage[r] = self.usage.get(r, 0) + v
+
+    def release( self, demand ):
+        "Remove a VM demand from the usage of this hypervisor."
+        for r, v in demand.items():
+            self.usage[r] = self.usage.get(r, 0) - v
+
+    def free( self ):
+        "Return dict of remaining capacity for each limited resource."
+        return dict((r, c - self.usage.get(r, 0))
+                    for r, c in self.capacity.items())
+
+    def fits( self, demand ):
+        "Test if a VM demand fits in the remaining capacity."
+        return all(self.usage.get(r, 0) + demand.get(r, 0) <= c
+                   for r, c in self.capacity.items())
+
     def __repr__( self ):
         "More informative string representation"
         # TODO: This should be different.
@@ -300,15 +400,30 @@ def get_config_file_name( self ):
         "Return the file name of the configuration file."
         return self._config_folder+"/"+self.name+".config_hv"
 
+    def get_store_key( self ):
+        "Return the key of the configuration in the state store."
+        return "hv/"+self.name
+
     def check_comp_config( self ):
         "Check for any previous configurations and adjust if necessary."
-        # TODO: Implement me.
-        pass
+        config = self.read_comp_config()
+        if config is None:
+            return
+        self._enabled = config.get("enabled", self._enabled)
+        if self._vm_dist_limit is None:     # Explicit limit takes priority.
+            self._vm_dist_limit = config.get("vm_dist_limit")
+        if self._capacity is None:          # Explicit capacity too.
+            self._capacity = config.get("capacity")
 
     def update_comp_config( self ):
         "Update the configurations for this component."
-        # TODO: Implement me.
-        pass
+        if not self._have_comp_config:
+            return
+        config = {}
+        config["enabled"] = self._enabled
+        config["vm_dist_limit"] = self._vm_dist_limit
+        config["capacity"] = self.capacity
+        self.write_comp_config(config)
 
     def get_num_VMs( self ):
         "Return the number of VMs running on this hypervisor."
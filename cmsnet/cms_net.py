@@ -90,19 +90,31 @@
 import re
 import select
 import signal
-from time import sleep
+import sys
+from time import sleep, time
 from itertools import chain
 
 from mininet.cli import CLI
 from mininet.log import info, warn, error, debug, output
-from mininet.node import Host, Switch#, POXNormalSwitch
+from mininet.node import Host, Switch, OVSSwitch#, POXNormalSwitch
 from mininet.link import Link, Intf
 from mininet.util import quietRun, fixLimits, numCores, ensureRoot, moveIntf
 from mininet.util import macColonHex, ipStr, ipParse, netParse, ipAdd
+from mininet.util import parallelMap, natural, retry
 from mininet.term import cleanUpScreens, makeTerms
 from mininet.net import Mininet
 
 from cmsnet.cms_comp import CMSComponent, VirtualMachine, Hypervisor
+from cmsnet.cms_comp import RESOURCES
+from cmsnet.cms_store import CMSStore
+from cmsnet.cms_placement import PlacementEngine, HopTable
+from cmsnet.cms_rebalance import Rebalancer
+from cmsnet.cms_channel import ControllerChannel, EventCoalescer
+from cmsnet.cms_channel import EventJournal
+from functools import wraps
+from contextlib import contextmanager
+from threading import Lock, RLock
+from fnmatch import fnmatchcase
 import random
 import socket
 import json
@@ -114,30 +126,87 @@
 import cmsnet.cms_topo
 
 # Patching. REMOVE AFTER CHANGES TO MININET AND UNCOMMENT ABOVE EDIT.
-from cmsnet.mininet_node_patch import Dummy, POXNormalSwitch
+from cmsnet.mininet_node_patch import Dummy, POXNormalSwitch, OVSNormalSwitch
 
 
 # Mininet version: should be consistent with README and LICENSE
 VERSION = "2.0.0.i.x.beta"
 
+def isNamePattern( name ):
+    "Is name a range (vm1..vm9) or glob (vm*) pattern rather than a name?"
+    return '..' in name or any(c in name for c in '*?[')
+
+def expandNames( patterns, names=() ):
+    """Expand name patterns into a list of names.
+       patterns: name, range (vm1..vm500 or vm1..500) or shell-style glob
+                 (web*), or a list of these
+       names: existing names, matched against globs
+       Raises ValueError on malformed ranges."""
+    if isinstance(patterns, basestring):
+        patterns = patterns.split()
+    result = []
+    for pattern in patterns:
+        if '..' in pattern:
+            m = re.match(r'^(.*?)(\d+)\.\.(.*?)(\d+)$', pattern)
+            if not m or m.group(3) not in ('', m.group(1)):
+                raise ValueError('bad name range %s' % pattern)
+            prefix, start, end = m.group(1), int(m.group(2)), int(m.group(4))
+            if start > end:
+                raise ValueError('empty name range %s' % pattern)
+            result += ['%s%d' % (prefix, i) for i in xrange(start, end + 1)]
+        elif any(c in pattern for c in '*?['):
+            result += sorted((n for n in names if fnmatchcase(n, pattern)),
+                             key=natural)
+        else:
+            result.append(pattern)
+    return result
+
+def rarpFrame( mac ):
+    """Return the RARP request announcing mac that a VM broadcasts after a
+       migration (as QEMU does), padded to the minimum Ethernet size."""
+    hw = mac.replace(':', '').decode('hex')
+    frame = ('\xff' * 6 + hw + '\x80\x35' +          # Ethernet, RARP
+             '\x00\x01\x08\x00\x06\x04\x00\x03' +    # Request reverse
+             hw + '\x00' * 4 + hw + '\x00' * 4)
+    return frame + '\x00' * (60 - len(frame))
+
+def batched( method ):
+    """Decorator: serialize a CMSnet command (e.g. against the rebalancer
+       thread) and coalesce its config writes into one."""
+    @wraps( method )
+    def wrapper( self, *args, **kwargs ):
+        with self.lock:
+            if self.store is None:
+                return method( self, *args, **kwargs )
+            with self.store.batch():
+                return method( self, *args, **kwargs )
+    return wrapper
+
 class CMSnet( object ):
     "Network emulation with hosts spawned in network namespaces."
 
     def __init__( self, new_config=False, config_folder=".",
                   vm_dist_mode="random", vm_dist_limit=10, msg_level="all",
                   net_cls=Mininet, vm_cls=VirtualMachine, hv_cls=Hypervisor,
-                  controller_ip="127.0.0.1", controller_port=7790, **params):
+                  controller_ip="127.0.0.1", controller_port=7790,
+                  store_cls=CMSStore, migration_mode="classic",
+                  msg_coalesce=0.0, **params):
         """Create Mininet object.
            new_config: True if we are using brand new configurations.
            config_folder: Folder where configuration files are saved/loaded.
            vm_dist_mode: Mode of how VMs are distributed amongst hypervisors
-           vm_dist_limit: Limit of number of VMs on hypervisors in packed mode
+           vm_dist_limit: Limit of VMs on hypervisors in packed/tenant mode
            msg_level: CMS message handling level at controller
            net_cls: Mininet class.
            vm_cls: VM class.
            hv_cls: Hypervisor class.
            controller_ip = IP to connect to for the controller socket.
            controller_port = Port to connect to for the controller socket.
+           store_cls: State store class (None for one file per component).
+           migration_mode: How VM links are moved (see _moveIntf; mbb
+                           stages flows only on Open vSwitch hypervisors)
+           msg_coalesce: Time window (s) to collapse CMS messages of a VM
+                         into its net change (0 for none)
            params: extra paramters for Mininet"""
         self.new_config = new_config
         self.config_folder = config_folder
@@ -149,15 +218,37 @@ def __init__( self, new_config=False, config_folder=".",
         self.hv_cls = hv_cls
         self.controller_ip = controller_ip
         self.controller_port = controller_port
+        self.migration_mode = migration_mode
+        self.msg_coalesce = msg_coalesce
         self.params = params
 
         self.VMs = []
         self.HVs = []
         self.nameToComp = {}   # name to CMSComponent (VM/HV) objects 
+        self.tenantToVMs = {}  # tenant ID to dict of VM names to VMs
+        self.runningVMs = {}   # name to VMs running on some hypervisor
+        self.inactiveVMs = {}  # name to VMs created but not running
         self.last_HV = None
-        self.controller_socket = None
+        self.controller_channel = None
+        self.coalescer = None
+        self.journal = EventJournal()
+        self.send_lock = Lock()  # Keeps journal and wire in seq order
+        self.sync_timeout = 2.0  # Time for the controller to answer hello
+        self.nodeToLock = {}   # Node to lock serializing its link changes
+        self.linkLock = RLock()  # Held while intf/port/link tables change
+        self.mbb_priority = 0xfff0  # Priority of flows staged by mbb mode
+        self.mbb_timeout = 10       # Hard timeout (s) of flows staged by mbb
+        self.mbb_garp_count = 2     # Gratuitous ARPs (and RARPs) after a move
+        self.lock = RLock()    # Serializes CMSnet commands (see batched)
+        self.placement = PlacementEngine(self.isHVFull)
+        self.hop_table = HopTable()
+        self.forgetting = []   # Learning switches that forget moved VMs
+        self.learning = False  # Whether moved VMs must announce themselves
+        self.rebalancer = Rebalancer(self)
         self.possible_modes = CMSnet.getPossibleVMDistModes()
         self.possible_levels = CMSnet.getPossibleCMSMsgLevels()
+        self.possible_migration_modes = CMSnet.getPossibleMigrationModes()
+        self.store = store_cls(config_folder) if store_cls else None
 
         if not self.new_config:
             self.check_net_config()
@@ -193,7 +284,7 @@ def __len__( self ):
 
     def __contains__( self, item ):
         "returns True if net contains named component"
-        return item in self.keys()
+        return item in self.nameToComp
 
     def keys( self ):
         "return a list of all component names or net's keys"
@@ -201,11 +292,47 @@ def keys( self ):
 
     def values( self ):
         "return a list of all components or net's values"
-        return [ self[name] for name in self.__iter__() ]
+        return list( chain( self.VMs, self.HVs ) )
 
     def items( self ):
         "return (key,value) tuple list for every component in net"
-        return zip( self.keys(), self.values() )
+        return [ ( comp.name, comp ) for comp in self.values() ]
+
+    # Secondary VM indexes, kept up to date by the lifecycle commands.
+    # (VMs by hypervisor are kept in Hypervisor.nameToVMs.)
+
+    def _indexVM( self, vm ):
+        "Add VM to the tenant and running/inactive indexes."
+        self.tenantToVMs.setdefault(vm.tenant_id, {})[vm.name] = vm
+        if vm.is_running():
+            self.runningVMs[vm.name] = vm
+        else:
+            self.inactiveVMs[vm.name] = vm
+
+    def _unindexVM( self, vm ):
+        "Remove VM from the tenant and running/inactive indexes."
+        tenant_VMs = self.tenantToVMs.get(vm.tenant_id, {})
+        tenant_VMs.pop(vm.name, None)
+        if not tenant_VMs:
+            self.tenantToVMs.pop(vm.tenant_id, None)
+        self.runningVMs.pop(vm.name, None)
+        self.inactiveVMs.pop(vm.name, None)
+
+    def getVMsByHV( self, hv_name ):
+        "Return list of VMs running on the named hypervisor."
+        return self.nameToComp[ hv_name ].nameToVMs.values()
+
+    def getVMsByTenant( self, tenant_id ):
+        "Return list of VMs belonging to a tenant."
+        return self.tenantToVMs.get(tenant_id, {}).values()
+
+    def getRunningVMs( self ):
+        "Return list of VMs running on some hypervisor."
+        return self.runningVMs.values()
+
+    def getInactiveVMs( self ):
+        "Return list of VMs that are created but not running."
+        return self.inactiveVMs.values()
 
 
 
@@ -218,17 +345,22 @@ def start( self ):
         self._tempStartDummy()
         self.mn.start()
         self.get_hypervisors()
+        self.build_hop_table()
+        self.find_learning_switches()
         self.get_old_VMs()
         self.setup_controller_connection()
 
     def stop( self ):
         "Stop Mininet, VMs, and the connection to the controller."
+        self.rebalancer.stop()
         self.close_controller_connection()
         info( '*** Stopping %i VMs\n' % len( self.VMs ) )
         for vm in self.VMs:
             vm.shutdown()
         self.mn.stop()
         self._tempStopDummy()
+        if self.store:
+            self.store.close()
 
     def run( self, test, *args, **kwargs ):
         "Perform a complete start/test/stop cycle."
@@ -238,46 +370,66 @@ def run( self, test, *args, **kwargs ):
         self.stop()
         return result
 
-    def check_net_config( self ):
-        "Check for any previous CMSnet configurations and adjust if necessary."
+    def read_net_config( self ):
+        "Return the saved CMSnet configuration dict, or None if none."
+        if self.store:
+            return self.store.get("cmsnet")
         try:
             with open(self.config_folder+"/cn.config_cmsnet", "r") as f:
                 config_raw = f.read()
-                config = {}
-                if config_raw:
-                    config, l = defaultDecoder.raw_decode(config_raw)
-                for attr in config:
-                    if attr.startswith("topo"):       # Handle separately.
-                        pass
-                    elif attr == "net_cls":
-                        cls = getattr(mininet.net, config[attr])
-                        setattr(self, attr, cls)
-                    elif attr.endswith("cls"):
-                        cls = getattr(cmsnet.cms_comp, config[attr])
-                        setattr(self, attr, cls)
-                    elif isinstance(config[attr], basestring):
-                        setattr(self, attr, str(config[attr]))
-                    else:
-                        setattr(self, attr, config[attr])
-                topo_cls_name = config.get("topo_cls")
-                if topo_cls_name:
-                    topo_cls = getattr(cmsnet.cms_topo, topo_cls_name)
-                    topo_opts = config.get("topo_opts", {})
-                    topo = topo_cls(**topo_opts)
-                    self.params.update({'topo': topo})
-                else:
-                    warn("\nNo topology exists for CMSnet\n")
-                f.close()                
         except IOError as e:
+            return None
+        config = {}
+        if config_raw:
+            config, l = defaultDecoder.raw_decode(config_raw)
+        return config
+
+    def write_net_config( self, config ):
+        "Save the CMSnet configuration dict."
+        if self.store:
+            self.store.put("cmsnet", config)
+            return
+        f = open(self.config_folder+"/cn.config_cmsnet", "w")
+        f.write(json.dumps(config))
+        f.flush()
+        f.close()
+
+    def check_net_config( self ):
+        "Check for any previous CMSnet configurations and adjust if necessary."
+        config = self.read_net_config()
+        if config is None:
             info("\nNo config exists for CMSnet\n")
+            return
+        for attr in config:
+            if attr.startswith("topo"):       # Handle separately.
+                pass
+            elif attr == "net_cls":
+                cls = getattr(mininet.net, config[attr])
+                setattr(self, attr, cls)
+            elif attr.endswith("cls"):
+                cls = getattr(cmsnet.cms_comp, config[attr])
+                setattr(self, attr, cls)
+            elif isinstance(config[attr], basestring):
+                setattr(self, attr, str(config[attr]))
+            else:
+                setattr(self, attr, config[attr])
+        topo_cls_name = config.get("topo_cls")
+        if topo_cls_name:
+            topo_cls = getattr(cmsnet.cms_topo, topo_cls_name)
+            topo_opts = config.get("topo_opts", {})
+            topo = topo_cls(**topo_opts)
+            self.params.update({'topo': topo})
+        else:
+            warn("\nNo topology exists for CMSnet\n")
 
     def update_net_config( self ):
-        "Update the CMSnet configurations file."
-        f = open(self.config_folder+"/cn.config_cmsnet", "w")
+        "Update the CMSnet configurations."
         config = {}
         config["vm_dist_mode"] = self.vm_dist_mode
         config["vm_dist_limit"] = self.vm_dist_limit
         config["msg_level"] = self.msg_level
+        config["migration_mode"] = self.migration_mode
+        config["msg_coalesce"] = self.msg_coalesce
         config["net_cls"] = self.net_cls.__name__
         config["vm_cls"] = self.vm_cls.__name__
         config["hv_cls"] = self.hv_cls.__name__
@@ -286,18 +438,11 @@ def update_net_config( self ):
 
         topo = self.mn.topo
         if topo:
-            topo_opts = {}
-            topo_opts["hv_num"] = topo.hv_num
-            topo_opts["fb_num"] = topo.fb_num
-            topo_opts["hopts"] = topo.hopts
-            topo_opts["sopts"] = topo.sopts
-            topo_opts["lopts"] = topo.lopts
+            topo_opts = topo.topoOpts()
             config["topo_cls"] = topo.__class__.__name__
             config["topo_opts"] = topo_opts
 
-        f.write(json.dumps(config))
-        f.flush()
-        f.close()
+        self.write_net_config(config)
 
     def get_hypervisors( self ):
         "Collect all hypervisors."
@@ -309,70 +454,325 @@ def get_hypervisors( self ):
             assert hasattr(self.mn.topo, 'hvSwitches')
             for hv_name in self.mn.topo.hvSwitches():
                 sw = self.mn.nameToNode[hv_name]
-                hv = self.hv_cls(sw, self.config_folder)
+                hv = self.hv_cls(sw, self.config_folder, store=self.store)
                 self.HVs.append(hv)
                 self.nameToComp[ hv_name ] = hv
+                self.placement.add(hv)
         else:
             print "Sorry, we don't support hacky approaches. Muahaha!"
             print "Please leave a topo after the beep. BEEEEEEEP!"
 
-    def get_old_VMs( self ):
-        "Collect all previously saved VMs."
+    def build_hop_table( self ):
+        "Precompute hop distances between hypervisors (tenant mode)."
+        switches = set(self.mn.switches)
+        links = [tuple(pair) for pair in self.mn.nodePairToLinks
+                 if len(pair) == 2 and pair <= switches]
+        self.hop_table.build(self.HVs, links)
+
+    def find_learning_switches( self ):
+        "Find the switches that _forgetVM has to work on."
+        learning = [switch for switch in self.mn.switches
+                    if isinstance(switch, OVSNormalSwitch)]
+        self.forgetting = [switch for switch in learning if switch.forgets]
+        self.learning = bool(learning)
+
+    def get_saved_VM_names( self ):
+        "Return names of all previously saved VMs."
+        if self.store:
+            return [key[len("vm/"):] for key in self.store.keys("vm/")]
         # I want to use glob here instead...
         #     http://stackoverflow.com/questions/3207219/
         # Well, this works too.
         #     http://stackoverflow.com/questions/3964681/
+        return [file_name[:-10] for file_name in os.listdir(self.config_folder)
+                if file_name.endswith(".config_vm")]
+
+    def read_saved_VM_configs( self ):
+        "Return [(vm_name, config)] for all previously saved VMs."
+        configs = []
+        for vm_name in self.get_saved_VM_names():
+            if self.store:
+                config = self.store.get("vm/"+vm_name)
+            else:
+                try:
+                    with open(self.config_folder+"/"+vm_name+".config_vm") as f:
+                        config_raw = f.read()
+                    config = {}
+                    if config_raw:
+                        config, l = defaultDecoder.raw_decode(config_raw)
+                except IOError as e:
+                    config = None
+            configs.append((vm_name, config or {}))
+        return configs
+
+    @batched
+    def get_old_VMs( self, workers=None ):
+        """Collect all previously saved VMs.
+           Resumes in phases: read all saved state, start all hosts
+           concurrently, wire each VM straight to its saved hypervisor
+           (or the dummy if it was not running), configure the hosts
+           concurrently and finally create the VM components.
+           workers: number of concurrent host operations (optional)"""
         err = False
-        for file_name in os.listdir(self.config_folder):
-            if file_name.endswith(".config_vm"):
-                vm_name = file_name[:-10]
-                self.createVM(vm_name)
-                vm = self.nameToComp[ vm_name ]
-                if vm.config_hv_name:
-                    self.launchVM( vm_name, vm.config_hv_name )
-                    if not vm.is_running():
-                        err = True
+        dummy = self.mn.nameToNode.get("dummy")
+        times = [time()]
+
+        # Phase 1: Read all saved state.
+        configs = self.read_saved_VM_configs()
+        if not configs:
+            return
+        info('*** Resuming %i VMs\n' % len(configs))
+        times.append(time())
+
+        # Phase 2: Start all hosts.
+        hosts = []
+        for vm_name, config in configs:
+            params = {}
+            if config.get("MAC"):
+                params["mac"] = str(config["MAC"])
+            if config.get("IP"):
+                ip = str(config["IP"])
+                params["ip"] = ip if "/" in ip else "%s/%s" % (ip,
+                                                     self.mn.prefixLen)
+            hosts.append((vm_name, params))
+        hosts = self.mn.addHosts(hosts, workers=workers)
+        times.append(time())
+
+        # Phase 3: Wire VMs to hypervisors, one hypervisor per worker.
+        nodeToHosts = {}
+        vm_hvs = []
+        for host, (vm_name, config) in zip(hosts, configs):
+            hv = self.nameToComp.get(config.get("config_hv_name"))
+            if config.get("config_hv_name") and (
+                    not isinstance(hv, Hypervisor) or not hv.is_enabled()):
+                error("\nCannot resume %s on hypervisor %s\n" %
+                      (vm_name, config.get("config_hv_name")))
+                err = True
+                hv = None
+            vm_hvs.append(hv)
+            node = hv.node if hv else dummy
+            nodeToHosts.setdefault(node, []).append(host)
+
+        def wire( item ):
+            "Link hosts to a single hypervisor switch (or the dummy)."
+            node, node_hosts = item
+            intfs = []
+            for host in node_hosts:
+                link = self.mn.addLink(host, node)
+                intfs.append(link.intf2)
+            if hasattr(node, 'attachIntfs'):
+                node.attachIntfs(intfs)
+            elif hasattr(node, 'attach'):
+                for intf in intfs:
+                    node.attach(intf)
+
+        parallelMap(wire, nodeToHosts.items(), workers)
+        times.append(time())
+
+        # Phase 4: Configure hosts.
+        def configure( host ):
+            "Configure a single host."
+            host.configDefault()
+            host.cmd('ifconfig lo up')
+
+        parallelMap(configure, hosts, workers)
+        if self.mn.xterms:
+            self.mn.terms += makeTerms(hosts, 'host')
+        if self.mn.autoStaticArp:
+            self.mn.staticArp()
+        times.append(time())
+
+        # Phase 5: Create VM components and restore running state.
+        for host, hv in zip(hosts, vm_hvs):
+            vm = self.vm_cls(host, self.config_folder, store=self.store)
+            self.VMs.append(vm)
+            self.nameToComp[ vm.name ] = vm
+            if hv:
+                vm.launch(hv)
+                self.last_HV = hv
+                self.placement.update(hv)
+            self._indexVM(vm)
+        times.append(time())
+
+        phases = ["read", "hosts", "links", "config", "VMs"]
+        steps = ["%s %.2fs" % (phase, end - start) for phase, start, end in
+                 zip(phases, times[:-1], times[1:])]
+        info('*** Resumed %i VMs in %.2fs (%s)\n' %
+             (len(configs), times[-1] - times[0], ", ".join(steps)))
         if err:
             error("\nError occurred when resuming VMs!\n")
 
     def setup_controller_connection( self ):
-        "Start the connection to the controller."
-        # Change self.controller_socket from None to the actual socket.
-        try:
-            ip = self.controller_ip
-            port = self.controller_port
-            sock = socket.create_connection((ip, port))
-            self.controller_socket = sock
-        except Exception,e:
-            warn("\nCannot connect to controller: %s\n" % str(e))
+        """Start the connection to the controller. Messages are sent (and
+           the connection made and remade) in the background."""
+        self.controller_channel = ControllerChannel(
+            self.controller_ip, self.controller_port,
+            handshake=self._controller_handshake,
+            on_message=self._controller_message)
+        self.controller_channel.start()
+        self._setup_coalescer()
+
+    def _setup_coalescer( self ):
+        "(Re)create the coalescer of CMS messages for msg_coalesce."
+        if self.coalescer:
+            self.coalescer.stop()
+            self.coalescer = None
+        if self.msg_coalesce > 0:
+            self.coalescer = EventCoalescer(self.msg_coalesce,
+                                            self._send_events)
 
     def close_controller_connection( self ):
-        "Close the connection to the controller."
-        if self.controller_socket:
-            try:
-                self.controller_socket.shutdown(socket.SHUT_RDWR)
-            except:
-                pass  # If other side already shut down, leave it.
-            self.controller_socket.close()
-            self.controller_socket = None
-
-    def send_msg_to_controller(self, cmd_type, vm):
-        "Send a CMS message to the controller."
-        msg = {
-          'CHANNEL'   : 'CMS',
+        "Close the connection to the controller, after pending messages."
+        if self.coalescer:
+            self.coalescer.stop()
+            self.coalescer = None
+        if self.controller_channel:
+            self.controller_channel.stop()
+            self.controller_channel = None
+
+    def _vm_event(self, cmd_type, vm, new_hv_name=None, old_hv_name=None):
+        "Return the CMS message fields describing an event of a VM."
+        event = {
           'cmd'       : cmd_type,
-          'msg_level' : self.msg_level,
           'host'      : vm.name,
-          'new_hv'    : vm.hv_name
+          'new_hv'    : new_hv_name if new_hv_name else vm.hv_name,
+          'mac'       : vm.MAC,
+          'ip'        : vm.IP
         }
-        if self.controller_socket:
-            self.controller_socket.send(json.dumps(msg))
+        if old_hv_name:
+            event['old_hv'] = old_hv_name
+            event['old_dpid'] = self._hvDpid(old_hv_name)
+        event['dpid'] = self._hvDpid(event['new_hv'])
+        port = self._vmPort(vm, event['new_hv'])
+        if port is not None:
+            event['port'] = port
+        return event
+
+    def _hvDpid(self, hv_name):
+        "Return the datapath ID (hex string) of a hypervisor, or None."
+        hv = self.nameToComp.get(hv_name) if hv_name else None
+        return getattr(getattr(hv, 'node', None), 'dpid', None)
+
+    def _vmPort(self, vm, hv_name):
+        "Return the port of the VM on hypervisor hv_name, or None if not there."
+        intf = self.mn.peerIntf(vm.node.defaultIntf())
+        if intf is None or intf.node.name != hv_name:
+            return None
+        return intf.node.ports.get(intf)
+
+    def _controller_handshake(self, send, read):
+        """
+        Catch the controller up on a new connection, before any other
+        message: say hello with our last sequence number, and on its sync
+        (with the last sequence number it acknowledged, or none), send it
+        the journal events after that one, or a snapshot of the VM
+        locations if the journal does not have them all. A controller not
+        answering within sync_timeout is not caught up.
+        """
+        send({'CHANNEL': 'CMS', 'cmd': 'hello', 'seq': self.journal.seq})
+        deadline = time() + self.sync_timeout
+        while True:
+            msg = read(max(0.0, deadline - time()))
+            if msg is None:
+                warn("\nNo sync from controller; not catching it up\n")
+                return
+            if isinstance(msg, dict) and msg.get('cmd') == 'sync':
+                break               # Skip anything else (e.g. welcome).
+        last_seq = msg.get('last_seq')
+        events = self.journal.since(last_seq)
+        if events is None:
+            seq = self.journal.seq
+            send({'CHANNEL': 'CMS', 'cmd': 'snapshot', 'seq': seq,
+                  'msg_level': self.msg_level, 'vms': self._vm_locations()})
+            self.journal.ack(seq)
+            info("*** Sent controller a snapshot (seq %i)\n" % seq)
+        elif events:
+            send({'CHANNEL': 'CMS', 'cmd': 'batch', 'replay': True,
+                  'msg_level': self.msg_level, 'events': events})
+            info("*** Replayed %i events to controller\n" % len(events))
+
+    def _controller_message(self, msg):
+        "Handle a message from the controller (acknowledgments)."
+        if isinstance(msg, dict) and msg.get('cmd') == 'ack':
+            self.journal.ack(int(msg['seq']))
+
+    def _vm_locations(self):
+        "Return the location (hv, mac, ip) of every running VM."
+        return [{'host': vm.name, 'hv': vm.hv_name, 'mac': vm.MAC,
+                 'ip': vm.IP, 'dpid': self._hvDpid(vm.hv_name),
+                 'port': self._vmPort(vm, vm.hv_name)}
+                for vm in self.runningVMs.values()]
+
+    def _msg_level_wants(self, cmd_type):
+        "Test if the CMS message level lets events of a type through."
+        if self.msg_level == "all":
+            return True
+        if cmd_type == "migrating":     # Part of a migration.
+            cmd_type = "migrated"
+        return cmd_type == self.msg_level
+
+    def _send_events(self, events):
+        """Journal VM events and send them to the controller, as one message.
+           Messages are queued in the order of their sequence numbers, as
+           the controller drops any event numbered below one it has seen."""
+        if not self.controller_channel or not events:
+            return
+        with self.send_lock:
+            self.journal.record(events)
+            if len(events) == 1:
+                msg = dict(events[0])
+            else:
+                msg = {'cmd': 'batch', 'events': events}
+            msg['CHANNEL'] = 'CMS'
+            msg['msg_level'] = self.msg_level
+            self.controller_channel.send(msg)
+
+    def _queue_events(self, events):
+        """Send VM events the message level lets through, collapsed first
+           if coalescing. Migrating events (make-before-break) are urgent:
+           they are never held, but still follow the events held before
+           them."""
+        events = [e for e in events if self._msg_level_wants(e['cmd'])]
+        if not self.coalescer:
+            self._send_events(events)
+            return
+        urgent = [e for e in events if e['cmd'] == 'migrating']
+        for e in events:
+            if e['cmd'] != 'migrating':
+                self.coalescer.add(e)
+        if urgent:
+            self.coalescer.flush(urgent)
+
+    def send_msg_to_controller(self, cmd_type, vm, new_hv_name=None,
+                               old_hv_name=None):
+        "Send a CMS message to the controller."
+        if not self.controller_channel or \
+           not self._msg_level_wants(cmd_type):
+            return          # Dropped before building and serializing.
+        self._queue_events([self._vm_event(cmd_type, vm, new_hv_name,
+                                           old_hv_name)])
+
+    def send_batch_to_controller(self, cmd_type, vms, old_hv_names=None):
+        "Send one CMS message to the controller for a batch of VMs."
+        if not self.controller_channel or \
+           not self._msg_level_wants(cmd_type):
+            return          # Dropped before building and serializing.
+        if old_hv_names is None:
+            old_hv_names = [None] * len(vms)
+        self._queue_events([self._vm_event(cmd_type, vm,
+                                           old_hv_name=old_hv_name)
+                            for vm, old_hv_name in zip(vms, old_hv_names)])
 
     @classmethod
     def getPossibleCMSMsgLevels( cls ):
         "Dynamically obtain all possible message levels for the controller."
         return ["all", "instantiated", "migrated", "destroyed", "none"]
 
+    @classmethod
+    def getPossibleMigrationModes( cls ):
+        "Obtain all possible modes of moving VM links (see _moveIntf)."
+        return ["classic", "fast", "mbb"]
+
 
 
 
@@ -392,33 +792,35 @@ def get_hypervisors_beta( self ):
         for node_name in self.mn.nameToNode:
             node = self.mn.nameToNode[node_name]
             if node.params.get("cms_type") == "hypervisor":
-                hv = self.hv_cls( node, self.config_folder)
+                hv = self.hv_cls( node, self.config_folder, store=self.store)
                 self.HVs.append(hv)
                 self.nameToComp[ node_name ] = hv
+                self.placement.add(hv)
 
     def addHVSwitch( self, name, cls=None, **params ):
         """Add HV-switch. FOR TESTING PURPOSES ONLY.
            name: name of switch to add
            cls: custom switch class/constructor (optional)
            returns: added switch
-           side effect: params has extra parameter cmsnet."""
-        if self.built:
+           side effect: params has extra parameter cms_type."""
+        if self.mn.built:
             error("Cannot add switch; Mininet already built.")
             return
-        params.update({"cms_net": "hypervisor"})
+        params.update({"cms_type": "hypervisor"})
         return self.mn.addSwitch(name, cls=cls, **params)
 
-    def addFabricSwitch( self, name, **params ):
+    def addFabricSwitch( self, name, cls=POXNormalSwitch, **params ):
         """Add fabric-switch. FOR TESTING PURPOSES ONLY.
            name: name of switch to add
-           cls: custom switch class/constructor (optional)
+           cls: custom switch class/constructor (optional; OVSNormalSwitch
+                for a kernel datapath fabric)
            returns: added switch
-           side effect: params has extra parameter cmsnet."""
-        if self.built:
+           side effect: params has extra parameter cms_type."""
+        if self.mn.built:
             error("Cannot add switch; Mininet already built.")
             return
-        params.update({"cms_net": "fabric", "cls": POXNormalSwitch})
-        return self.mn.addSwitch(name, **params)
+        params.update({"cms_type": "fabric"})
+        return self.mn.addSwitch(name, cls=cls, **params)
 
 
 
@@ -431,18 +833,22 @@ def addFabricSwitch( self, name, **params ):
     # CMS VM Distribution Mode Handling
     #~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
 
-    def _getNextDefaultHVName( self ):
-        "Using the distribution mode, get the next default hv_name"
+    def _getNextDefaultHVName( self, vm=None, vm_dist_mode=None ):
+        """Using the distribution mode, get the next default hv_name
+           vm: VM to be placed (used by the resource-aware modes)
+           vm_dist_mode: Mode to use instead of the current one (optional)"""
         if len(self.HVs) == 0:
             error_msg = "No hypervisor exists"
             error("\nCannot get hv_name: %s.\n" % error_msg)
             return
-        vm_dist_handler = getattr(self, "_vm_dist_" + self.vm_dist_mode, None)
+        if not vm_dist_mode:
+            vm_dist_mode = self.vm_dist_mode
+        vm_dist_handler = getattr(self, "_vm_dist_" + vm_dist_mode, None)
         if not vm_dist_handler:
-            error_msg = "VM distribution mode %s invalid" % self.vm_dist_mode
+            error_msg = "VM distribution mode %s invalid" % vm_dist_mode
             error("\nCannot get hv_name: %s.\n" % error_msg)
             return
-        hv_name = vm_dist_handler()
+        hv_name = vm_dist_handler(vm)
         return hv_name
 
     @classmethod
@@ -461,7 +867,7 @@ def getPossibleVMDistModes( cls ):
         return dist_mode_names
 
     def isHVFull( self, hv ):
-        "Check if hypervisor has reached its VM capacity limit (packed mode)."
+        "Check if HV has reached its VM capacity limit (packed/tenant mode)."
         hv_limit = hv.vm_dist_limit
         limit = hv_limit if hv_limit else self.vm_dist_limit
         return len(hv.nameToVMs) >= limit
@@ -482,66 +888,143 @@ def _efficientPackedDistMode( self ):
             return
         return hv_name
 
-    def _vm_dist_random( self ):
-        "Choose a random HV."
-        rand_hv = random.choice(self.HVs)
-        return rand_hv.name
-
-    def _vm_dist_sparse( self ):
-        "Choose HVs sparsely and evenly."
-        min_hv = min(self.HVs, key=lambda hv: len(hv.nameToVMs))
-        return min_hv.name
-
-    def _vm_dist_packed( self ):
-        "Choose HVs so that VMs are packed together."
-        # return self._efficientPackedDistMode()
-        avail_hvs = [hv for hv in self.HVs if not self.isHVFull(hv)]
-        if len(avail_hvs) == 0:
+    def _placed_name( self, hv ):
+        "Return name of hv chosen by the placement engine, or report error."
+        if hv is None:
             error_msg = "No hypervisor is available"
             error("\nCannot get hv_name: %s.\n" % error_msg)
             return
-        max_hv = max(avail_hvs, key=lambda hv: len(hv.nameToVMs))
-        return max_hv.name
+        return hv.name
 
-    def _vm_dist_same( self ):
-        "Choose an HV the same as the last chosen one."
+    def _check_last_HV( self ):
+        "Check that a hypervisor was last chosen, or report error."
         if not self.last_HV:
             error_msg = "No hypervisor last chosen"
             error("\nCannot get hv_name: %s.\n" % error_msg)
+            return False
+        return True
+
+    def _vm_dist_random( self, vm=None ):
+        "Choose a random HV."
+        return self._placed_name(self.placement.random())
+
+    def _vm_dist_sparse( self, vm=None ):
+        "Choose HVs sparsely and evenly."
+        return self._placed_name(self.placement.sparse())
+
+    def _vm_dist_packed( self, vm=None ):
+        "Choose HVs so that VMs are packed together."
+        return self._placed_name(self.placement.packed())
+
+    def _vm_dist_same( self, vm=None ):
+        "Choose an HV the same as the last chosen one."
+        if not self._check_last_HV():
             return
-        same_hv = self.last_HV
-        return same_hv.name
+        same_hv = self.last_HV if self.last_HV.is_enabled() else None
+        return self._placed_name(same_hv)
 
-    def _vm_dist_different( self ):
+    def _vm_dist_different( self, vm=None ):
         "Choose a random HV different from the last chosen one."
-        if not self.last_HV:
-            error_msg = "No hypervisor last chosen"
-            error("\nCannot get hv_name: %s.\n" % error_msg)
+        if not self._check_last_HV():
             return
-        diff_hv = random.choice([hv for hv in self.HVs if hv != self.last_HV])
-        return diff_hv.name
+        return self._placed_name(self.placement.different(self.last_HV))
 
-    def _vm_dist_next( self ):
+    def _vm_dist_next( self, vm=None ):
         "Choose HVs in a cycle."
-        if not self.last_HV:
-            error_msg = "No hypervisor last chosen"
-            error("\nCannot get hv_name: %s.\n" % error_msg)
+        if not self._check_last_HV():
             return
-        last_hv_index = self.HVs.index(self.last_HV)
-        next_hv_index = (last_hv_index + 1) % len(self.HVs)
-        next_hv = self.HVs[next_hv_index]
-        return next_hv.name
+        return self._placed_name(self.placement.next(self.last_HV))
 
-    def _vm_dist_previous( self ):
+    def _vm_dist_previous( self, vm=None ):
         "Choose HVs in a cycle, rotating in reverse."
-        if not self.last_HV:
-            error_msg = "No hypervisor last chosen"
-            error("\nCannot get hv_name: %s.\n" % error_msg)
+        if not self._check_last_HV():
             return
-        last_hv_index = self.HVs.index(self.last_HV)
-        prev_hv_index = (last_hv_index - 1) % len(self.HVs)
-        prev_hv = self.HVs[prev_hv_index]
-        return prev_hv.name
+        return self._placed_name(self.placement.previous(self.last_HV))
+
+    def _vm_dist_tenant( self, vm=None ):
+        """Choose the HV closest to the running VMs of the same tenant, i.e.
+           with the fewest fabric hops summed over those VMs. Co-locates a
+           tenant until its HVs are full (see isHVFull), then spills over to
+           the nearest HVs. VMs of new tenants are spread as in sparse."""
+        if vm is None:
+            return self._vm_dist_sparse()
+        tenant_HVs = {}      # HV to number of tenant VMs on it
+        for peer in self.tenantToVMs.get(vm.tenant_id, {}).values():
+            if peer.hv is not None and peer is not vm:
+                tenant_HVs[peer.hv] = tenant_HVs.get(peer.hv, 0) + 1
+        if not tenant_HVs:
+            return self._vm_dist_sparse(vm)
+        distance = self.hop_table.distance
+        best = None
+        for hv in self._fitting_HVs(vm):
+            if self.isHVFull(hv):
+                continue
+            cost = sum(num * distance(hv, peer_hv)
+                       for peer_hv, num in tenant_HVs.items())
+            key = (cost, len(hv.nameToVMs))
+            if best is None or key < best[0]:
+                best = (key, hv)
+        return self._placed_name(best[1] if best else None)
+
+    def _resource_scale( self ):
+        "Return the largest capacity of each resource over enabled HVs."
+        scale = {}
+        for hv in self.placement.enabled_HVs():
+            for r, c in hv.capacity.items():
+                scale[r] = max(scale.get(r, 0), c)
+        return scale
+
+    def _demand_size( self, demand, scale ):
+        "Return the size of a demand, normalized by the resource scale."
+        return sum(float(v) / scale[r] for r, v in demand.items()
+                   if scale.get(r))
+
+    def _fitting_HVs( self, vm ):
+        "Iterator: return enabled HVs with enough free capacity for vm."
+        demand = vm.demand if vm else {}
+        for hv in self.placement.enabled_HVs():
+            if hv.fits(demand):
+                yield hv
+
+    def _vm_dist_ffd( self, vm=None ):
+        """Choose the first HV with enough free capacity (first-fit). Bulk
+           launches place the largest demands first (first-fit decreasing)."""
+        hv = next(self._fitting_HVs(vm), None)
+        return self._placed_name(hv)
+
+    def _vm_dist_bestfit( self, vm=None ):
+        "Choose the HV with the least free capacity left after placement."
+        demand = vm.demand if vm else {}
+        def slack( hv ):
+            "Normalized free capacity left (unlimited resources count 1)."
+            free = hv.free()
+            return sum(float(free[r] - demand.get(r, 0)) / hv.capacity[r]
+                       if hv.capacity.get(r) else 1.0 for r in RESOURCES)
+        best = None
+        for hv in self._fitting_HVs(vm):
+            hv_slack = slack(hv)
+            if best is None or hv_slack < best[0]:
+                best = (hv_slack, hv)
+        return self._placed_name(best[1] if best else None)
+
+    def _vm_dist_dotproduct( self, vm=None ):
+        """Choose the HV whose free capacity best aligns with the demand
+           (largest dot product of normalized demand and free capacity)."""
+        demand = vm.demand if vm else {}
+        scale = self._resource_scale()
+        def alignment( hv ):
+            "Dot product of normalized demand and normalized free capacity."
+            free = hv.free()
+            return sum(float(v) / scale[r] *
+                       (float(free[r]) / hv.capacity[r]
+                        if hv.capacity.get(r) else 1.0)
+                       for r, v in demand.items() if scale.get(r))
+        best = None
+        for hv in self._fitting_HVs(vm):
+            hv_alignment = alignment(hv)
+            if best is None or hv_alignment > best[0]:
+                best = (hv_alignment, hv)
+        return self._placed_name(best[1] if best else None)
 
 
 
@@ -561,6 +1044,7 @@ def not_implemented( self ):
 
 
 
+    @batched
     def createVM( self, vm_name, vm_script=None, vm_cls=None, **params ):
         "Create a virtual machine image."
         if self.debug_flag1:
@@ -575,12 +1059,14 @@ def createVM( self, vm_name, vm_script=None, vm_cls=None, **params ):
         host = self._createHostAtDummy(vm_name, **params)
         if not vm_cls:
             vm_cls = self.vm_cls
-        vm = vm_cls(host, self.config_folder)
+        vm = vm_cls(host, self.config_folder, store=self.store)
         self.VMs.append(vm)
         self.nameToComp[ vm_name ] = vm
+        self._indexVM(vm)
 
         return vm
 
+    @batched
     def cloneVM( self, old_vm_name, new_vm_name=None ):
         "Clone a virtual machine image."
         if self.debug_flag1:
@@ -607,34 +1093,44 @@ def cloneVM( self, old_vm_name, new_vm_name=None ):
 
         new_vm = self.createVM(new_vm_name, vm_script, vm_cls, **params)
         assert isinstance(new_vm, VirtualMachine)
+        self._unindexVM(new_vm)    # Tenant changes on clone.
         old_vm.cloneTo(new_vm)     # Leave complexity in here.
+        self._indexVM(new_vm)
 
         return new_vm
 
+    @batched
     def launchVM( self, vm_name, hv_name=None ):
         "Initialize the created VM on a hypervisor."
         if self.debug_flag1:
             print "EXEC: launchVM(%s, %s):" % (vm_name, hv_name)
 
+        assert vm_name in self.nameToComp
+        vm = self.nameToComp.get(vm_name)
         if hv_name == None:
-            hv_name = self._getNextDefaultHVName()
+            hv_name = self._getNextDefaultHVName(vm)
             if hv_name == None:  # Some error occurred.
                 return           # Return and do nothing.
 
-        assert vm_name in self.nameToComp
         assert hv_name in self.nameToComp
-        vm = self.nameToComp.get(vm_name)
         hv = self.nameToComp.get(hv_name)
         assert isinstance(vm, VirtualMachine)
         assert isinstance(hv, Hypervisor)
         assert not vm.is_running()
         assert hv.is_enabled()
+        if not hv.fits(vm.demand):
+            warn("\nHypervisor %s overcommitted by VM %s\n" %
+                 (hv_name, vm_name))
 
         self._moveLink(vm.node, hv.node)
+        self._unindexVM(vm)
         vm.launch(hv)
+        self._indexVM(vm)
+        self.placement.update(hv)
         self.last_HV = hv
         self.send_msg_to_controller("instantiated", vm)
 
+    @batched
     def migrateVM( self, vm_name, hv_name ):
         "Migrate a running image to another hypervisor."
         if self.debug_flag1:
@@ -648,11 +1144,19 @@ def migrateVM( self, vm_name, hv_name ):
         assert isinstance(hv, Hypervisor) 
         assert vm.is_running()
         assert hv.is_enabled()
-
-        self._moveLink(vm.node, hv.node)
+        if not hv.fits(vm.demand):
+            warn("\nHypervisor %s overcommitted by VM %s\n" %
+                 (hv_name, vm_name))
+
+        old_hv = vm.hv
+        if self.migration_mode == "mbb":
+            self.send_msg_to_controller("migrating", vm, hv.name, old_hv.name)
+        self._migrateLink(vm, hv)
         vm.moveTo(hv)
-        self.send_msg_to_controller("migrated", vm)
+        self.placement.update(old_hv, hv)
+        self.send_msg_to_controller("migrated", vm, old_hv_name=old_hv.name)
 
+    @batched
     def stopVM( self, vm_name ):
         "Stop a running image."
         if self.debug_flag1:
@@ -663,10 +1167,18 @@ def stopVM( self, vm_name ):
         assert isinstance(vm, VirtualMachine)
         assert vm.is_running()
 
+        old_hv = vm.hv
+        self._unindexVM(vm)
         vm.stop()
+        self._indexVM(vm)
+        self.placement.update(old_hv)
         self._removeLink(vm.node)
-        self.send_msg_to_controller("destroyed", vm)
+        if self.migration_mode == "mbb":
+            with self._lockNodes(old_hv.node):
+                self._unstageFlows(vm, old_hv.node)
+        self.send_msg_to_controller("destroyed", vm, old_hv_name=old_hv.name)
 
+    @batched
     def deleteVM( self, vm_name ):
         "Remove the virtual machine image from the hypervisor."
         if self.debug_flag1:
@@ -684,10 +1196,12 @@ def deleteVM( self, vm_name ):
         vm = self.nameToComp[vm_name]
         self.VMs.remove(vm)
         del self.nameToComp[ vm_name ]
+        self._unindexVM(vm)
+        self.mn.unindexNode(vm.node)
         info( '*** Stopping host: %s\n' % vm_name ) 
         vm.node.terminate()
-        # Remove the file
-        os.remove(vm.get_config_file_name()) 
+        # Remove the saved configuration
+        vm.remove_comp_config()
 
         """
         # NOTE: many details on this one is hard to do, so
@@ -715,9 +1229,10 @@ def changeVMDistributionMode( self, vm_dist_mode, vm_dist_limit=None ):
         assert vm_dist_mode in self.possible_modes
 
         self.vm_dist_mode = vm_dist_mode
-        if vm_dist_mode == "packed" and vm_dist_limit:
+        if vm_dist_mode in ("packed", "tenant") and vm_dist_limit:
             assert vm_dist_limit > 0
             self.vm_dist_limit = vm_dist_limit
+            self.placement.rebuild()      # Full HVs may have changed.
         self.update_net_config()
 
     def changeCMSMsgLevel( self, msg_level ):
@@ -730,6 +1245,38 @@ def changeCMSMsgLevel( self, msg_level ):
         self.msg_level = msg_level
         self.update_net_config()
 
+    def changeMsgCoalesce( self, msg_coalesce ):
+        "Change the time window of collapsing CMS messages (0 for none)."
+        if self.debug_flag1:
+            print "EXEC: changeMsgCoalesce(%s):" % msg_coalesce
+
+        assert msg_coalesce >= 0
+
+        self.msg_coalesce = msg_coalesce
+        if self.controller_channel:
+            self._setup_coalescer()
+        self.update_net_config()
+
+    def changeMigrationMode( self, migration_mode ):
+        """Change the mode of moving VM links on launch/migrate/stop.
+           mbb mode stages flows for a moving VM only on Open vSwitch
+           hypervisors; on other (e.g. POX) hypervisors this is left to
+           the controller, which is told by "migrating" messages."""
+        if self.debug_flag1:
+            print "EXEC: changeMigrationMode(%s):" % migration_mode
+
+        assert migration_mode in self.possible_migration_modes
+        if migration_mode == "mbb":
+            others = [hv.name for hv in self.HVs
+                      if not isinstance(hv.node, OVSSwitch)]
+            if others:
+                warn("\nmbb: flows are not staged on hypervisors %s; the"
+                     " controller must stage them\n" % " ".join(others))
+
+        with self.lock:
+            self.migration_mode = migration_mode
+            self.update_net_config()
+
     def enableHV( self, hv_name ):
         "Enable a hypervisor."
         if self.debug_flag1:
@@ -741,6 +1288,7 @@ def enableHV( self, hv_name ):
         assert not hv.is_enabled()
 
         hv.enable()
+        self.placement.update(hv)
 
     def disableHV( self, hv_name ):
         "Disable a hypervisor."
@@ -753,6 +1301,327 @@ def disableHV( self, hv_name ):
         assert hv.is_enabled()
 
         hv.disable()
+        self.placement.update(hv)
+
+    def setHVCapacity( self, hv_name, **capacity ):
+        "Set the resource capacities of a hypervisor (see RESOURCES)."
+        if self.debug_flag1:
+            print "EXEC: setHVCapacity(%s, %s):" % (hv_name, capacity)
+
+        assert hv_name in self.nameToComp
+        hv = self.nameToComp.get(hv_name)
+        assert isinstance(hv, Hypervisor)
+
+        hv.capacity = capacity
+
+    def setVMDemand( self, vm_name, **demand ):
+        "Set the resource demands of a VM (see RESOURCES)."
+        if self.debug_flag1:
+            print "EXEC: setVMDemand(%s, %s):" % (vm_name, demand)
+
+        assert vm_name in self.nameToComp
+        vm = self.nameToComp.get(vm_name)
+        assert isinstance(vm, VirtualMachine)
+
+        hv = vm.hv
+        if hv:       # Check against usage without the VM's old demand.
+            over = [r for r, c in sorted(hv.capacity.items())
+                    if hv.usage.get(r, 0) - vm.demand.get(r, 0) +
+                    demand.get(r, 0) > c]
+            if over:
+                error_msg = ("%s demand does not fit in the free capacity"
+                             " of hypervisor %s" % ("/".join(over), hv.name))
+                error("\nCannot set demand of VM %s: %s.\n" %
+                      (vm_name, error_msg))
+                return
+        vm.demand = demand
+
+
+
+    #~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+    # CMS Bulk Commands
+    #~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+
+    """
+    NOTE: The bulk commands validate the whole batch before changing
+          anything, decide placement serially (distribution modes depend
+          on the current load), then do the slow namespace/link work
+          concurrently and send a single 'batch' message to the
+          controller. Concurrent link moves are serialized per switch by
+          _lockNodes(); outside classic mode the dummy is not locked
+          (each parked intf belongs to a single VM), so launching or
+          stopping VMs on distinct hypervisors overlaps.
+    """
+
+    def expandVMNames( self, patterns ):
+        "Expand VM name patterns (see expandNames) against existing VMs."
+        return expandNames(patterns, [vm.name for vm in self.VMs])
+
+    def _get_batch_HVs( self, hv_names, num ):
+        "Return list of num HV names (or Nones) from None, a name or a list."
+        if hv_names is None or isinstance(hv_names, basestring):
+            return [hv_names] * num
+        hv_names = list(hv_names)
+        assert len(hv_names) == num
+        return hv_names
+
+    @batched
+    def createVMs( self, vm_names, vm_cls=None, workers=None, **params ):
+        "Create many virtual machine images at once."
+        vm_names = self.expandVMNames(vm_names)
+        if self.debug_flag1:
+            print "EXEC: createVMs(%i VMs, %s):" % (len(vm_names), vm_cls)
+
+        assert len(set(vm_names)) == len(vm_names)
+        for vm_name in vm_names:
+            assert vm_name not in self.nameToComp
+            assert vm_name not in self.mn.nameToNode
+        assert not vm_cls or issubclass(vm_cls, VirtualMachine)
+        dummy = self.mn.nameToNode.get("dummy")
+        assert isinstance(dummy, Dummy)
+        if not vm_cls:
+            vm_cls = self.vm_cls
+
+        info( '*** Adding %i hosts\n' % len(vm_names) )
+        hosts = self.mn.addHosts([(vm_name, dict(params))
+                                  for vm_name in vm_names], workers=workers)
+        info( '*** Adding links to %s\n' % dummy.name )
+        for host in hosts:        # Single node; nothing to overlap.
+            self.mn.addLink(host, dummy)
+
+        def configure( host ):
+            "Configure a single host."
+            host.configDefault()
+            host.cmd('ifconfig lo up')
+
+        parallelMap(configure, hosts, workers)
+        if self.mn.xterms:
+            self.mn.terms += makeTerms(hosts, 'host')
+        if self.mn.autoStaticArp:
+            self.mn.staticArp()
+
+        vms = []
+        for host in hosts:
+            vm = vm_cls(host, self.config_folder, store=self.store)
+            self.VMs.append(vm)
+            self.nameToComp[ vm.name ] = vm
+            self._indexVM(vm)
+            vms.append(vm)
+        return vms
+
+    @batched
+    def launchVMs( self, vm_names, hv_names=None, workers=None ):
+        """Initialize many created VMs on hypervisors at once.
+           hv_names: None to use the distribution mode, a single HV name
+                     for all VMs, or a list with one HV name per VM"""
+        vm_names = self.expandVMNames(vm_names)
+        if self.debug_flag1:
+            print "EXEC: launchVMs(%i VMs, %s):" % (len(vm_names), hv_names)
+
+        hv_names = self._get_batch_HVs(hv_names, len(vm_names))
+        assert len(set(vm_names)) == len(vm_names)
+        vms = [self.nameToComp.get(vm_name) for vm_name in vm_names]
+        for vm in vms:
+            assert isinstance(vm, VirtualMachine)
+            assert not vm.is_running()
+        for hv_name in set(hv_names) - set([None]):
+            hv = self.nameToComp.get(hv_name)
+            assert isinstance(hv, Hypervisor)
+            assert hv.is_enabled()
+
+        # Phase A: Placement, in order, so that modes see earlier choices.
+        pending = zip(vms, hv_names)
+        if self.vm_dist_mode == "ffd":    # First-fit decreasing.
+            scale = self._resource_scale()
+            pending.sort(key=lambda p: self._demand_size(p[0].demand, scale),
+                         reverse=True)
+        placed = []
+        last_HV = self.last_HV
+        for vm, hv_name in pending:
+            if hv_name is None:
+                hv_name = self._getNextDefaultHVName(vm)
+            if hv_name is None:            # Some error occurred; undo.
+                old_hvs = set()
+                for placed_vm in placed:
+                    old_hvs.add(placed_vm.hv)
+                    placed_vm.stop(run_script=False)  # Releases demand.
+                self.placement.update(*old_hvs)
+                self.last_HV = last_HV
+                return []
+            hv = self.nameToComp[hv_name]
+            vm.launch(hv, run_script=False)
+            self.placement.update(hv)
+            self.last_HV = hv
+            placed.append(vm)
+
+        # Phase B: Move links and run start scripts concurrently.
+        def launch( vm ):
+            "Wire and start a single VM."
+            self._moveLink(vm.node, vm.hv.node)
+            vm.node.cmd(vm.start_script)
+
+        parallelMap(launch, vms, workers)
+        for vm in vms:
+            self._unindexVM(vm)
+            self._indexVM(vm)
+        self.send_batch_to_controller("instantiated", vms)
+        return vms
+
+    @batched
+    def migrateVMs( self, vm_names, hv_names, workers=None ):
+        """Migrate many running VMs at once.
+           hv_names: a single HV name for all VMs, or one HV name per VM"""
+        vm_names = self.expandVMNames(vm_names)
+        if self.debug_flag1:
+            print "EXEC: migrateVMs(%i VMs, %s):" % (len(vm_names), hv_names)
+
+        hv_names = self._get_batch_HVs(hv_names, len(vm_names))
+        assert len(set(vm_names)) == len(vm_names)
+        vms = [self.nameToComp.get(vm_name) for vm_name in vm_names]
+        hvs = [self.nameToComp.get(hv_name) for hv_name in hv_names]
+        for vm, hv in zip(vms, hvs):
+            assert isinstance(vm, VirtualMachine)
+            assert isinstance(hv, Hypervisor)
+            assert vm.is_running()
+            assert hv.is_enabled()
+
+        old_hv_names = [vm.hv_name for vm in vms]
+        for vm, hv in zip(vms, hvs):
+            old_hv = vm.hv
+            vm.moveTo(hv)
+            self.placement.update(old_hv, hv)
+        if self.migration_mode == "mbb":
+            self.send_batch_to_controller("migrating", vms, old_hv_names)
+        parallelMap(lambda vm: self._migrateLink(vm, vm.hv), vms, workers)
+        self.send_batch_to_controller("migrated", vms, old_hv_names)
+        return vms
+
+    @batched
+    def stopVMs( self, vm_names, workers=None ):
+        "Stop many running VMs at once."
+        vm_names = self.expandVMNames(vm_names)
+        if self.debug_flag1:
+            print "EXEC: stopVMs(%i VMs):" % len(vm_names)
+
+        assert len(set(vm_names)) == len(vm_names)
+        vms = [self.nameToComp.get(vm_name) for vm_name in vm_names]
+        for vm in vms:
+            assert isinstance(vm, VirtualMachine)
+            assert vm.is_running()
+
+        old_hv_names = [vm.hv.name for vm in vms]
+        for vm in vms:
+            old_hv = vm.hv
+            self._unindexVM(vm)
+            vm.stop(run_script=False)
+            self._indexVM(vm)
+            self.placement.update(old_hv)
+
+        def stop( vm ):
+            "Stop and unwire a single VM."
+            vm.node.cmd(vm.stop_script)
+            old_node = self.mn.peerIntf(vm.node.defaultIntf()).node
+            self._removeLink(vm.node)
+            if self.migration_mode == "mbb":
+                with self._lockNodes(old_node):
+                    self._unstageFlows(vm, old_node)
+
+        parallelMap(stop, vms, workers)
+        self.send_batch_to_controller("destroyed", vms, old_hv_names)
+        return vms
+
+    def expandHVNames( self, patterns ):
+        "Expand HV name patterns (see expandNames) against existing HVs."
+        return expandNames(patterns, [hv.name for hv in self.HVs])
+
+    @batched
+    def evictVMs( self, hv_names, policy=None, workers=None ):
+        """Migrate all VMs off hypervisors, concurrently.
+           hv_names: HV name patterns (see expandNames)
+           policy: distribution mode choosing the targets (default: current)
+           workers: maximum number of concurrent migrations
+           returns: dict with "vms" (migrated VM names), "stranded" (names
+                    of VMs left for lack of a target), "time" (total time)
+                    and "downtime" (VM name to time its link was down,
+                    from detaching it from the old hypervisor to attaching
+                    it to the new one; lock waits and switch updates
+                    around the move are not counted)"""
+        hv_names = self.expandHVNames(hv_names)
+        if self.debug_flag1:
+            print "EXEC: evictVMs(%s, %s):" % (hv_names, policy)
+
+        hvs = [self.nameToComp.get(hv_name) for hv_name in hv_names]
+        for hv in hvs:
+            assert isinstance(hv, Hypervisor)
+        assert not policy or policy in self.possible_modes
+        start_time = time()
+
+        # Pick targets one by one, so that the policy sees earlier choices.
+        # Evicted HVs must not be chosen again, so disable them meanwhile.
+        was_enabled = [hv for hv in hvs if hv.is_enabled()]
+        for hv in was_enabled:
+            hv.disable()
+            self.placement.update(hv)
+        vms = sorted((vm for hv in hvs for vm in hv.nameToVMs.values()),
+                     key=lambda vm: natural(vm.name))
+        moved = []
+        old_hv_names = []
+        stranded = []
+        try:
+            for vm in vms:
+                hv_name = self._getNextDefaultHVName(vm, policy)
+                if hv_name is None:
+                    stranded.append(vm)
+                    continue
+                hv = self.nameToComp[hv_name]
+                old_hv = vm.hv
+                vm.moveTo(hv)
+                self.placement.update(old_hv, hv)
+                self.last_HV = hv
+                moved.append(vm)
+                old_hv_names.append(old_hv.name)
+        finally:
+            for hv in was_enabled:
+                hv.enable()
+                self.placement.update(hv)
+
+        downtime = {}
+        def migrate( vm ):
+            "Move the link of a single VM, timing it."
+            down = self._migrateLink(vm, vm.hv)
+            if down is not None:
+                downtime[vm.name] = down
+
+        if self.migration_mode == "mbb":
+            self.send_batch_to_controller("migrating", moved, old_hv_names)
+        parallelMap(migrate, moved, workers)
+        self.send_batch_to_controller("migrated", moved, old_hv_names)
+        if stranded:
+            warn("\nNo target hypervisor for %i VMs: %s\n" %
+                 (len(stranded), " ".join(vm.name for vm in stranded)))
+        return {"vms": [vm.name for vm in moved],
+                "stranded": [vm.name for vm in stranded],
+                "time": time() - start_time,
+                "downtime": downtime}
+
+    @batched
+    def drainHV( self, hv_names, policy=None, workers=None ):
+        """Disable hypervisors and migrate all their VMs away, concurrently.
+           See evictVMs for the arguments and the returned report."""
+        hv_names = self.expandHVNames(hv_names)
+        if self.debug_flag1:
+            print "EXEC: drainHV(%s, %s):" % (hv_names, policy)
+
+        for hv_name in hv_names:
+            hv = self.nameToComp.get(hv_name)
+            assert isinstance(hv, Hypervisor)
+            if hv.is_enabled():
+                hv.disable()
+                self.placement.update(hv)
+        report = self.evictVMs(hv_names, policy, workers)
+        info("*** Drained %i hypervisors: %i VMs migrated in %.3f s\n" %
+             (len(hv_names), len(report["vms"]), report["time"]))
+        return report
 
 
 
@@ -889,6 +1758,78 @@ def _createHostAtDummy( self, hostName, **params ):
         
         return host
 
+    def _migrateLink( self, vm, hv ):
+        """
+        Move the link of a running VM to a hypervisor. In mbb (make before
+        break) mode, forwarding state for the VM is installed at the new
+        hypervisor before the move, the VM sends gratuitous ARP right after
+        it, and state for the VM at the old hypervisor is then removed.
+        (The controller is told beforehand by a "migrating" message.)
+
+        vm: Migrating VM.
+        hv: Destination hypervisor.
+        returns: time (s) the link was down (see _moveIntf), or None
+        """
+        if self.migration_mode != "mbb":
+            down = self._moveLink(vm.node, hv.node)
+            if self._forgetVM(vm):
+                self._announceVM(vm)
+            return down
+        old_node = self.mn.peerIntf(vm.node.defaultIntf()).node
+        if old_node is hv.node:
+            warn('connection already established\n')
+            return None
+        with self._lockNodes(old_node, hv.node):
+            # The fast path gives the intf the next port of hv.node.
+            self._stageFlows(vm, hv.node, hv.node.newPort())
+            down = self._moveLink(vm.node, hv.node)
+        self._forgetVM(vm)
+        self._announceVM(vm)
+        with self._lockNodes(old_node):
+            self._unstageFlows(vm, old_node)
+        return down
+
+    def _forgetVM( self, vm ):
+        """Make learning switches (OVSNormalSwitch) forget where a moved VM
+           was; a hub would simply have flooded to the new location.
+           Only switches with a forget() that does something are visited
+           (see find_learning_switches).
+           returns: True if there are learning switches, which also need
+                    the VM to announce itself (see _announceVM)"""
+        for switch in self.forgetting:
+            with self._lockNodes(switch):
+                switch.forget(vm.MAC)
+        return self.learning
+
+    def _stageFlows( self, vm, node, port ):
+        """Install a flow forwarding traffic for vm to port of an OVS node.
+           It expires after mbb_timeout, by which time the controller has
+           had the "migrated" message, even if it is never unstaged."""
+        if not isinstance(node, OVSSwitch):
+            return                # Left to the controller.
+        flow = 'priority=%d,hard_timeout=%d,dl_dst=%s,actions=output:%d' % (
+            self.mbb_priority, self.mbb_timeout, vm.MAC, port)
+        node.cmd('ovs-ofctl add-flow', node, flow)
+
+    def _unstageFlows( self, vm, node ):
+        "Remove all flows forwarding traffic for vm from an OVS node."
+        if not isinstance(node, OVSSwitch):
+            return                # Left to the controller.
+        node.cmd('ovs-ofctl del-flows', node, 'dl_dst=%s' % vm.MAC)
+
+    def _announceVM( self, vm ):
+        "Send RARP and gratuitous ARP from the VM (in the background)."
+        intf = vm.node.defaultIntf()
+        send = ("import socket; s = socket.socket(socket.AF_PACKET,"
+                " socket.SOCK_RAW); s.bind(('%s', 0));"
+                " map(s.send, ['%s'.decode('hex')] * %d)" %
+                (intf, rarpFrame(vm.MAC).encode('hex'), self.mbb_garp_count))
+        vm.node.cmd('%s -c "%s" >/dev/null 2>&1 &' % (sys.executable, send))
+        if not vm.IP:
+            return
+        vm.node.cmd('arping -q -U -c %d -I %s %s >/dev/null 2>&1 &' %
+                    (self.mbb_garp_count, intf, vm.IP))
+
     def _moveLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         """
         Move a host node to destination node in Mininet.
@@ -897,6 +1838,7 @@ def _moveLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         node2: Destination node instance.
         intf1_name: Moving node interface name. Default if None.
         intf2_name: Destination node interface name. Default if None.
+        returns: time (s) the link was down (see _moveIntf), or None
         """
         if self.debug_flag1:
             args = (node1, node2, intf1_name, intf2_name)
@@ -913,22 +1855,60 @@ def _moveLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         assert intf1 is not None
         intf1_name = intf1_name if intf1_name else intf1.name
         assert intf1.link != None
-        assert intf1.link.intf1 == intf1 or intf1.link.intf2 == intf1
         assert intf1.node == node1
-        intf1_other = None
-        if intf1.link.intf1 == intf1:
-            intf1_other = intf1.link.intf2
-        elif intf1.link.intf2 == intf1:
-            intf1_other = intf1.link.intf1
+        intf1_other = self.mn.peerIntf(intf1)
+        assert intf1_other is not None
         node1_other = intf1_other.node
         intf1_name_other = intf1_other.name
-        intf1_port_other = node1_other.ports[intf1_other]
 
         # Special case: Node already connected to other node.
         if node1_other == node2:
             if not intf2_name or intf2_name == intf1_name_other:
                 warn('connection already established\n')
-                return
+                return None
+
+        with self._lockNodes(node1_other, node2):
+            return self._moveIntf(intf1_other, node2, intf2_name)
+
+    def _lockNodes( self, *nodes ):
+        """Context manager: lock nodes (in a fixed order) for link changes.
+           Outside classic mode the dummy is not locked: a parked intf
+           belongs to a single VM, its tables are only changed under
+           linkLock, and commands in its namespace run in processes of
+           their own (see _nodeCmd). Classic moves use the shell of each
+           node, so there the dummy is locked like any other node."""
+        nodes = [node for node in set(nodes)
+                 if self.migration_mode == "classic" or
+                 not isinstance(node, Dummy)]
+        locks = [self.nodeToLock.setdefault(node, RLock())
+                 for node in sorted(nodes, key=lambda n: n.name)]
+
+        @contextmanager
+        def locked():
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+        return locked()
+
+    def _moveIntf( self, intf1_other, node2, intf2_name=None ):
+        """
+        Move an interface from its node to node2 (see _moveLink).
+        Callers must hold the locks of both nodes.
+
+        intf1_other: Interface to move.
+        node2: Destination node instance.
+        intf2_name: Destination node interface name. Default if None.
+        returns: time (s) from detaching the intf to attaching it again
+        """
+        if self.migration_mode != "classic":
+            return self._fastMoveIntf(intf1_other, node2, intf2_name)
+
+        node1_other = intf1_other.node
+        detach_time = time()
 
         # Part 1.5: Call detach() on switch.
         if hasattr(node1_other, 'detach'):
@@ -937,18 +1917,19 @@ def _moveLink( self, node1, node2, intf1_name=None, intf2_name=None ):
             node1_other.detach(intf1_other)
 
         # Part 2: Exchange information between node1_other and node2.
-        del node1_other.intfs[ intf1_port_other ]
-        del node1_other.ports[ intf1_other ]
-        del node1_other.nameToIntf[ intf1_name_other ]
-        intf2_port = node2.newPort()          # For now, just assign new port.
+        link = intf1_other.link
+        with self.linkLock:
+            self.mn.unindexLink(link)             # Index is keyed by node.
+            node1_other.delIntf(intf1_other)      # Releases port for reuse.
+            intf2_port = node2.newPort()      # For now, just assign new port.
         intf2 = intf1_other
         if not intf2_name:
             intf2_name = "%s-eth%d" % (node2.name, intf2_port)
         intf2.rename(intf2_name)
-        intf2.node = node2
-        node2.intfs[ intf2_port ] = intf2
-        node2.ports[ intf2 ] = intf2_port
-        node2.nameToIntf[ intf2_name ] = intf2
+        with self.linkLock:
+            intf2.node = node2
+            node2.addIntf(intf2, port=intf2_port, moveIntfFn=None)
+            self.mn.indexLink(link)
 
         # Part 3: Moving intf1_other to intf2 by namespace.
         debug( '\nmoving', intf2, 'into namespace for', node2, '\n' )
@@ -959,6 +1940,108 @@ def _moveLink( self, node1, node2, intf1_name=None, intf2_name=None ):
             if self.debug_flag1:
                 print "Attach %s to %s" % (intf2, node2)
             node2.attach(intf2)
+        return time() - detach_time
+
+    def _stableIntfName( self, intf ):
+        """Return a name for the switch-side intf of a VM link which never
+           changes across moves, or None if it would be too long."""
+        peer = self.mn.peerIntf(intf)
+        if peer is None:
+            return None
+        name = "hv-%s" % peer.name
+        return name if len(name) <= 15 else None    # IFNAMSIZ - 1
+
+    def _fastMoveIntf( self, intf1_other, node2, intf2_name=None ):
+        """
+        Move an interface like _moveIntf, with as few commands as possible.
+        The switch-side intf of a VM keeps a stable name (see
+        _stableIntfName), so it is renamed at most once. Kernel changes
+        (down, rename, namespace, up) go through a single ip -batch per
+        namespace, and a move between two Open vSwitch bridges is a single
+        OVSDB transaction. The moved intf is not verified afterwards.
+        Callers must hold the locks of both nodes.
+
+        intf1_other: Interface to move.
+        node2: Destination node instance.
+        intf2_name: Destination node interface name. Default if None.
+        returns: time (s) from detaching the intf to attaching it again
+        """
+        node1_other = intf1_other.node
+        old_name = intf1_other.name
+        same_ns = (not node1_other.inNamespace and not node2.inNamespace)
+        ovs = (isinstance(node1_other, OVSSwitch) and
+               isinstance(node2, OVSSwitch))
+
+        # Part 1: Detach from the old switch, unless done in Part 4.
+        detach_time = time()
+        if not ovs and hasattr(node1_other, 'detach'):
+            node1_other.detach(intf1_other)
+
+        # Part 2: Exchange information between node1_other and node2.
+        link = intf1_other.link
+        if not intf2_name:               # Needs the link still indexed.
+            intf2_name = self._stableIntfName(intf1_other)
+        with self.linkLock:
+            self.mn.unindexLink(link)
+            node1_other.delIntf(intf1_other)
+            intf2_port = node2.newPort()
+            intf2 = intf1_other
+            if not intf2_name:
+                intf2_name = "%s-eth%d" % (node2.name, intf2_port)
+            intf2.name = intf2_name
+            intf2.node = node2
+            node2.addIntf(intf2, port=intf2_port, moveIntfFn=None)
+            self.mn.indexLink(link)
+
+        # Part 3: Kernel changes, batched.
+        rename = intf2_name != old_name
+        up = isinstance(node2, Switch)   # Parked intfs stay down.
+        ops = []
+        if rename:
+            if ovs:
+                node1_other.cmd('ovs-vsctl del-port', node1_other, old_name)
+            ops += ['link set dev %s down' % old_name,
+                    'link set dev %s name %s' % (old_name, intf2_name)]
+        if not same_ns:
+            ops.append('link set dev %s netns %s' % (intf2_name, node2.pid))
+        elif rename and up:
+            ops.append('link set dev %s up' % intf2_name)
+        if ops:
+            self._ipBatch(node1_other, ops)
+        if not same_ns and up:
+            self._ipBatch(node2, ['link set dev %s up' % intf2_name])
+
+        # Part 4: Attach to the new switch.
+        if ovs:
+            cmd = ['ovs-vsctl']
+            if not rename:
+                cmd += ['-- del-port', node1_other.name, intf2_name]
+            cmd += ['-- add-port', node2.name, intf2_name,
+                    '-- set Interface', intf2_name,
+                    'ofport_request=%d' % intf2_port]
+            node2.cmd(*cmd)
+            attach_time = time()
+            node2.TCReapply(intf2)
+        else:
+            if hasattr(node2, 'attach'):
+                node2.attach(intf2)
+            attach_time = time()
+        return attach_time - detach_time
+
+    def _ipBatch( self, node, ops ):
+        "Run ip commands in the namespace of node with a single ip -batch."
+        if self.debug_flag1:
+            print "ip -batch on %s: %s" % (node, "; ".join(ops))
+        ops = " ".join("'%s'" % op for op in ops)
+        return self._nodeCmd(node, "printf '%%s\\n' %s | ip -batch -" % ops)
+
+    def _nodeCmd( self, node, cmd ):
+        """Run a shell command on a node. The shell of a node runs one
+           command at a time, so commands in the (unlocked) dummy run in
+           processes of their own."""
+        if isinstance(node, Dummy):
+            return node.run(cmd)
+        return node.cmd(cmd)
 
     def _removeLink( self, node, intf_name=None, remove_only_once=True ):
         """
@@ -991,16 +2074,16 @@ def _removeLink( self, node, intf_name=None, remove_only_once=True ):
         # Special case: Node already connected to dummy.
         if remove_only_once:
             assert intf.link != None
-            assert intf.link.intf1 == intf or intf.link.intf2 == intf
             assert intf.node != dummy
-            if intf.link.intf1.node == dummy or intf.link.intf2.node == dummy:
+            intf_other = self.mn.peerIntf(intf)
+            assert intf_other is not None
+            if intf_other.node == dummy:
                 warn('intf %s already removed\n' % intf_name)
                 return
 
-        # Part 2: Extracting dummy information and calling moveLink().
-        dummy_intf_port = dummy.newPort()
-        dummy_intf_name = 'dummy-eth' + str(dummy_intf_port)
-        self._moveLink(node, dummy, intf_name, dummy_intf_name)
+        # Part 2: Calling moveLink(), which names the intf dummy-eth<port>.
+        # (Naming it here would race with concurrent removals.)
+        self._moveLink(node, dummy, intf_name)
 
     def _swapLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         """
@@ -1026,13 +2109,9 @@ def _swapLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         assert intf1 is not None
         intf1_name = intf1_name if intf1_name else intf1.name
         assert intf1.link != None
-        assert intf1.link.intf1 == intf1 or intf1.link.intf2 == intf1
         assert intf1.node == node1
-        intf1_other = None
-        if intf1.link.intf1 == intf1:
-            intf1_other = intf1.link.intf2
-        elif intf1.link.intf2 == intf1:
-            intf1_other = intf1.link.intf1
+        intf1_other = self.mn.peerIntf(intf1)
+        assert intf1_other is not None
         node1_other = intf1_other.node
         intf1_name_other = intf1_other.name
 
@@ -1041,13 +2120,9 @@ def _swapLink( self, node1, node2, intf1_name=None, intf2_name=None ):
         assert intf2 is not None
         intf2_name = intf2_name if intf2_name else intf2.name
         assert intf2.link != None
-        assert intf2.link.intf1 == intf2 or intf2.link.intf2 == intf2
         assert intf2.node == node2
-        intf2_other = None
-        if intf2.link.intf1 == intf2:
-            intf2_other = intf2.link.intf2
-        elif intf2.link.intf2 == intf2:
-            intf2_other = intf2.link.intf1
+        intf2_other = self.mn.peerIntf(intf2)
+        assert intf2_other is not None
         node2_other = intf2_other.node
         intf2_name_other = intf2_other.name
 
@@ -0,0 +1,198 @@
+"""
+Placement engine for CMSnet.
+
+The placement engine keeps hypervisors indexed so that the VM distribution
+modes of CMSnet choose a hypervisor in O(log n) time instead of scanning
+every hypervisor, and never choose a disabled one.
+
+PlacementEngine: indexes hypervisors by position (for next/previous/random)
+and by load (for sparse/packed).
+
+Indexes:
+
+    enabled     sorted positions (in order of addition) of enabled HVs;
+                next/previous bisect it, random picks from it
+    sparse      min-heap of (load, position)
+    packed      min-heap of (-load, position), without full HVs
+
+Heap entries are not removed when a load changes; a new entry is pushed
+instead and stale ones (whose load no longer matches, or whose HV has been
+disabled or filled up) are discarded when they reach the top. The heaps are
+rebuilt when they grow too large.
+
+The engine must be told about every change through update(): CMSnet calls it
+after launching, migrating and stopping VMs and after enabling or disabling
+hypervisors.
+
+HopTable: precomputed hop distances between hypervisor switches, found by a
+breadth-first search over switch-to-switch links from every hypervisor. The
+topology does not change once the network is started, so the table is built
+once and each lookup is a dict access.
+"""
+
+import random
+from heapq import heappush, heappop, heapify
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+
+class PlacementEngine( object ):
+    "Indexes hypervisors for fast VM placement."
+
+    def __init__( self, is_full=None ):
+        """
+        Intialization
+
+        is_full: Function telling if a hypervisor is full (packed mode)
+        """
+        self.HVs = []            # hypervisors in order of addition
+        self.hvToPos = {}        # hypervisor to position in self.HVs
+        self.enabled = []        # sorted positions of enabled hypervisors
+        self.sparse_heap = []    # (load, position); may hold stale entries
+        self.packed_heap = []    # (-load, position); may hold stale entries
+        self.is_full = is_full if is_full else lambda hv: False
+
+    def load( self, hv ):
+        "Return the load of a hypervisor."
+        return len(hv.nameToVMs)
+
+    def add( self, hv ):
+        "Add a hypervisor to the indexes."
+        assert hv not in self.hvToPos
+        self.hvToPos[hv] = len(self.HVs)
+        self.HVs.append(hv)
+        self.update(hv)
+
+    def update( self, *hvs ):
+        "Reindex hypervisors whose load or enabled state may have changed."
+        for hv in hvs:
+            if hv is None or hv not in self.hvToPos:
+                continue
+            pos = self.hvToPos[hv]
+            i = bisect_left(self.enabled, pos)
+            present = i < len(self.enabled) and self.enabled[i] == pos
+            if not hv.is_enabled():
+                if present:
+                    del self.enabled[i]
+                continue
+            if not present:
+                self.enabled.insert(i, pos)
+            load = self.load(hv)
+            heappush(self.sparse_heap, (load, pos))
+            if not self.is_full(hv):
+                heappush(self.packed_heap, (-load, pos))
+        limit = 4 * len(self.HVs) + 64
+        if len(self.sparse_heap) > limit or len(self.packed_heap) > limit:
+            self.rebuild()
+
+    def rebuild( self ):
+        "Rebuild the load heaps (e.g. after capacity limits change)."
+        self.sparse_heap = []
+        self.packed_heap = []
+        for pos in self.enabled:
+            hv = self.HVs[pos]
+            load = self.load(hv)
+            self.sparse_heap.append((load, pos))
+            if not self.is_full(hv):
+                self.packed_heap.append((-load, pos))
+        heapify(self.sparse_heap)
+        heapify(self.packed_heap)
+
+    def enabled_HVs( self ):
+        "Iterator: return enabled hypervisors in order."
+        for pos in self.enabled:
+            yield self.HVs[pos]
+
+    def sparse( self ):
+        "Return the least loaded enabled hypervisor (first one on ties)."
+        heap = self.sparse_heap
+        while heap:
+            load, pos = heap[0]
+            hv = self.HVs[pos]
+            if hv.is_enabled() and self.load(hv) == load:
+                return hv
+            heappop(heap)
+        return None
+
+    def packed( self ):
+        "Return the most loaded enabled hypervisor that is not full."
+        heap = self.packed_heap
+        while heap:
+            neg_load, pos = heap[0]
+            hv = self.HVs[pos]
+            if (hv.is_enabled() and self.load(hv) == -neg_load and
+                    not self.is_full(hv)):
+                return hv
+            heappop(heap)
+        return None
+
+    def random( self ):
+        "Return a random enabled hypervisor."
+        if not self.enabled:
+            return None
+        return self.HVs[random.choice(self.enabled)]
+
+    def different( self, last_hv ):
+        "Return a random enabled hypervisor other than last_hv."
+        choices = len(self.enabled)
+        if last_hv is not None and last_hv.is_enabled():
+            choices -= 1
+        if choices <= 0:
+            return None
+        while True:
+            hv = self.random()
+            if hv is not last_hv:
+                return hv
+
+    def next( self, last_hv ):
+        "Return the enabled hypervisor after last_hv, in a cycle."
+        if not self.enabled:
+            return None
+        i = bisect_right(self.enabled, self.hvToPos[last_hv])
+        return self.HVs[self.enabled[i % len(self.enabled)]]
+
+    def previous( self, last_hv ):
+        "Return the enabled hypervisor before last_hv, in a cycle."
+        if not self.enabled:
+            return None
+        i = bisect_left(self.enabled, self.hvToPos[last_hv]) - 1
+        return self.HVs[self.enabled[i]]
+
+
+class HopTable( object ):
+    "Hop distances between hypervisor switches through the fabric."
+
+    def __init__( self ):
+        self.hops = {}           # HV to dict of HV to number of hops
+        self.unreachable = 0     # distance used for disconnected HVs
+
+    def build( self, HVs, links ):
+        """
+        Compute the hop distances between all hypervisors.
+
+        HVs: List of hypervisors
+        links: List of (switch, switch) pairs of switch-to-switch links
+        """
+        neighbors = {}
+        for node1, node2 in links:
+            neighbors.setdefault(node1, set()).add(node2)
+            neighbors.setdefault(node2, set()).add(node1)
+        nodeToHV = dict((hv.node, hv) for hv in HVs)
+        self.hops = {}
+        self.unreachable = len(neighbors) + 1
+        for hv in HVs:
+            dist = {hv.node: 0}
+            queue = deque([hv.node])
+            while queue:
+                node = queue.popleft()
+                for peer in neighbors.get(node, ()):
+                    if peer not in dist:
+                        dist[peer] = dist[node] + 1
+                        queue.append(peer)
+            self.hops[hv] = dict((nodeToHV[node], d)
+                                 for node, d in dist.items()
+                                 if node in nodeToHV)
+
+    def distance( self, hv1, hv2 ):
+        "Return the number of hops between two hypervisors."
+        return self.hops.get(hv1, {}).get(hv2, self.unreachable)
@@ -0,0 +1,232 @@
+"""
+Data-plane probe harness for CMSnet.
+
+Measures what a VM operation (launch, migrate, stop) costs the traffic of
+the VM, rather than how long the CMSnet command took. A peer host sends
+timestamped UDP probes to the VM at a sub-millisecond interval, the VM
+echoes them back, and the harness runs the operation in the middle of the
+stream. Both probe ends run inside emulated hosts (see cms_probe_agent.py),
+so no external traffic generator is needed.
+
+ProbeHarness: runs measured operations (run()) and repeats them into
+distributions (repeat()).
+
+Results of a run:
+
+    op_time     time taken by the CMSnet command (s)
+    sent        probes sent
+    lost        probes never echoed
+    dup         extra echoes of already echoed probes
+    reordered   echoes received after an echo of a later probe
+    blackout    longest stretch of probes lost in a row, in time (s)
+    rtt_base    median round trip time before the operation (s)
+    rtt_max     largest round trip time (s)
+    spikes      echoed probes with a round trip time over spike_factor
+                times rtt_base
+
+Aggregated results (repeat()) hold, for each of these, the list of values
+over all runs and their min/median/p90/max.
+"""
+
+import os
+import sys
+from subprocess import PIPE
+from time import sleep, time
+
+from mininet.log import info, warn, error
+
+AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     "cms_probe_agent.py")
+
+
+def percentile( values, fraction ):
+    "Return the value at the given fraction of the sorted values."
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def analyze( lines, interval, op_start, spike_factor=3.0 ):
+    """
+    Compute the results of a run from the output of a probe sender.
+
+    lines: Output lines of "cms_probe_agent.py send"
+    interval: Probe interval (s)
+    op_start: Time the operation started
+    spike_factor: Round trip time spike threshold, relative to rtt_base
+    """
+    probes = []            # (seq, sent, echoed or None, received or None)
+    dup = 0
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "dup":
+            dup = int(fields[1])
+            continue
+        seq, sent = int(fields[0]), float(fields[1])
+        if fields[2] == "-":
+            probes.append((seq, sent, None, None))
+        else:
+            probes.append((seq, sent, float(fields[2]), float(fields[3])))
+
+    echoed = [p for p in probes if p[3] is not None]
+    rtts = [p[3] - p[1] for p in echoed]
+    base = [p[3] - p[1] for p in echoed if p[1] < op_start]
+    rtt_base = percentile(base, 0.5) if base else percentile(rtts, 0.5)
+
+    # Blackout: longest gap between the send times of echoed probes.
+    blackout = 0.0
+    last_sent = probes[0][1] - interval if probes else None
+    for p in probes:
+        if p[3] is not None:
+            blackout = max(blackout, p[1] - last_sent - interval)
+            last_sent = p[1]
+    if probes and probes[-1][3] is None:     # Never came back.
+        blackout = max(blackout, probes[-1][1] - last_sent)
+
+    reordered = 0
+    last_seq = -1
+    for p in sorted(echoed, key=lambda p: p[3]):
+        if p[0] < last_seq:
+            reordered += 1
+        last_seq = max(last_seq, p[0])
+
+    spikes = 0
+    if rtt_base:
+        spikes = len([r for r in rtts if r > spike_factor * rtt_base])
+
+    return {"sent": len(probes),
+            "lost": len(probes) - len(echoed),
+            "dup": dup,
+            "reordered": reordered,
+            "blackout": blackout,
+            "rtt_base": rtt_base,
+            "rtt_max": max(rtts) if rtts else None,
+            "spikes": spikes}
+
+
+class ProbeHarness( object ):
+    "Measures the data-plane cost of VM operations."
+
+    OPS = ("launch", "migrate", "stop")
+
+    def __init__( self, cn, interval=0.0005, port=5099, settle=0.5,
+                  spike_factor=3.0 ):
+        """
+        Intialization
+
+        cn: CMSnet
+        interval: Time between probes (s)
+        port: UDP port of the echo agent in the VM
+        settle: Time probes run before and after the operation (s)
+        spike_factor: Round trip time spike threshold, relative to rtt_base
+        """
+        self.cn = cn
+        self.interval = interval
+        self.port = port
+        self.settle = settle
+        self.spike_factor = spike_factor
+
+    def _do_op( self, op, vm_name, hv_name ):
+        "Run a CMSnet operation on a VM."
+        if op == "launch":
+            self.cn.launchVM(vm_name, hv_name)
+        elif op == "migrate":
+            self.cn.migrateVM(vm_name, hv_name)
+        elif op == "stop":
+            self.cn.stopVM(vm_name)
+        else:
+            raise ValueError("No such operation: %s" % op)
+
+    def run( self, op, vm_name, peer_name, hv_name=None ):
+        """
+        Measure a single operation. Returns the results (see analyze()),
+        or None if the probes could not run.
+
+        op: "launch", "migrate" or "stop"
+        vm_name: VM to operate on (probed)
+        peer_name: VM or host sending probes to vm_name
+        hv_name: Target hypervisor of launch/migrate
+        """
+        vm = self.cn.nameToComp.get(vm_name)
+        peer = self.cn.nameToComp.get(peer_name)
+        peer_node = peer.node if peer else self.cn.mn.nameToNode.get(peer_name)
+        if vm is None or peer_node is None:
+            error("\nCannot probe: no such VM or peer.\n")
+            return None
+        if not vm.IP:
+            error("\nCannot probe: VM %s has no IP.\n" % vm_name)
+            return None
+
+        echo = vm.node.popen([sys.executable, AGENT, "echo",
+                              str(self.port)])
+        sender = None
+        try:
+            sleep(0.05)                        # Let the echo agent bind.
+            sender = peer_node.popen([sys.executable, AGENT, "send",
+                                      vm.IP, str(self.port),
+                                      repr(self.interval)], stdin=PIPE)
+            sleep(self.settle)
+            op_start = time()
+            self._do_op(op, vm_name, hv_name)
+            op_time = time() - op_start
+            sleep(self.settle)
+            out, err = sender.communicate("")  # Closing stdin stops it.
+            sender = None
+        finally:
+            if sender:
+                sender.kill()
+            echo.kill()
+            echo.wait()
+        if err:
+            warn("\nProbe sender: %s\n" % err.strip())
+
+        result = analyze(out.splitlines(), self.interval, op_start,
+                         self.spike_factor)
+        result["op_time"] = op_time
+        return result
+
+    def repeat( self, count, op, vm_name, peer_name, hv_names=None ):
+        """
+        Measure an operation count times and aggregate the results.
+
+        hv_names: Target hypervisors of launch/migrate, used in turn
+                  (e.g. two HVs to migrate back and forth)
+        Launches are undone (stopVM) and stops prepared (launchVM on the
+        next HV) between runs, unmeasured.
+        """
+        hv_names = list(hv_names) if hv_names else [None]
+        results = []
+        for i in range(count):
+            hv_name = hv_names[i % len(hv_names)]
+            vm = self.cn.nameToComp[vm_name]
+            if op == "launch" and vm.is_running():
+                self.cn.stopVM(vm_name)
+            elif op == "stop" and not vm.is_running():
+                self.cn.launchVM(vm_name, hv_name)
+            elif op == "migrate" and vm.hv_name == hv_name:
+                hv_name = hv_names[(i + 1) % len(hv_names)]
+            result = self.run(op, vm_name, peer_name, hv_name)
+            if result is None:
+                break
+            info("*** Probe run %i/%i: blackout %.4f s, lost %i/%i\n" %
+                 (i + 1, count, result["blackout"], result["lost"],
+                  result["sent"]))
+            results.append(result)
+        return self.aggregate(results)
+
+    def aggregate( self, results ):
+        "Aggregate results of several runs into distributions."
+        summary = {"runs": len(results)}
+        if not results:
+            return summary
+        for key in results[0]:
+            values = [r[key] for r in results if r[key] is not None]
+            summary[key] = {"values": values,
+                            "min": min(values) if values else None,
+                            "median": percentile(values, 0.5),
+                            "p90": percentile(values, 0.9),
+                            "max": max(values) if values else None}
+        return summary
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Probe agent for the CMSnet probe harness (see cms_probe.py).
+
+Runs inside an emulated host. All hosts share the kernel clock, so the
+timestamps taken by different hosts can be compared directly.
+
+    cms_probe_agent.py echo PORT
+        Echo every probe back to its sender, adding the time it arrived.
+
+    cms_probe_agent.py send HOST PORT INTERVAL
+        Send a probe to HOST:PORT every INTERVAL seconds until stdin is
+        closed, then wait a little for late echoes and print one line per
+        probe sent: "seq sent echoed received" (times in seconds, echoed and
+        received are "-" for lost probes). Echoes of a probe after the
+        first are counted on a final "dup N" line.
+"""
+
+import os
+import sys
+import time
+import struct
+import socket
+import select
+
+PROBE = struct.Struct("!Id")          # seq, send time
+ECHO = struct.Struct("!Idd")          # seq, send time, echo time
+GRACE = 0.5                           # Wait for late echoes (s)
+
+
+def echo( port ):
+    "Echo probes until killed."
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", port))
+    while True:
+        data, addr = sock.recvfrom(64)
+        now = time.time()
+        if len(data) != PROBE.size:
+            continue
+        seq, sent = PROBE.unpack(data)
+        try:
+            sock.sendto(ECHO.pack(seq, sent, now), addr)
+        except socket.error:
+            pass                      # No route while the VM moves.
+
+
+def send( host, port, interval ):
+    "Send probes until stdin is closed; print the results."
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    stdin = sys.stdin.fileno()
+    sent = []                         # send time of each probe, by seq
+    echoes = {}                       # seq to (echo time, receive time)
+    dups = 0
+    next_time = time.time()
+    stop_time = None
+    while stop_time is None or time.time() < stop_time:
+        now = time.time()
+        if stop_time is None and now >= next_time:
+            try:
+                sock.sendto(PROBE.pack(len(sent), now), (host, port))
+            except socket.error:
+                pass                  # Lost; no route while the VM moves.
+            sent.append(now)
+            next_time += interval
+            if next_time < now:       # Fell behind; do not burst.
+                next_time = now + interval
+        if stop_time is None:
+            timeout = max(0, next_time - time.time())
+            fds = [sock, stdin]
+        else:
+            timeout = max(0, stop_time - time.time())
+            fds = [sock]
+        readable = select.select(fds, [], [], timeout)[0]
+        if stdin in readable and not os.read(stdin, 1024):
+            stop_time = time.time() + GRACE
+        if sock in readable:
+            while True:
+                try:
+                    data = sock.recv(64)
+                except socket.error:
+                    break
+                received = time.time()
+                if len(data) != ECHO.size:
+                    continue
+                seq, _sent, echoed = ECHO.unpack(data)
+                if seq in echoes:
+                    dups += 1
+                else:
+                    echoes[seq] = (echoed, received)
+    out = []
+    for seq, sent_time in enumerate(sent):
+        if seq in echoes:
+            out.append("%d %.6f %.6f %.6f" % ((seq, sent_time) + echoes[seq]))
+        else:
+            out.append("%d %.6f - -" % (seq, sent_time))
+    out.append("dup %d" % dups)
+    sys.stdout.write("\n".join(out) + "\n")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == "echo":
+        echo(int(sys.argv[2]))
+    elif len(sys.argv) == 5 and sys.argv[1] == "send":
+        send(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        sys.exit(__doc__)
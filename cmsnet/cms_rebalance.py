@@ -0,0 +1,226 @@
+"""
+Rebalancer for CMSnet.
+
+The rebalancer moves running VMs between hypervisors to cut the peak load,
+within a migration budget: at most max_moves migrations per round, and no VM
+is moved again until its cooldown has expired. Migrations go through
+CMSnet.migrateVM(), so the controller is told about each of them as usual.
+
+Rebalancer: plans and executes rebalancing rounds, either on demand
+(rebalance()) or periodically from a background thread (start()/stop()).
+
+The load of a hypervisor is the sum of the loads of its VMs. Metrics:
+
+    count       every VM has load 1
+    demand      VM resource demand, normalized by the largest capacity of
+                each resource (see CMSnet.setVMDemand)
+    traffic     bytes per second sent and received by the VM since the last
+                round, read from the counters of its hypervisor-side port
+    <callable>  any function returning the load of a VM
+
+Each round is greedy: take a VM off the most loaded hypervisor and put it
+on the least loaded one that has room for it, as long as this lowers the
+larger of the two loads.
+"""
+
+import time
+from threading import Thread, Event
+
+from mininet.log import info, warn, error, debug
+
+
+class Rebalancer( object ):
+    "Moves VMs between hypervisors to balance their load."
+
+    def __init__( self, cn, metric="count", max_moves=5, cooldown=60.0,
+                  threshold=1.0 ):
+        """
+        Intialization
+
+        cn: CMSnet to rebalance
+        metric: VM load metric ("count", "demand", "traffic" or a function)
+        max_moves: Maximum number of migrations per round
+        cooldown: Minimum time (s) between two migrations of the same VM
+        threshold: Minimum load difference worth a migration
+        """
+        self.cn = cn
+        self.metric = metric
+        self.max_moves = max_moves
+        self.cooldown = cooldown
+        self.threshold = threshold
+
+        self.vmToMoveTime = {}   # VM name to time of its last migration
+        self.vmToBytes = {}      # VM name to (time, bytes) of last sample
+        self.thread = None
+        self.stopped = Event()
+        self.rounds = 0
+        self.moves = 0
+
+    # Metrics
+
+    def vm_load( self, vm, scale=None ):
+        "Return the load of a VM under the current metric."
+        if callable(self.metric):
+            return self.metric(vm)
+        if self.metric == "count":
+            return 1.0
+        if self.metric == "demand":
+            return self.cn._demand_size(vm.demand, scale or {})
+        if self.metric == "traffic":
+            return self._vm_traffic(vm)
+        raise ValueError("No such rebalancing metric: %s" % self.metric)
+
+    def _vm_traffic( self, vm ):
+        "Return the bytes per second of a VM since the last sample."
+        intf = self.cn.mn.peerIntf(vm.node.defaultIntf())
+        if intf is None:
+            return 0.0
+        total = 0
+        for counter in ("rx_bytes", "tx_bytes"):
+            path = "/sys/class/net/%s/statistics/%s" % (intf.name, counter)
+            try:
+                with open(path) as f:
+                    total += int(f.read())
+            except (IOError, ValueError):
+                return 0.0
+        now = time.time()
+        last = self.vmToBytes.get(vm.name)
+        self.vmToBytes[vm.name] = (now, total)
+        if last is None or now <= last[0] or total < last[1]:
+            return 0.0
+        return (total - last[1]) / (now - last[0])
+
+    def loads( self ):
+        "Return dicts of HV to load and VM to load over enabled HVs."
+        scale = self.cn._resource_scale() if self.metric == "demand" else None
+        hvToLoad = {}
+        vmToLoad = {}
+        for hv in self.cn.placement.enabled_HVs():
+            hvToLoad[hv] = 0.0
+            for vm in hv.nameToVMs.values():
+                vmToLoad[vm] = self.vm_load(vm, scale)
+                hvToLoad[hv] += vmToLoad[vm]
+        return hvToLoad, vmToLoad
+
+    # Planning
+
+    def _movable( self, vm, now ):
+        "Test if the cooldown of a VM has expired."
+        last = self.vmToMoveTime.get(vm.name)
+        return last is None or now - last >= self.cooldown
+
+    def _fits( self, vm, dst, hvToUsage, hvToCount ):
+        """Test if a VM fits on dst, given the usage and VM count dst will
+           have after the moves planned so far. The VM count limit only
+           applies in the modes that place by it (see CMSnet.isHVFull)."""
+        usage = hvToUsage[dst]
+        if not all(usage.get(r, 0) + vm.demand.get(r, 0) <= c
+                   for r, c in dst.capacity.items()):
+            return False
+        if self.cn.vm_dist_mode in ("packed", "tenant"):
+            limit = dst.vm_dist_limit or self.cn.vm_dist_limit
+            return hvToCount[dst] < limit
+        return True
+
+    def plan( self ):
+        "Return list of (vm, old_hv, new_hv) migrations for one round."
+        hvToLoad, vmToLoad = self.loads()
+        if len(hvToLoad) < 2:
+            return []
+        # Usage and VM counts as they will be after the planned moves.
+        hvToUsage = dict((hv, dict(hv.usage)) for hv in hvToLoad)
+        hvToCount = dict((hv, len(hv.nameToVMs)) for hv in hvToLoad)
+        now = time.time()
+        moved = set()
+        moves = []
+        while len(moves) < self.max_moves:
+            move = None
+            for src in sorted(hvToLoad, key=hvToLoad.get, reverse=True):
+                move = self._best_move(src, hvToLoad, vmToLoad, moved, now,
+                                       hvToUsage, hvToCount)
+                if move:
+                    break
+            if not move:
+                break
+            vm, src, dst = move
+            hvToLoad[src] -= vmToLoad[vm]
+            hvToLoad[dst] += vmToLoad[vm]
+            for r, v in vm.demand.items():
+                hvToUsage[src][r] = hvToUsage[src].get(r, 0) - v
+                hvToUsage[dst][r] = hvToUsage[dst].get(r, 0) + v
+            hvToCount[src] -= 1
+            hvToCount[dst] += 1
+            moved.add(vm)
+            moves.append(move)
+        return moves
+
+    def _best_move( self, src, hvToLoad, vmToLoad, moved, now,
+                    hvToUsage, hvToCount ):
+        """Return the (vm, src, dst) migration off src which lowers the peak
+           load the most, or None if there is none worth doing."""
+        best = None
+        src_load = hvToLoad[src]
+        for dst in sorted(hvToLoad, key=hvToLoad.get):
+            gap = src_load - hvToLoad[dst]
+            if gap <= self.threshold:
+                break              # Remaining HVs are even closer to src.
+            for vm in src.nameToVMs.values():
+                load = vmToLoad.get(vm, 0.0)
+                if (vm in moved or not 0 < load < gap or
+                        not self._movable(vm, now) or
+                        not self._fits(vm, dst, hvToUsage, hvToCount)):
+                    continue
+                peak = max(src_load - load, hvToLoad[dst] + load)
+                if best is None or peak < best[0]:
+                    best = (peak, (vm, src, dst))
+        return best[1] if best else None
+
+    # Execution
+
+    def rebalance( self, dry_run=False ):
+        "Plan and execute one round. Return the list of migrations."
+        with self.cn.lock:
+            moves = self.plan()
+            self.rounds += 1
+            if dry_run:
+                return moves
+            for vm, src, dst in moves:
+                debug("Rebalancing %s from %s to %s\n" %
+                      (vm.name, src.name, dst.name))
+                self.cn.migrateVM(vm.name, dst.name)
+                self.vmToMoveTime[vm.name] = time.time()
+                self.moves += 1
+        if moves:
+            info("*** Rebalanced %i VMs\n" % len(moves))
+        return moves
+
+    def _run( self, interval ):
+        "Run rebalancing rounds until stopped."
+        while not self.stopped.wait(interval):
+            try:
+                self.rebalance()
+            except Exception as e:
+                error("\nRebalancing round failed: %s\n" % e)
+
+    def start( self, interval=10.0 ):
+        "Start rebalancing every interval seconds in the background."
+        if self.is_running():
+            warn("\nRebalancer already running\n")
+            return
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, args=(interval,),
+                             name="cms-rebalancer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop( self ):
+        "Stop background rebalancing."
+        if not self.is_running():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def is_running( self ):
+        "Test if background rebalancing is running."
+        return self.thread is not None and self.thread.is_alive()
@@ -0,0 +1,253 @@
+"""
+State store for CMSnet.
+
+A single store holds the saved configuration of the whole CMS inventory
+(CMSnet itself, every VM and every hypervisor), instead of one small JSON
+file per component.
+
+CMSStore: a key/value store made of a snapshot file plus an append-only
+journal. Each change is appended to the journal as one JSON line; when the
+journal grows larger than the state itself, the state is compacted into a
+new snapshot (written to a temporary file and renamed into place) and the
+journal is truncated.
+
+Writes are coalesced: puts of unchanged values are dropped, and inside a
+batch() block only the final value of each key is written when the
+outermost block exits. A CMS command that changes several properties of a
+VM therefore costs one small append instead of several file rewrites.
+
+Keys used by CMSnet:
+
+    cmsnet         CMSnet configuration (formerly cn.config_cmsnet)
+    vm/<name>      VM configuration (formerly <name>.config_vm)
+    hv/<name>      hypervisor configuration
+
+Existing per-component config files are imported the first time a store is
+opened in a folder that has no store yet (see migrate_legacy()).
+"""
+
+import os
+import json
+from contextlib import contextmanager
+
+from mininet.log import info, warn, error, debug
+
+
+def _str( obj ):
+    "Convert unicode strings (recursively) to str."
+    if isinstance(obj, unicode):
+        return str(obj)
+    if isinstance(obj, list):
+        return [_str(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict((_str(k), _str(v)) for k, v in obj.iteritems())
+    return obj
+
+
+class CMSStore( object ):
+    "Journaled key/value store for CMSnet configurations."
+
+    _DELETED = object()   # Pending deletion marker.
+
+    def __init__( self, config_folder=".", name="cms", compact_min=1000,
+                  sync=False, migrate=True ):
+        """
+        Intialization
+
+        config_folder: Folder holding the store files
+        name: Base name of the store files
+        compact_min: Minimum journal length before compacting
+        sync: fsync() the journal after every flush?
+        migrate: Import legacy per-component config files if no store exists
+        """
+        self.config_folder = config_folder
+        self.snapshot_file = os.path.join(config_folder, name+".snapshot")
+        self.journal_file = os.path.join(config_folder, name+".journal")
+        self.compact_min = compact_min
+        self.sync = sync
+
+        self.state = {}          # key to saved value
+        self.pending = {}        # key to value (or _DELETED) not yet written
+        self.batch_depth = 0
+        self.journal_len = 0     # number of records in the journal
+        self.journal = None
+
+        existed = (os.path.exists(self.snapshot_file) or
+                   os.path.exists(self.journal_file))
+        self.load()
+        self.journal = open(self.journal_file, "a")
+        if migrate and not existed:
+            self.migrate_legacy()
+
+    # Reading
+
+    def load( self ):
+        "Load the snapshot and replay the journal."
+        self.state = {}
+        self.journal_len = 0
+        try:
+            with open(self.snapshot_file, "r") as f:
+                self.state = _str(json.load(f))
+        except IOError:
+            pass
+        except ValueError as e:
+            error("\nCorrupt CMS store snapshot %s: %s\n" %
+                  (self.snapshot_file, e))
+        try:
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        record = _str(json.loads(line))
+                    except ValueError:
+                        # Torn write at the end of the journal; drop it.
+                        warn("\nIgnoring partial CMS store record\n")
+                        continue
+                    self._apply(record)
+                    self.journal_len += 1
+        except IOError:
+            pass
+
+    def _apply( self, record ):
+        "Apply a journal record to the state."
+        if record.get("op") == "del":
+            self.state.pop(record["key"], None)
+        else:
+            self.state[record["key"]] = record["value"]
+
+    def get( self, key, default=None ):
+        "Return the value saved under key."
+        value = self.pending.get(key, self.state.get(key, default))
+        if value is self._DELETED:
+            return default
+        return value
+
+    def __contains__( self, key ):
+        return self.get(key, self._DELETED) is not self._DELETED
+
+    def keys( self, prefix="" ):
+        "Return list of keys starting with prefix."
+        keys = set(k for k in self.state if k.startswith(prefix))
+        for key, value in self.pending.iteritems():
+            if not key.startswith(prefix):
+                continue
+            if value is self._DELETED:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return sorted(keys)
+
+    # Writing
+
+    def put( self, key, value ):
+        "Save value under key."
+        if self.get(key, self._DELETED) == value:
+            return               # Unchanged; nothing to write.
+        self.pending[key] = value
+        if not self.batch_depth:
+            self.flush()
+
+    def delete( self, key ):
+        "Remove key from the store."
+        if key not in self:
+            return
+        if key not in self.state:    # Never written; just drop it.
+            del self.pending[key]
+            return
+        self.pending[key] = self._DELETED
+        if not self.batch_depth:
+            self.flush()
+
+    @contextmanager
+    def batch( self ):
+        "Coalesce all writes in the block into a single journal append."
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth:
+                self.flush()
+
+    def flush( self ):
+        "Append pending changes to the journal."
+        if not self.pending:
+            return
+        lines = []
+        for key, value in self.pending.iteritems():
+            if value is self._DELETED:
+                record = {"op": "del", "key": key}
+            else:
+                record = {"op": "put", "key": key, "value": value}
+            self._apply(record)
+            lines.append(json.dumps(record))
+        self.pending = {}
+        self.journal.write("\n".join(lines) + "\n")
+        self.journal.flush()
+        if self.sync:
+            os.fsync(self.journal.fileno())
+        self.journal_len += len(lines)
+        if self.journal_len > max(self.compact_min, len(self.state)):
+            self.compact()
+
+    def compact( self ):
+        "Write the state to a new snapshot and truncate the journal."
+        debug("Compacting CMS store (%d records)\n" % self.journal_len)
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file, self.snapshot_file)
+        self.journal.close()
+        self.journal = open(self.journal_file, "w")
+        self.journal_len = 0
+
+    def clear( self ):
+        "Remove everything from the store."
+        self.pending = {}
+        self.state = {}
+        self.compact()
+
+    def close( self ):
+        "Flush pending changes and close the journal."
+        if self.journal:
+            self.flush()
+            self.journal.close()
+            self.journal = None
+
+    # Migration
+
+    def migrate_legacy( self, remove=False ):
+        """
+        Import legacy per-component config files into the store.
+
+        remove: Remove the imported files afterwards
+        """
+        suffixes = {".config_vm": "vm/", ".config_hv": "hv/"}
+        imported = []
+        with self.batch():
+            for file_name in os.listdir(self.config_folder):
+                path = os.path.join(self.config_folder, file_name)
+                base, ext = os.path.splitext(file_name)
+                if file_name == "cn.config_cmsnet":
+                    key = "cmsnet"
+                elif ext in suffixes:
+                    key = suffixes[ext] + base
+                else:
+                    continue
+                try:
+                    with open(path, "r") as f:
+                        config_raw = f.read()
+                    config = _str(json.loads(config_raw)) if config_raw else {}
+                except (IOError, ValueError) as e:
+                    warn("\nCannot import config %s: %s\n" % (path, e))
+                    continue
+                self.put(key, config)
+                imported.append(path)
+        if imported:
+            info("*** Imported %d config files into CMS store\n" %
+                 len(imported))
+            self.compact()
+        if remove:
+            for path in imported:
+                os.remove(path)
@@ -13,20 +13,59 @@
 
 from mininet.util import irange, natural, naturalSeq
 from mininet.topo import Topo
+from mininet.node import OVSSwitch
 #from mininet.node import POXNormalSwitch
-from cmsnet.mininet_node_patch import POXNormalSwitch
+from cmsnet.mininet_node_patch import POXSwitch, POXNormalSwitch
+from cmsnet.mininet_node_patch import OVSNormalSwitch, OVSMultipathSwitch
+
+# Switch classes by name for the fabric and hv_switch options.
+FABRIC_SWITCHES = { 'pox': POXNormalSwitch,
+                    'ovs': OVSNormalSwitch }
+HV_SWITCHES = { 'ovs': OVSSwitch,
+                'ovsnormal': OVSNormalSwitch,
+                'pox': POXSwitch }
+
+# Forwarding over fabrics with several paths between HV-switches.
+MULTIPATH_MODES = ( 'ecmp',        # All paths, hashed by flow
+                    'stp' )        # One spanning tree
 
 class CMSTopo(Topo):
     "Network representation solely for CMS networks."
 
-    def __init__(self, hv_num=2, fb_num=1, **opts):
+    def __init__(self, hv_num=2, fb_num=1, fabric="pox", hv_switch=None,
+                 **opts):
         """Init.
            hv_num: number of HV-switches
-           fb_num: number of fabric-switches"""
+           fb_num: number of fabric-switches
+           fabric: fabric-switch type (see FABRIC_SWITCHES)
+           hv_switch: HV-switch type (see HV_SWITCHES), or None for the
+                      switch class of the network"""
         super(CMSTopo, self).__init__(**opts)
 
-        self.hv_num = hv_num
-        self.fb_num = fb_num
+        assert fabric in FABRIC_SWITCHES, "No such fabric: %s" % fabric
+        assert hv_switch is None or hv_switch in HV_SWITCHES, \
+               "No such hv_switch: %s" % hv_switch
+        self.hv_num = int(hv_num)
+        self.fb_num = int(fb_num)
+        self.fabric_cls = FABRIC_SWITCHES[fabric]
+        self.hv_cls = HV_SWITCHES.get(hv_switch)
+        self.fabric = fabric
+        self.hv_switch = hv_switch
+        self.fb_count = 0
+
+    def topoOpts(self):
+        """Return the options recreating this topology (persisted in the
+           CMSnet config)."""
+        return {"hv_num": self.hv_num, "fb_num": self.fb_num,
+                "fabric": self.fabric, "hv_switch": self.hv_switch,
+                "hopts": self.hopts, "sopts": self.sopts,
+                "lopts": self.lopts}
+
+    def nextFabricName(self, prefix):
+        """Return a new fabric-switch name, numbered after the HV-switches
+           (the number gives the dpid)."""
+        self.fb_count += 1
+        return '%s%s' % (prefix, self.hv_num + self.fb_count)
 
     def addHVSwitch(self, name, **opts):
         """Convenience method: Add hypervisor-representing to graph.
@@ -34,6 +73,8 @@ def addHVSwitch(self, name, **opts):
            opts: HV-switch options
            returns: HV-switch name"""
         opts.update({"cms_type": "hypervisor"})
+        if self.hv_cls and "cls" not in opts:
+            opts.update({"cls": self.hv_cls})
         result = self.addSwitch(name, **opts)
         return result
 
@@ -42,18 +83,20 @@ def addFabricSwitch(self, name, **opts):
            name: fabric-switch name
            opts: fabric-switch options
            returns: fabric-switch name"""
-        opts.update({"cms_type": "fabric", "cls": POXNormalSwitch})
+        opts.update({"cms_type": "fabric"})
+        if "cls" not in opts:
+            opts.update({"cls": self.fabric_cls})
         result = self.addSwitch(name, **opts)
         return result
 
     def isHVSwitch(self, n):
         '''Returns true if node is switch and represents a hypervisor.'''
-        info = self.node_info[n]
+        info = self.nodeInfo(n)
         return self.isSwitch(n) and info.get('cms_type') == "hypervisor"
 
     def isFabricSwitch(self, n):
         '''Returns true if node is switch and represents (part of) a fabric.'''
-        info = self.node_info[n]
+        info = self.nodeInfo(n)
         return self.isSwitch(n) and info.get('cms_type') == "fabric"
 
     def hvSwitches(self, sort=True):
@@ -108,4 +151,119 @@ def __init__(self, **opts):
             self.addLink(switch, fabric)
 
 
+class CMSMultipathTopo(CMSTopo):
+    "Base of CMS topologies with several paths between HV-switches."
+
+    def __init__(self, multipath="ecmp", **opts):
+        """Init.
+           multipath: forwarding over the paths (see MULTIPATH_MODES)
+           opts: Options"""
+        opts.setdefault("fabric", "ovs")
+        super(CMSMultipathTopo, self).__init__(**opts)
+
+        assert multipath in MULTIPATH_MODES, \
+               "No such multipath mode: %s" % multipath
+        assert self.fabric == "ovs", "Fabric with loops needs fabric=ovs"
+        self.multipath = multipath
+
+    def topoOpts(self):
+        opts = super(CMSMultipathTopo, self).topoOpts()
+        opts["multipath"] = self.multipath
+        return opts
+
+    def addMultipathSwitch(self, name, uplinks):
+        """Add fabric-switch forwarding with the multipath mode.
+           name: fabric-switch name
+           uplinks: names of the neighbor switches that are up
+           returns: fabric-switch name"""
+        if self.multipath == "ecmp":
+            return self.addFabricSwitch(name, cls=OVSMultipathSwitch,
+                                        uplinks=uplinks)
+        return self.addFabricSwitch(name, cls=OVSNormalSwitch, stp=True)
+
+
+class CMSLeafSpineTopo(CMSMultipathTopo):
+    """Leaf-spine topology: hv_num HV-switches spread over leaf_num leaf
+       switches, each linked to all spine_num spine switches."""
+
+    def __init__(self, spine_num=2, leaf_num=2, **opts):
+        """Init.
+           spine_num: number of spine switches
+           leaf_num: number of leaf switches
+           opts: Options"""
+        super(CMSLeafSpineTopo, self).__init__(**opts)
+
+        self.spine_num = int(spine_num)
+        self.leaf_num = int(leaf_num)
+        self.fb_num = self.spine_num + self.leaf_num
+
+        spines = [self.nextFabricName('spine')
+                  for i in range(self.spine_num)]
+        leaves = [self.nextFabricName('leaf') for i in range(self.leaf_num)]
+        for spine in spines:
+            self.addMultipathSwitch(spine, [])
+        for leaf in leaves:
+            self.addMultipathSwitch(leaf, spines)
+            for spine in spines:
+                self.addLink(leaf, spine)
+
+        for i in irange(1, self.hv_num):
+            switch = self.addHVSwitch('s%s' % i)
+            self.addLink(switch, leaves[(i - 1) % self.leaf_num])
+
+    def topoOpts(self):
+        opts = super(CMSLeafSpineTopo, self).topoOpts()
+        opts.update({"spine_num": self.spine_num, "leaf_num": self.leaf_num})
+        return opts
+
+
+class CMSFatTreeTopo(CMSMultipathTopo):
+    """k-ary fat-tree topology: k pods of k/2 edge and k/2 aggregation
+       switches, and (k/2)^2 core switches. Up to k^3/4 HV-switches (all
+       by default) are spread over the edge switches."""
+
+    def __init__(self, k=4, **opts):
+        """Init.
+           k: number of ports of the fabric switches (even)
+           opts: Options"""
+        k = int(k)
+        assert k >= 2 and k % 2 == 0, "k must be even"
+        opts.setdefault("hv_num", k ** 3 / 4)
+        super(CMSFatTreeTopo, self).__init__(**opts)
+
+        assert self.hv_num <= k ** 3 / 4, "At most k^3/4 HV-switches"
+        self.k = k
+        half = k / 2
+        self.fb_num = half * half + k * k
+
+        cores = [self.nextFabricName('core') for i in range(half * half)]
+        for core in cores:
+            self.addMultipathSwitch(core, [])
+        edges = []
+        for pod in range(k):
+            aggs = [self.nextFabricName('agg') for i in range(half)]
+            for a, agg in enumerate(aggs):
+                # Aggregation switch a of every pod links to the same cores.
+                uplinks = cores[a * half:(a + 1) * half]
+                self.addMultipathSwitch(agg, uplinks)
+                for core in uplinks:
+                    self.addLink(agg, core)
+            for i in range(half):
+                edge = self.nextFabricName('edge')
+                self.addMultipathSwitch(edge, aggs)
+                for agg in aggs:
+                    self.addLink(edge, agg)
+                edges.append(edge)
+
+        # Round robin over the edge switches, so that all pods are used.
+        for i in irange(1, self.hv_num):
+            switch = self.addHVSwitch('s%s' % i)
+            self.addLink(switch, edges[(i - 1) % len(edges)])
+
+    def topoOpts(self):
+        opts = super(CMSFatTreeTopo, self).topoOpts()
+        opts["k"] = self.k
+        return opts
+
+
 
@@ -6,12 +6,16 @@
 The destination of Dummy should be at the very end of the file.
 
 The destination of POXNormalSwitch should be after all other switches.
+
+The destination of OVSNormalSwitch should be after OVSSwitch.
 """
 
 import os
 import re
 import signal
 import select
+import socket
+from time import sleep, time
 from subprocess import Popen, PIPE, STDOUT
 from operator import or_
 
@@ -20,7 +24,7 @@
                            numCores, retry, mountCgroups )
 from mininet.moduledeps import moduleDeps, pathCheck, OVS_KMOD, OF_KMOD, TUN
 from mininet.link import Link, Intf, TCIntf
-from mininet.node import Node, Host, Switch
+from mininet.node import Node, Host, Switch, OVSSwitch
 
 
 
@@ -36,7 +40,12 @@
 
 class Dummy( Node ):
     "A dummy is simply a Node"
-    pass
+    reusePorts = True  # Parked VMs come and go; keep port numbers dense
+
+    def run( self, cmd ):
+        """Run a shell command in the namespace of the dummy, in a process
+           of its own; unlike cmd(), it may be called from many threads."""
+        return quietRun( [ 'mnexec', '-a', str( self.pid ), 'sh', '-c', cmd ] )
 
 
 
@@ -57,12 +66,193 @@ def format_pox_extra( extra ):
     double_quote_slash = single_quote_slash.replace("\"", "\\\"")
     return double_quote_slash
 
+def portctl_request( path, line, timeout, deadline ):
+    """Send a command line to a pox_portctl socket, retrying the connection
+       until deadline (POX may still be starting).
+       returns: reply words, or None if the socket is unavailable"""
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+            break
+        except socket.error:
+            sock.close()
+            if time() >= deadline:
+                return None
+            sleep(0.05)
+    try:
+        f = sock.makefile('r+')
+        f.write(line + "\n")
+        f.flush()
+        reply = f.readline().split()
+    except socket.error as e:
+        reply = ["error", str(e)]
+    finally:
+        sock.close()
+    return reply if reply else ["error", "no reply"]
+
+
+class POXWorkerPool( object ):
+    """Shared POX processes (workers), each hosting many POXSwitch datapaths
+       through pox_portctl.py, instead of one POX process per switch.
+
+       Datapaths are sharded over the workers by dpid. Switches with the
+       same personal controller type share the workers of that type, and
+       with them one personal controller per worker (on a port of its own);
+       switches with a remote controller use workers without one. Workers
+       run in the root namespace, so only switches there can use them."""
+
+    default = None   # Pool used by switches given pool=True
+
+    def __init__( self, workers=None, base_port=6700, pin=True,
+                  poxCoreDir=None ):
+        """Init.
+           workers: number of workers per controller type (default: cores)
+           base_port: first TCP port of the personal controllers
+           pin: pin each worker to a core (taskset)?
+           poxCoreDir: POX directory (default: that of the first switch)"""
+        self.workers = int(workers) if workers else numCores()
+        self.next_port = int(base_port)
+        self.pin = pin and bool(quietRun('which taskset').strip())
+        self.poxCoreDir = poxCoreDir
+        self.keyToWorker = {}   # (controller type, shard) to worker dict
+        self.startup_wait = 5.0     # Time for a worker to come up (s)
+
+    @classmethod
+    def get( cls, pool ):
+        """Return the pool meant by a pool switch parameter: a pool, True
+           (the default pool) or a number of workers (the default pool,
+           created with that many workers). None if no pool is meant."""
+        if isinstance(pool, cls):
+            return pool
+        if isinstance(pool, basestring):
+            pool = pool.lower()
+            if pool in ("", "0", "false", "no", "none"):
+                return None
+            pool = True if pool in ("true", "yes") else int(pool)
+        if not pool:
+            return None
+        if cls.default is None:
+            workers = None if pool is True else pool
+            cls.default = cls(workers=workers)
+        return cls.default
+
+    def _key( self, switch ):
+        "Return the (controller type, shard) of the worker of a switch."
+        ctype = None if switch.use_remote_controller else switch.controller_type
+        return (ctype, int(switch.dpid, 16) % self.workers)
+
+    def _start_worker( self, key, poxCoreDir ):
+        "Start the POX process of a worker."
+        ctype, shard = key
+        tag = "%s-%i" % ((ctype or "remote").replace(".", "_"), shard)
+        path = "/tmp/pox-worker-%s.portctl" % tag
+        args = [poxCoreDir + "/pox.py"]
+        port = None
+        if ctype is None:
+            args += ["--no-openflow"]
+        else:
+            port = self.next_port
+            self.next_port += 1
+            args += ctype.split() + ["openflow.of_01", "--address=127.0.0.1",
+                                     "--port=%i" % port]
+        args += ["pox_portctl", "--path=" + path]
+        if self.pin:
+            args = ["taskset", "-c", str(shard % numCores())] + args
+        env = dict(os.environ)
+        cmsnet_dir = os.path.dirname(os.path.abspath(__file__))
+        env["PYTHONPATH"] = cmsnet_dir + ":" + env.get("PYTHONPATH", "")
+        log = open("/tmp/pox-worker-%s.log" % tag, "w")
+        proc = Popen(args, cwd=poxCoreDir, env=env, stdout=log, stderr=STDOUT)
+        log.close()
+        worker = {"proc": proc, "path": path, "port": port,
+                  "start_time": time(), "dpids": set()}
+        self.keyToWorker[key] = worker
+        debug("Started POX worker %s (pid %d)\n" % (tag, proc.pid))
+        return worker
+
+    def _stop_worker( self, key ):
+        "Stop the POX process of a worker."
+        worker = self.keyToWorker.pop(key)
+        if worker["proc"].poll() is None:
+            worker["proc"].terminate()
+            worker["proc"].wait()
+        if os.path.exists(worker["path"]):
+            os.remove(worker["path"])
+
+    def _request( self, worker, *args ):
+        "Send a command to a worker. True if it worked."
+        line = " ".join(str(arg) for arg in args)
+        reply = portctl_request(worker["path"], line, self.startup_wait,
+                                worker["start_time"] + self.startup_wait)
+        if reply is None or reply[0] != "ok":
+            warn("POX worker command %s failed: %s\n" %
+                 (line, " ".join(reply[1:]) if reply else "unavailable"))
+            return False
+        return True
+
+    def worker( self, switch ):
+        "Return the worker of a switch, or None if it has none."
+        return self.keyToWorker.get(self._key(switch))
+
+    def add_dp( self, switch ):
+        """Add (or re-add) the datapath of a switch to its worker.
+           returns: the worker, or None on failure"""
+        key = self._key(switch)
+        worker = self.keyToWorker.get(key)
+        if worker is not None and worker["proc"].poll() is not None:
+            warn("POX worker of %s died; restarting it\n" % switch.name)
+            self._stop_worker(key)
+            worker = None
+        if worker is None:
+            worker = self._start_worker(key, self.poxCoreDir or
+                                        switch.poxCoreDir)
+        if switch.dpid in worker["dpids"]:
+            self._request(worker, "del-dp", switch.dpid)
+            worker["dpids"].discard(switch.dpid)
+        if worker["port"] is None:
+            address, port = switch.controller_ip, switch.controller_port
+        else:
+            address, port = "127.0.0.1", worker["port"]
+        ports = ",".join(switch.intf_ports) or "-"
+        if not self._request(worker, "add-dp", switch.dpid, switch.name,
+                             address, port, switch.max_retry_delay, ports):
+            if not worker["dpids"]:
+                self._stop_worker(key)
+            return None
+        worker["dpids"].add(switch.dpid)
+        return worker
+
+    def del_dp( self, switch ):
+        "Remove the datapath of a switch; stop its worker if left empty."
+        key = self._key(switch)
+        worker = self.keyToWorker.get(key)
+        if worker is None or switch.dpid not in worker["dpids"]:
+            return
+        self._request(worker, "del-dp", switch.dpid)
+        worker["dpids"].discard(switch.dpid)
+        if not worker["dpids"]:
+            self._stop_worker(key)
+
+    def stop( self ):
+        "Stop all workers."
+        for key in self.keyToWorker.keys():
+            self._stop_worker(key)
+
+
 class POXSwitch( Switch ):
     "Switch to run a POX application."
 
+    # Hot-added ports (portctl) get our port numbers, but when POX has to
+    # (re)start the switch, it numbers the --ports list 1..n; reusing freed
+    # numbers keeps ours dense, so that both numberings mostly agree.
+    reusePorts = True
+
     def __init__( self, name, control_flag=False, control_type="",
                   address="127.0.0.1", port=6633, ports="", dpid=None,
-                  max_retry_delay=16, extra="", listenPort=None, **params):
+                  max_retry_delay=16, extra="", listenPort=None, portctl=True,
+                  pool=None, **params):
         """Init.
            name: name for switch
            control_flag: spawn personal controller?
@@ -74,6 +264,9 @@ def __init__( self, name, control_flag=False, control_type="",
            max_retry_delay: max time between retries to connect to controller
            extra: extra parameters
            listenPort: port to listen on for dpctl connections
+           portctl: add/remove ports in place (see pox_portctl.py)?
+           pool: POXWorkerPool to host the datapath in, True for the
+                 default pool, or its number of workers (None: own POX)
            params: Node parameters (see config() for details)"""
         Switch.__init__(self, name, dpid, listenPort=listenPort, **params)
 
@@ -90,6 +283,7 @@ def __init__( self, name, control_flag=False, control_type="",
         ps += "\n  max_retry_delay\t"      + str(max_retry_delay)
         ps += "\n  extra          \t"      + str(extra)
         ps += "\n  listenPort     \t"      + str(listenPort)
+        ps += "\n  pool           \t"      + str(pool)
         ps += "\n  params         \t"      + str(params)
         if self.print_personal_debug: print ps
 
@@ -118,6 +312,17 @@ def __init__( self, name, control_flag=False, control_type="",
         self.intf_ports = []
         self.pox_pid = None
         self.started_switch = False
+        self.portctl = portctl
+        self.portctl_path = "/tmp/" + self.name + ".portctl"
+        self.portctl_wait = 3.0      # Time for POX to open portctl (s)
+        self.start_time = None
+        self.pool = POXWorkerPool.get(pool)
+        if self.pool and self.inNamespace:
+            warn("POX worker pool unusable in a namespace; "
+                 "%s runs its own POX.\n" % self.name)
+            self.pool = None
+        if self.pool:
+            self.portctl = True     # Ports are only changed in place.
 
         ps = "Input to POXSwitch.__init__(): "
         ps += "\n  poxCoreDir      \t"      + str(self.poxCoreDir)
@@ -158,6 +363,8 @@ def _build_cmd_args( self ):
         self.cmd_args += " --dpid="            + str(self.dpid)
         self.cmd_args += " --ports="           + ",".join(self.intf_ports)
         self.cmd_args += " --extra="           + ",".join(self.extra)
+        if self.portctl:
+            self.cmd_args += " pox_portctl --path=" + self.portctl_path
 
         self.cmd_log = "/tmp/" + self.name + ".log"
         self.cmd( 'echo "" > %s' % self.cmd_log )  # Clear previous
@@ -165,6 +372,10 @@ def _build_cmd_args( self ):
 
         if self.print_personal_debug: print "WARN: self.listenPort is UNUSED"
         self.command = self.run_file
+        if self.portctl:            # pox_portctl lives next to this file.
+            cmsnet_dir = os.path.dirname(os.path.abspath(__file__))
+            self.command = ("PYTHONPATH=%s:$PYTHONPATH " % cmsnet_dir +
+                            self.command)
         self.command += " " + self.ctrl_args
         self.command += " " + self.cmd_args
         self.command += " " + self.cmd_tail
@@ -172,6 +383,17 @@ def _build_cmd_args( self ):
 
     def _run_pox_switch( self ):
         "Run the POX switch"
+        if self.pool:
+            worker = self.pool.add_dp(self)
+            if worker is not None:
+                self.portctl_path = worker["path"]
+                self.started_switch = True
+                self.start_time = time()
+                return
+            warn("%s could not join a POX worker; "
+                 "running its own POX.\n" % self.name)
+            self.pool = None
+            self.portctl_path = "/tmp/" + self.name + ".portctl"
         if self.pox_pid is not None:
             warn( "Killing old pox switch to restart new one." )
             self._kill_pox_switch()
@@ -179,9 +401,14 @@ def _run_pox_switch( self ):
         self.cmd( self.command, printPid=True )
         self.pox_pid = self.lastPid
         self.started_switch = True
+        self.start_time = time()
 
     def _kill_pox_switch( self ):
         "Kill the POX switch"
+        if self.pool:
+            self.pool.del_dp(self)
+            self.started_switch = False
+            return
         if self.pox_pid is None:
             error( "No pox switch process to kill" )
             return
@@ -190,36 +417,82 @@ def _kill_pox_switch( self ):
         self.pox_pid = None
         self.started_switch = False
 
-    def attach( self, intf ):
-        "Connect a data port"
-        self.cmd( 'ifconfig', intf, 'up' )
+    def _portctl_cmd( self, *args ):
+        """Send a command to the running POX switch (see pox_portctl.py).
+           returns: reply words after "ok", or None on failure"""
+        if not self.portctl or not self.started_switch:
+            return None
+        if self.pool:                 # Name our datapath in the worker.
+            args = args + (self.dpid,)
+        line = " ".join(str(arg) for arg in args)
+        reply = portctl_request(self.portctl_path, line, self.portctl_wait,
+                                self.start_time + self.portctl_wait)
+        if reply is None:
+            warn("portctl of %s unavailable\n" % self.name)
+            return None
+        if reply[0] != "ok":
+            warn("portctl %s on %s failed: %s\n" %
+                 (line, self.name, " ".join(reply[1:])))
+            return None
+        return reply[1:]
+
+    def _hot_add( self, intf ):
+        "Add a port to the running POX switch. True if it worked."
+        port = self.ports.get(intf, -1)
+        return self._portctl_cmd('add-port', intf, port) is not None
+
+    def _hot_del( self, intf ):
+        "Remove a port from the running POX switch. True if it worked."
+        return self._portctl_cmd('del-port', intf) is not None
+
+    def _add_intf_port( self, intf ):
+        "Add intf to the ports given to POX. True if added."
         intf_name = str(intf)
-
         if self.input_intf_ports:     # Only add specified ports.
             if intf_name in self.input_intf_ports:
                 self.intf_ports.append(intf_name)
-        else:                         # Add all ()-eth# ports.
-            if self.name in intf_name:
+                return True
+        else:                         # Add all ()-eth# ports,
+            if (self.name in intf_name or  # or moved ones (CMSnet).
+                    getattr(intf, 'node', None) is self):
                 self.intf_ports.append(intf_name)
+                return True
+        return False
+
+    def attach( self, intf ):
+        "Connect a data port"
+        self.attachIntfs( [ intf ] )
+
+    def attachIntfs( self, intfs ):
+        """Connect several data ports. A running switch gets them in place,
+           or is restarted (only once) if that fails."""
+        added = []
+        for intf in intfs:
+            self.cmd( 'ifconfig', intf, 'up' )
+            if self._add_intf_port(intf):
+                added.append(intf)
         if self.print_personal_debug:
             print "intf_ports currently: "+str(self.intf_ports)
 
-        # If already started, we need to restart the switch.
-        if self.started_switch:
-            self._run_pox_switch()
+        # If already started, add the ports in place or restart the switch.
+        if self.started_switch and added:
+            if not all([self._hot_add(intf) for intf in added]):
+                self._run_pox_switch()
 
     def detach( self, intf ):
         "Disconnect a data port"
         self.cmd( 'ifconfig', intf, 'down' )
         intf_name = str(intf)
-        if intf_name in self.intf_ports:
+        removed = intf_name in self.intf_ports
+        if removed:
             self.intf_ports.remove(intf_name)
         if self.print_personal_debug:
             print "intf_ports currently: "+str(self.intf_ports)
 
-        # If already started, we need to restart the switch.
-        if self.started_switch:
-            self._run_pox_switch()
+        # If already started, remove the port in place or restart the switch.
+        if self.started_switch and removed:
+            if not self._hot_del(intf):
+                self._run_pox_switch()
 
     def start( self, controllers ):
         "Start up a new POX OpenFlow switch"
@@ -262,8 +535,143 @@ class POXNormalSwitch( POXSwitch ):
     "Normal l2_pair Switch to run a POX application."
 
     def __init__( self, name, **params):
-        params.update({"inNamespace":True})
+        # The namespace keeps personal controllers apart; pooled switches
+        # share theirs, one per worker, in the root namespace.
+        if not POXWorkerPool.get(params.get("pool")):
+            params.update({"inNamespace":True})
         POXSwitch.__init__(self, name, control_flag=True,
                            control_type="forwarding.hub", **params)
 
 
+
+
+
+#
+#   OVSNormalSwitch -------------------------------------------------------
+#
+
+
+
+class OVSNormalSwitch( OVSSwitch ):
+    """Open vSwitch kernel bridge forwarding on its own as a MAC learning
+       switch (NORMAL action), with no controller. The kernel datapath
+       counterpart of POXNormalSwitch, for fabrics at line rate."""
+    forgets = False  # forget() does nothing; moved VMs announce themselves
+
+    def __init__( self, name, stp=False, **params ):
+        """Init.
+           name: name for switch
+           stp: run spanning tree, for fabrics with loops (ports take
+                about 30 s to start forwarding)"""
+        params.update({"failMode": "standalone"})
+        OVSSwitch.__init__( self, name, **params )
+        self.stp = stp
+
+    def start( self, controllers ):
+        "Start up the bridge, ignoring controllers."
+        OVSSwitch.start( self, [] )
+        if self.stp:
+            self.cmd( 'ovs-vsctl set bridge', self, 'stp_enable=true' )
+        self.cmd( 'ovs-ofctl add-flow', self, 'priority=0,actions=NORMAL' )
+
+    def forget( self, mac ):
+        """Forget where a MAC address was (e.g. of a VM that just moved).
+           Nothing to do here: the NORMAL action learns the new port from
+           the gratuitous ARP the VM sends after moving, and a full
+           fdb/flush would make the whole fabric flood."""
+        pass
+
+
+class OVSMultipathSwitch( OVSNormalSwitch ):
+    """Fabric switch of a multi-rooted tree (leaf-spine, fat-tree) that
+       spreads traffic over all its uplinks (ECMP) instead of blocking
+       them like spanning tree.
+
+       Ports are down (towards the hypervisors) or up (uplinks). MAC
+       addresses are learned on every port (table 1): on a down port as
+       that port, on an up port as "above", without the port, so that
+       frames for it go up one uplink chosen by a hash of their flow
+       (bundle action). Frames for unknown destinations (and broadcasts)
+       coming from below are flooded down and sent up one uplink; frames
+       from above only ever go down. So frames never go back up, and the
+       tree has no loops without blocking any link.
+
+       The result of the lookup in table 1 is left in registers for table
+       2: reg0 is the down port of the destination, reg1 is 1 if it is
+       above, and both are 0 if it is unknown."""
+    forgets = True  # MACs learned in table 1 must be deleted on moves
+
+    def __init__( self, name, uplinks=(), **params ):
+        """Init.
+           name: name for switch
+           uplinks: names of the neighbor switches that are up"""
+        OVSNormalSwitch.__init__( self, name, **params )
+        self.uplinks = list( uplinks )
+        self.learn_timeout = 300    # Idle time before forgetting a MAC (s)
+
+    def attach( self, intf ):
+        "Connect a data port, with the OpenFlow port number we know."
+        self.cmd( 'ovs-vsctl add-port', self, intf,
+                  '-- set Interface', intf,
+                  'ofport_request=%d' % self.ports[ intf ] )
+        self.cmd( 'ifconfig', intf, 'up' )
+        self.TCReapply( intf )
+
+    def portLists( self ):
+        "Return lists of down and up port numbers."
+        down, up = [], []
+        for intf in self.intfList():
+            if not intf.link or intf.IP():
+                continue
+            peer = intf.link.intf2 if intf.link.intf1 is intf else \
+                   intf.link.intf1
+            if peer.node.name in self.uplinks:
+                up.append( self.ports[ intf ] )
+            else:
+                down.append( self.ports[ intf ] )
+        return down, up
+
+    def start( self, controllers ):
+        "Start up the bridge with multipath flows."
+        OVSSwitch.start( self, [] )
+        self.cmd( 'ovs-ofctl del-flows', self )
+        down, up = self.portLists()
+        learn = ( 'learn(table=1,idle_timeout=%d,cookie=0x1,'
+                  'NXM_OF_ETH_DST[]=NXM_OF_ETH_SRC[],%%s)' %
+                  self.learn_timeout )
+        learnDown = learn % 'load:NXM_OF_IN_PORT[]->NXM_NX_REG0[0..15]'
+        learnUp = learn % 'load:0x1->NXM_NX_REG1[0..0]'
+        lookup = 'resubmit(,1),resubmit(,2)'
+        flood = [ 'output:%d' % p for p in down ]
+        if len( up ) > 1:
+            upward = [ 'bundle(symmetric_l4,0,hrw,ofport,slaves:%s)' %
+                       ','.join( str( p ) for p in up ) ]
+        else:
+            upward = [ 'output:%d' % p for p in up ]
+        flows = [ 'table=1,priority=0,actions=drop',
+                  'table=2,priority=10,actions=output:NXM_NX_REG0[0..15]' ]
+        for p in down:
+            flows.append( 'table=0,in_port=%d,actions=%s,%s' %
+                          ( p, learnDown, lookup ) )
+            # Known to be above: up only; unknown: down and up.
+            flows.append( 'table=2,priority=30,reg1=1,in_port=%d,actions=%s'
+                          % ( p, ','.join( upward ) or 'drop' ) )
+            flows.append( 'table=2,priority=20,reg0=0,in_port=%d,actions=%s'
+                          % ( p, ','.join( flood + upward ) or 'drop' ) )
+        for p in up:
+            flows.append( 'table=0,in_port=%d,actions=%s,%s' %
+                          ( p, learnUp, lookup ) )
+            # Never back up: known to be above is stale; unknown: down.
+            flows.append( 'table=2,priority=30,reg1=1,in_port=%d,'
+                          'actions=drop' % p )
+            flows.append( 'table=2,priority=20,reg0=0,in_port=%d,actions=%s'
+                          % ( p, ','.join( flood ) or 'drop' ) )
+        for flow in flows:
+            self.cmd( 'ovs-ofctl add-flow', self, '"%s"' % flow )
+
+    def forget( self, mac ):
+        "Forget where a MAC address was (e.g. of a VM that just moved)."
+        self.cmd( 'ovs-ofctl del-flows', self,
+                  'table=1,cookie=0x1/-1,dl_dst=%s' % mac )
+
+
@@ -0,0 +1,214 @@
+"""
+Port control channel for POX software switches (datapaths.pcap_switch).
+
+This is a POX component, loaded into the POX process of a POXSwitch next to
+datapaths.pcap_switch. It listens on a unix socket and adds or removes pcap
+ports of the running switch in place, so that CMSnet can move VM links
+without restarting POX (which drops all flows and the controller
+connection).
+
+It also lets one POX process (a worker of a POXWorkerPool) host many
+datapaths: add-dp creates a pcap switch connecting to the given controller,
+and del-dp removes it. With several datapaths, port commands name the
+datapath by its DPID.
+
+Protocol: one command per line, one reply line per command.
+
+  add-port NAME [PORT_NO [DPID]]    -> "ok PORT_NO" or "error MESSAGE"
+  del-port NAME [DPID]              -> "ok" or "error MESSAGE"
+  add-dp DPID NAME ADDRESS PORT MAX_RETRY_DELAY PORTS
+                                    -> "ok" or "error MESSAGE"
+                                       (PORTS: comma-separated, or -)
+  del-dp DPID                       -> "ok" or "error MESSAGE"
+  ping                              -> "ok"
+
+Usage (from the POX directory):
+  PYTHONPATH=/path/to/cmsnet ./pox.py datapaths.pcap_switch ... \\
+    pox_portctl --path=/tmp/s1.portctl
+"""
+
+import os
+import socket
+import threading
+
+from pox.core import core
+
+log = core.getLogger()
+
+TIMEOUT = 5   # Maximum time for the POX core to run a command (s)
+
+
+def _switches ():
+  "Return the dict of DPID to pcap switch of this POX process."
+  import pox.datapaths
+  if not hasattr(pox.datapaths, '_switches'):
+    pox.datapaths._switches = {}
+  return pox.datapaths._switches
+
+
+def _dpid (dpid):
+  "Convert a DPID string (as given to pcap_switch --dpid) to a number."
+  from pox.lib.util import str_to_dpid
+  return str_to_dpid(dpid)
+
+
+def _get_switch (dpid=None):
+  "Return the pcap switch with the given DPID (or the only one), or None."
+  switches = _switches()
+  if dpid is not None:
+    return switches.get(_dpid(dpid))
+  if len(switches) != 1:
+    return None
+  return switches.values()[0]
+
+
+def _add_port (name, port_no=-1, dpid=None):
+  sw = _get_switch(dpid)
+  if sw is None:
+    raise RuntimeError("no switch")
+  for p in sw.ports.values():
+    if getattr(p, 'name', None) == name:
+      return p.port_no            # Already there.
+  sw.add_interface(name, port_no=port_no)
+  for p in sw.ports.values():
+    if getattr(p, 'name', None) == name:
+      return p.port_no
+  raise RuntimeError("port %s not added" % name)
+
+
+def _del_port (name, dpid=None):
+  sw = _get_switch(dpid)
+  if sw is None:
+    raise RuntimeError("no switch")
+  sw.remove_interface(name)
+
+
+_loop = None   # IO loop shared by the OpenFlow connections of added DPs
+_workers = {}  # DPID to the OpenFlowWorker connecting its added DP
+
+def _add_dp (dpid, name, address, port, max_retry_delay, ports):
+  global _loop
+  import pox.datapaths
+  from pox.datapaths.pcap_switch import PCapSwitch
+  from pox.lib.ioworker import RecocoIOLoop
+  switches = _switches()
+  if _dpid(dpid) in switches:
+    raise RuntimeError("datapath %s exists" % dpid)
+  sw = PCapSwitch(dpid=_dpid(dpid), name=name, ports=ports)
+  switches[_dpid(dpid)] = sw
+  if _loop is None:
+    _loop = RecocoIOLoop()
+    _loop.start()
+  _workers[_dpid(dpid)] = pox.datapaths.OpenFlowWorker.begin(
+      loop=_loop, addr=address, port=port,
+      max_retry_delay=max_retry_delay, switch=sw)
+
+
+def _del_dp (dpid):
+  if _dpid(dpid) not in _workers:
+    if _dpid(dpid) in _switches():
+      raise RuntimeError("datapath %s was not added by add-dp" % dpid)
+    raise RuntimeError("no switch")
+  worker = _workers.pop(_dpid(dpid))
+  sw = _switches().pop(_dpid(dpid))
+  errors = []
+  try:
+    worker.do_reconnect = False   # Else the BackoffWorker reconnects.
+    worker.shutdown()
+  except Exception as e:
+    errors.append("OpenFlow worker: %s" % e)
+  for p in list(sw.ports.values()):
+    try:
+      sw.remove_interface(p.port_no)
+    except Exception as e:
+      errors.append("port %s: %s" % (p.port_no, e))
+  if errors:
+    raise RuntimeError("datapath %s not torn down: %s" %
+                       (dpid, "; ".join(errors)))
+
+
+def _call (f, *args):
+  """
+  Run f(*args) in the POX core thread and return its result.
+  """
+  result = {}
+  done = threading.Event()
+  def run ():
+    try:
+      result['value'] = f(*args)
+    except Exception as e:
+      result['error'] = e
+    done.set()
+  core.callLater(run)
+  if not done.wait(TIMEOUT):
+    raise RuntimeError("timed out")
+  if 'error' in result:
+    raise result['error']
+  return result.get('value')
+
+
+def _handle (line):
+  "Execute a command line and return the reply line."
+  args = line.split()
+  if not args:
+    return "error empty command"
+  try:
+    if args[0] == 'ping' and len(args) == 1:
+      return "ok"
+    if args[0] == 'add-port' and len(args) in (2, 3, 4):
+      port_no = int(args[2]) if len(args) >= 3 else -1
+      dpid = args[3] if len(args) == 4 else None
+      return "ok %s" % _call(_add_port, args[1], port_no, dpid)
+    if args[0] == 'del-port' and len(args) in (2, 3):
+      dpid = args[2] if len(args) == 3 else None
+      _call(_del_port, args[1], dpid)
+      return "ok"
+    if args[0] == 'add-dp' and len(args) == 7:
+      ports = [p for p in args[6].split(",") if p and p != "-"]
+      _call(_add_dp, args[1], args[2], args[3], int(args[4]),
+            int(args[5]), ports)
+      return "ok"
+    if args[0] == 'del-dp' and len(args) == 2:
+      _call(_del_dp, args[1])
+      return "ok"
+    return "error bad command: %s" % line
+  except Exception as e:
+    log.warn("%s failed: %s", line, e)
+    return "error %s" % e
+
+
+def _serve (sock):
+  "Accept connections and handle their commands."
+  while core.running:
+    try:
+      conn, _addr = sock.accept()
+    except socket.error:
+      break
+    try:
+      f = conn.makefile('r+')
+      for line in f:
+        f.write(_handle(line.strip()) + "\n")
+        f.flush()
+    except socket.error:
+      pass
+    finally:
+      conn.close()
+
+
+def launch (path):
+  if os.path.exists(path):
+    os.remove(path)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.bind(path)
+  sock.listen(4)
+
+  def cleanup (event):
+    sock.close()
+    if os.path.exists(path):
+      os.remove(path)
+  core.addListenerByName("DownEvent", cleanup)
+
+  t = threading.Thread(target=_serve, args=(sock,), name="portctl")
+  t.daemon = True
+  t.start()
+  log.debug("Port control on %s", path)
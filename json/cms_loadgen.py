@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+"""
+Load generator for the controller side of CMS messages (mininet_service.py).
+
+Sends a synthetic stream of instantiated/migrated/destroyed events for a
+set of VMs and hypervisors, the way CMSnet does (newline-framed JSON on
+channel CMS, sequence numbered, optionally batched), at a given rate, and
+times each event until the controller acknowledges it. At the end it
+prints the sustained rate, the latency percentiles and the events never
+acknowledged (dropped).
+
+  cms_loadgen.py [--address A] [--port 7790] [--rate 1000] [--duration 10]
+                 [--vms 100] [--hvs 10] [--batch 1] [--mix 1,8,1]
+
+It can also stand in for the controller, for offline runs or to measure
+the generator itself (it acknowledges like CMSBot does):
+
+  cms_loadgen.py --serve [--port 7790] [--delay 0]
+"""
+
+import sys
+import json
+import time
+import random
+import socket
+import select
+import argparse
+import threading
+from collections import deque
+
+decoder = json.JSONDecoder()
+
+
+def read_msgs (sock, buf):
+  """
+  Receive from sock and return (messages, rest of buffer).
+  Raises socket.error when the connection is closed.
+  """
+  data = sock.recv(65536)
+  if not data:
+    raise socket.error("connection closed")
+  buf += data
+  msgs = []
+  while True:
+    buf = buf.lstrip()
+    if not buf:
+      break
+    try:
+      msg, end = decoder.raw_decode(buf)
+    except ValueError:
+      break                       # Incomplete
+    msgs.append(msg)
+    buf = buf[end:]
+  return msgs, buf
+
+
+def percentile (values, fraction):
+  "Return the value at the given fraction of the sorted values."
+  if not values:
+    return None
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+#~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+# Stand-in server
+#~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+
+def serve_connection (con, delay):
+  "Acknowledge the CMS events of a connection until it closes."
+  buf = ""
+  last_seq = None
+  events = 0
+  try:
+    while True:
+      msgs, buf = read_msgs(con, buf)
+      replies = []
+      for msg in msgs:
+        cmd = msg.get("cmd")
+        if cmd == "hello":
+          replies.append({"CHANNEL": "CMS", "cmd": "sync",
+                          "last_seq": last_seq})
+          continue
+        if cmd == "join_channel" or msg.get("CHANNEL") != "CMS":
+          continue
+        batch = msg.get("events") if cmd == "batch" else [msg]
+        for e in batch:
+          if delay:
+            time.sleep(delay)
+          events += 1
+          if e.get("seq") is not None:
+            last_seq = max(last_seq, e["seq"])
+        if last_seq is not None:
+          replies.append({"CHANNEL": "CMS", "cmd": "ack", "seq": last_seq})
+      if replies:
+        con.sendall("".join(json.dumps(r) + "\n" for r in replies))
+  except socket.error:
+    pass
+  finally:
+    con.close()
+  print >>sys.stderr, "== Connection closed after %d events ==" % events
+
+
+def serve (args):
+  "Run the stand-in server."
+  srv = socket.socket()
+  srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  srv.bind((args.address, args.port))
+  srv.listen(8)
+  print >>sys.stderr, "== Serving on %s:%d ==" % (args.address, args.port)
+  try:
+    while True:
+      con, _addr = srv.accept()
+      t = threading.Thread(target=serve_connection, args=(con, args.delay))
+      t.daemon = True
+      t.start()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    srv.close()
+
+
+#~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+# Load generator
+#~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+
+class Pool (object):
+  "Set of names with O(1) add, remove and random choice."
+
+  def __init__ (self, names=()):
+    self.names = list(names)
+    self.index = dict((n, i) for i, n in enumerate(self.names))
+
+  def __len__ (self):
+    return len(self.names)
+
+  def add (self, name):
+    self.index[name] = len(self.names)
+    self.names.append(name)
+
+  def remove (self, name):
+    i = self.index.pop(name)
+    last = self.names.pop()
+    if last != name:
+      self.names[i] = last
+      self.index[last] = i
+
+  def choice (self, rand):
+    return rand.choice(self.names)
+
+
+class EventStream (object):
+  """
+  Endless stream of consistent VM events: VMs are only migrated or
+  destroyed while running, and only instantiated while not.
+  """
+
+  def __init__ (self, vms, hvs, mix, seed=None):
+    self.random = random.Random(seed)
+    self.hvs = ["s%d" % (i + 1) for i in range(hvs)]
+    self.vmToHV = dict(("vm%d" % (i + 1), None) for i in range(vms))
+    self.stopped = Pool(sorted(self.vmToHV))
+    self.running = Pool()
+    self.mix = mix                # Weights of instantiated/migrated/destroyed
+
+  def _event (self, cmd, vm, hv, old_hv=None):
+    i = int(vm[2:])
+    e = {"cmd": cmd, "host": vm, "new_hv": hv,
+         "mac": "00:00:00:00:%02x:%02x" % (i >> 8 & 0xff, i & 0xff),
+         "ip": "10.0.%d.%d" % (i >> 8 & 0xff, i & 0xff)}
+    if old_hv:
+      e["old_hv"] = old_hv
+    return e
+
+  def next (self):
+    launch, migrate, destroy = self.mix
+    if not self.running:
+      migrate = destroy = 0       # Nothing to migrate or destroy
+    if not self.stopped:
+      launch = 0                  # Nothing to instantiate
+    r = self.random.random() * (launch + migrate + destroy)
+    if r < launch:
+      vm = self.stopped.choice(self.random)
+      new_hv = self.random.choice(self.hvs)
+      self.stopped.remove(vm)
+      self.running.add(vm)
+      self.vmToHV[vm] = new_hv
+      return self._event("instantiated", vm, new_hv)
+    vm = self.running.choice(self.random)
+    hv = self.vmToHV[vm]
+    if r < launch + destroy:
+      self.running.remove(vm)
+      self.stopped.add(vm)
+      self.vmToHV[vm] = None
+      return self._event("destroyed", vm, None, hv)
+    new_hv = self.random.choice(self.hvs)
+    if new_hv == hv and len(self.hvs) > 1:
+      new_hv = self.hvs[(self.hvs.index(hv) + 1) % len(self.hvs)]
+    self.vmToHV[vm] = new_hv
+    return self._event("migrated", vm, new_hv, hv)
+
+
+class LoadGenerator (object):
+  "Drives an event stream against the controller and measures it."
+
+  def __init__ (self, args):
+    self.args = args
+    mix = [float(w) for w in args.mix.split(",")]
+    assert len(mix) == 3, "--mix needs 3 weights"
+    self.stream = EventStream(args.vms, args.hvs, mix, args.seed)
+    self.seq = 0
+    self.pending = deque()        # (seq, send time) not acknowledged yet
+    self.lock = threading.Lock()
+    self.latencies = []
+    self.acked = 0
+    self.last_ack = None          # Time of the last acknowledgment
+    self.sock = None
+    self.done = threading.Event()
+
+  def connect (self):
+    sock = socket.create_connection((self.args.address, self.args.port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Join the CMS channel of the messenger, and say hello as CMSnet does.
+    sock.sendall(json.dumps({"CHANNEL": "", "cmd": "join_channel",
+                             "channel": "CMS", "json": True}) + "\n")
+    sock.sendall(json.dumps({"CHANNEL": "CMS", "cmd": "hello",
+                             "seq": 0}) + "\n")
+    # Number our events after those the controller has seen (which it
+    # would take for replays).
+    buf = ""
+    deadline = time.time() + 2.0
+    while time.time() < deadline:
+      if not select.select([sock], [], [], deadline - time.time())[0]:
+        break
+      msgs, buf = read_msgs(sock, buf)
+      syncs = [m for m in msgs if m.get("cmd") == "sync"]
+      if syncs:
+        self.seq = syncs[0].get("last_seq") or 0
+        break
+    else:
+      print >>sys.stderr, "== No sync from controller =="
+    self.first_seq = self.seq
+    self.sock = sock
+
+  def _ack (self, seq):
+    "Note that all events up to seq were acknowledged."
+    now = time.time()
+    with self.lock:
+      while self.pending and self.pending[0][0] <= seq:
+        _seq, sent = self.pending.popleft()
+        self.latencies.append(now - sent)
+        self.acked += 1
+        self.last_ack = now
+
+  def _read (self):
+    "Read acknowledgments until done."
+    buf = ""
+    while not self.done.is_set():
+      if not select.select([self.sock], [], [], 0.1)[0]:
+        continue
+      try:
+        msgs, buf = read_msgs(self.sock, buf)
+      except socket.error:
+        break
+      for msg in msgs:
+        if msg.get("cmd") == "ack" and msg.get("seq") is not None:
+          self._ack(msg["seq"])
+
+  def _message (self, events):
+    if len(events) == 1:
+      msg = dict(events[0])
+    else:
+      msg = {"cmd": "batch", "events": events}
+    msg["CHANNEL"] = "CMS"
+    msg["msg_level"] = "all"
+    return json.dumps(msg) + "\n"
+
+  def run (self):
+    "Send events for the duration; return the results dict."
+    args = self.args
+    self.connect()
+    reader = threading.Thread(target=self._read)
+    reader.daemon = True
+    reader.start()
+
+    interval = float(args.batch) / args.rate    # Between messages
+    start = time.time()
+    next_time = start
+    messages = 0
+    while time.time() - start < args.duration:
+      events = []
+      now = time.time()
+      for i in range(args.batch):
+        e = self.stream.next()
+        self.seq += 1
+        e["seq"] = self.seq
+        events.append(e)
+      with self.lock:
+        for e in events:
+          self.pending.append((e["seq"], now))
+      self.sock.sendall(self._message(events))
+      messages += 1
+      next_time += interval
+      delay = next_time - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      elif delay < -1.0:
+        next_time = time.time()   # Fell behind; do not burst to catch up.
+    send_time = time.time() - start
+
+    # Wait for the last acknowledgments.
+    deadline = time.time() + args.grace
+    while time.time() < deadline:
+      with self.lock:
+        if not self.pending:
+          break
+      time.sleep(0.01)
+    self.done.set()
+    reader.join()
+    self.sock.close()
+    return self.results(start, send_time, messages)
+
+  def results (self, start, send_time, messages):
+    latencies = sorted(self.latencies)
+    ack_time = self.last_ack - start if self.last_ack else 0
+    events = self.seq - self.first_seq
+    return {"events": events,
+            "messages": messages,
+            "send_rate": events / send_time if send_time else 0,
+            "acked": self.acked,
+            "dropped": events - self.acked,
+            "throughput": self.acked / ack_time if ack_time else 0,
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None}
+
+
+def print_results (r):
+  ms = lambda v: "-" if v is None else "%.3f ms" % (v * 1000)
+  print "events:     %d in %d messages" % (r["events"], r["messages"])
+  print "send rate:  %.0f events/s" % r["send_rate"]
+  print "throughput: %.0f events/s acknowledged" % r["throughput"]
+  print "dropped:    %d (never acknowledged)" % r["dropped"]
+  print "latency:    p50 %s, p90 %s, p99 %s, max %s" % (
+        ms(r["p50"]), ms(r["p90"]), ms(r["p99"]), ms(r["max"]))
+
+
+def main ():
+  parser = argparse.ArgumentParser(
+      description="CMS controller message load generator")
+  parser.add_argument('--address', default='127.0.0.1',
+                      help="Messenger service address")
+  parser.add_argument('--port', default=7790, type=int,
+                      help="Messenger service port")
+  parser.add_argument('--serve', action='store_true',
+                      help="Run a stand-in server instead")
+  parser.add_argument('--delay', default=0.0, type=float,
+                      help="Stand-in server processing time per event (s)")
+  parser.add_argument('--rate', default=1000.0, type=float,
+                      help="Events per second")
+  parser.add_argument('--duration', default=10.0, type=float,
+                      help="Time to send events for (s)")
+  parser.add_argument('--vms', default=100, type=int,
+                      help="Number of VMs")
+  parser.add_argument('--hvs', default=10, type=int,
+                      help="Number of hypervisors")
+  parser.add_argument('--batch', default=1, type=int,
+                      help="Events per message (batch)")
+  parser.add_argument('--mix', default="1,8,1",
+                      help="Weights of instantiated,migrated,destroyed")
+  parser.add_argument('--grace', default=2.0, type=float,
+                      help="Time to wait for the last acknowledgments (s)")
+  parser.add_argument('--seed', default=None, type=int,
+                      help="Random seed")
+  args = parser.parse_args()
+
+  if args.serve:
+    serve(args)
+    return
+  try:
+    mix = [float(w) for w in args.mix.split(",")]
+  except ValueError:
+    mix = []
+  if len(mix) != 3 or min(mix) < 0:
+    parser.error("--mix needs 3 weights >= 0")
+  if mix[0] <= 0:
+    # VMs all start stopped, so nothing else can happen before this.
+    parser.error("--mix needs an instantiated weight > 0")
+  if args.vms <= 0 or args.hvs <= 0:
+    parser.error("--vms and --hvs need to be > 0")
+  if args.rate <= 0 or args.batch <= 0:
+    parser.error("--rate and --batch need to be > 0")
+  print_results(LoadGenerator(args).run())
+
+
+if __name__ == '__main__':
+  main()
@@ -1,81 +1,290 @@
 """
-This file could work with pox_mininet.py to receive msg sent from that file,, it is just a small test of the JSON and messenger
+CMS component for POX: receives the CMS messages CMSnet sends (see
+CMSnet.send_msg_to_controller) through the messenger, on channel CMS.
+
+It keeps where every VM is in a VMLocationTable (registered with the core as
+cms_locations for other components), indexed by VM name, hypervisor, MAC and
+IP, and keeps the switches in line with it: when a VM migrates or is
+destroyed, only the flows of its old hypervisor that match its MAC address
+are deleted, instead of flushing any table. With install_flows, a flow to
+its new port is also installed on the new hypervisor (only use this if the
+OpenFlow port numbers are those of Mininet, e.g. fast migration mode).
+
+Messages it answers on the CMS channel:
+
+  hello           -> sync with the last event sequence number seen
+  lookup          -> location of the VM given by host, mac or ip
+  stats           -> counters
+
+Usage:
+  ./pox.py messenger messenger.tcp_transport --tcp_port=7790 \\
+    mininet_service [--install_flows]
 """
 
 
 from pox.core import core
 from pox.messenger import *
 from pox.lib.revent.revent import autoBindEvents
-from pox.core import core as core
+from pox.lib.addresses import EthAddr
+from pox.lib.util import str_to_dpid
+import pox.openflow.libopenflow_01 as of
 
 log = core.getLogger()
 
+
+class VMLocationTable (object):
+  """
+  Where every VM is: its hypervisor (and datapath and port there), MAC and
+  IP, by VM name, with reverse indexes by hypervisor, MAC and IP.
+  """
+
+  def __init__ (self):
+    self.hostToLoc = {}    # VM name to location dict
+    self.hvToHosts = {}    # Hypervisor name to set of VM names
+    self.macToHost = {}
+    self.ipToHost = {}
+
+  def __len__ (self):
+    return len(self.hostToLoc)
+
+  def place (self, host, hv, mac=None, ip=None, dpid=None, port=None):
+    "Record that host is on hv; return its previous location (or None)."
+    old = self.remove(host)
+    loc = {'host': host, 'hv': hv, 'mac': mac, 'ip': ip, 'dpid': dpid,
+           'port': port}
+    self.hostToLoc[host] = loc
+    self.hvToHosts.setdefault(hv, set()).add(host)
+    if mac:
+      self.macToHost[mac] = host
+    if ip:
+      self.ipToHost[ip] = host
+    return old
+
+  def remove (self, host):
+    "Forget host; return its location (or None)."
+    loc = self.hostToLoc.pop(host, None)
+    if loc is None:
+      return None
+    hosts = self.hvToHosts.get(loc['hv'])
+    if hosts is not None:
+      hosts.discard(host)
+      if not hosts:
+        del self.hvToHosts[loc['hv']]
+    if self.macToHost.get(loc['mac']) == host:
+      del self.macToHost[loc['mac']]
+    if self.ipToHost.get(loc['ip']) == host:
+      del self.ipToHost[loc['ip']]
+    return loc
+
+  def clear (self):
+    self.__init__()
+
+  def lookup (self, host=None, mac=None, ip=None):
+    "Return the location of a VM given by name, MAC or IP (or None)."
+    if host is None and mac is not None:
+      host = self.macToHost.get(mac)
+    if host is None and ip is not None:
+      host = self.ipToHost.get(ip)
+    return self.hostToLoc.get(host)
+
+  def on_hv (self, hv):
+    "Return the names of the VMs on a hypervisor."
+    return sorted(self.hvToHosts.get(hv, ()))
+
+
 class CMSBot (ChannelBot):
-  def _exec_cmd_migrated (self, event):
-    print "migrated"
-    print "CMBot msg: %s" % event.msg
-    msg = event.msg
-    if msg.get("CHANNEL") != 'CMS':
-      log.warn("Not correct channel: %s\n" % msg.get("CHANNEL"))
+  def _init (self, extra):
+    self.table = extra.get("table") or VMLocationTable()
+    self.install_flows = extra.get("install_flows", False)
+    self.last_seq = None   # Sequence number of the last CMS event seen
+    self.counters = {"events": 0, "duplicates": 0, "filtered": 0,
+                     "instantiated": 0, "migrating": 0, "migrated": 0,
+                     "destroyed": 0, "snapshots": 0, "replays": 0,
+                     "flow_deletes": 0, "flow_installs": 0,
+                     "no_connection": 0}
+
+  # Sequence numbers
+
+  def _seen (self, event, seq, ack=True):
+    """
+    Note (and acknowledge, if ack) the CMS event with sequence number seq.
+    Returns False if it was seen already (e.g. replayed).
+    """
+    if seq is None:
+      return True
+    if self.last_seq is not None and seq <= self.last_seq:
+      self.counters["duplicates"] += 1
+      return False
+    self.last_seq = seq
+    if ack:
+      self.reply(event, cmd="ack", seq=seq)
+    return True
+
+  # Flows
+
+  def _connection (self, dpid):
+    if dpid is None:
+      return None
+    con = core.openflow.getConnection(str_to_dpid(dpid))
+    if con is None:
+      self.counters["no_connection"] += 1
+    return con
+
+  def _delete_flows (self, dpid, mac):
+    "Delete the flows of a datapath to or from a MAC address."
+    con = self._connection(dpid)
+    if con is None or not mac:
       return
-    assert msg.get("CHANNEL") == 'CMS'
-    msg_level = msg.get("msg_level")
-    msg_cmd = msg.get("cmd")
-    host = msg.get("host")
-    new_hv = msg.get("new_hv")
-    if msg_cmd == msg_level or msg_level == "all":
-      log.info("msg_cmd: %s" % msg_cmd)
-      log.info("host: %s" % host)
-      log.info("new_hv: %s" % new_hv)
-
-  def _exec_cmd_instantiated (self, event):
-    print "instantiated"
-    print "CMBot msg: %s" % event.msg
+    for match in (of.ofp_match(dl_dst=EthAddr(mac)),
+                  of.ofp_match(dl_src=EthAddr(mac))):
+      con.send(of.ofp_flow_mod(command=of.OFPFC_DELETE, match=match))
+      self.counters["flow_deletes"] += 1
+
+  def _install_flow (self, loc):
+    "Install a flow to the port of a VM on its hypervisor."
+    if not self.install_flows or loc.get("port") is None:
+      return
+    con = self._connection(loc.get("dpid"))
+    if con is None or not loc.get("mac"):
+      return
+    con.send(of.ofp_flow_mod(match=of.ofp_match(dl_dst=EthAddr(loc["mac"])),
+                             idle_timeout=300,
+                             actions=[of.ofp_action_output(
+                                        port=loc["port"])]))
+    self.counters["flow_installs"] += 1
+
+  # Events
+
+  def _wanted (self, msg_level, msg_cmd):
+    "Test if the message level lets an event through."
+    if msg_cmd == "migrating":
+      msg_cmd = "migrated"
+    return msg_level == "all" or msg_cmd == msg_level
+
+  def _apply (self, e):
+    "Apply a VM event to the table and the switches."
+    msg_cmd = e.get("cmd")
+    host = e.get("host")
+    self.counters["events"] += 1
+    if msg_cmd in self.counters:
+      self.counters[msg_cmd] += 1
+    log.debug("%s: %s on %s (from %s)" % (msg_cmd, host, e.get("new_hv"),
+                                          e.get("old_hv")))
+    if msg_cmd == "instantiated":
+      loc = self._place(e)
+      self._install_flow(loc)
+    elif msg_cmd == "migrated":
+      old = self.table.lookup(host)
+      loc = self._place(e)
+      old_dpid = self._old_dpid(old, e)
+      if old_dpid and old_dpid != loc.get("dpid"):
+        self._delete_flows(old_dpid, loc.get("mac"))
+      self._install_flow(loc)
+    elif msg_cmd == "destroyed":
+      old = self.table.remove(host)
+      self._delete_flows(self._old_dpid(old, e),
+                         e.get("mac") or (old and old.get("mac")))
+    elif msg_cmd == "migrating":
+      pass    # CMSnet stages the new flows itself (make-before-break).
+    else:
+      log.warn("Unknown CMS event: %s" % msg_cmd)
+
+  def _old_dpid (self, old, e):
+    """
+    Return the datapath a VM was on before event e: where the table has it
+    (where its flows were installed), else where the event says.
+    """
+    if old and old.get("dpid"):
+      return old["dpid"]
+    return e.get("old_dpid")
+
+  def _place (self, e):
+    self.table.place(e.get("host"), e.get("new_hv"), e.get("mac"),
+                     e.get("ip"), e.get("dpid"), e.get("port"))
+    return self.table.lookup(e.get("host"))
+
+  def _handle (self, event):
+    "Handle a message carrying a single VM event."
     msg = event.msg
     if msg.get("CHANNEL") != 'CMS':
-      log.warn("Not correct channel: %s\n" % msg.get("CHANNEL"))
+      log.warn("Not correct channel: %s" % msg.get("CHANNEL"))
       return
-    assert msg.get("CHANNEL") == 'CMS'
-    msg_level = msg.get("msg_level")
-    msg_cmd = msg.get("cmd")
-    host = msg.get("host")
-    new_hv = msg.get("new_hv")
-    if msg_cmd == msg_level or msg_level == "all":
-      log.info("msg_cmd: %s" % msg_cmd)
-      log.info("host: %s" % host)
-      log.info("new_hv: %s" % new_hv)
-
-  def _exec_cmd_destroyed (self, event):
-    print "destroyed"
-    print "CMBot msg: %s" % event.msg
+    if not self._seen(event, msg.get("seq")):
+      return
+    if not self._wanted(msg.get("msg_level"), msg.get("cmd")):
+      self.counters["filtered"] += 1
+      return
+    self._apply(msg)
+
+  _exec_cmd_instantiated = _handle
+  _exec_cmd_migrating = _handle
+  _exec_cmd_migrated = _handle
+  _exec_cmd_destroyed = _handle
+
+  def _exec_cmd_batch (self, event):
     msg = event.msg
     if msg.get("CHANNEL") != 'CMS':
-      log.warn("Not correct channel: %s\n" % msg.get("CHANNEL"))
+      log.warn("Not correct channel: %s" % msg.get("CHANNEL"))
       return
-    assert msg.get("CHANNEL") == 'CMS'
     msg_level = msg.get("msg_level")
-    msg_cmd = msg.get("cmd")
-    host = msg.get("host")
-    new_hv = msg.get("new_hv")
-    if msg_cmd == msg_level or msg_level == "all":
-      log.info("msg_cmd: %s" % msg_cmd)
-      log.info("host: %s" % host)
-      log.info("new_hv: %s" % new_hv)
+    if msg.get("replay"):
+      self.counters["replays"] += 1
+    last_seq = self.last_seq
+    for e in msg.get("events", []):
+      if not self._seen(event, e.get("seq"), ack=False):
+        continue
+      if not self._wanted(msg_level, e.get("cmd")):
+        self.counters["filtered"] += 1
+        continue
+      self._apply(e)
+    if self.last_seq != last_seq:   # One ack for the whole batch.
+      self.reply(event, cmd="ack", seq=self.last_seq)
+
+  def _exec_cmd_hello (self, event):
+    # CMSnet (re)connected: tell it what we have, to be caught up.
+    log.info("CMSnet at seq %s; we are at %s" % (event.msg.get("seq"),
+                                                 self.last_seq))
+    self.reply(event, cmd="sync", last_seq=self.last_seq)
+
+  def _exec_cmd_snapshot (self, event):
+    msg = event.msg
+    vms = msg.get("vms", [])
+    log.info("snapshot at seq %s: %d VMs" % (msg.get("seq"), len(vms)))
+    self.counters["snapshots"] += 1
+    self.table.clear()
+    for vm in vms:
+      self.table.place(vm.get("host"), vm.get("hv"), vm.get("mac"),
+                       vm.get("ip"), vm.get("dpid"), vm.get("port"))
+    self.last_seq = None
+    self._seen(event, msg.get("seq"))
+
+  def _exec_cmd_lookup (self, event):
+    msg = event.msg
+    loc = self.table.lookup(msg.get("host"), msg.get("mac"), msg.get("ip"))
+    self.reply(event, cmd="location", location=loc)
+
+  def _exec_cmd_stats (self, event):
+    stats = dict(self.counters)
+    stats["vms"] = len(self.table)
+    stats["hvs"] = len(self.table.hvToHosts)
+    stats["last_seq"] = self.last_seq
+    self.reply(event, cmd="stats", stats=stats)
 
   def _unhandled (self, event):
-    print "unhandled"
-    print "CMBot msg: %s" % event.msg
     msg = event.msg
     if msg.get("CHANNEL") != 'CMS':
       log.warn("Not correct channel: %s" % msg.get("CHANNEL"))
       return
-    assert msg.get("CHANNEL") == 'CMS'
+    log.warn("Unhandled CMS message: %s" % msg.get("cmd"))
 
 
-def launch (nexus = "MessengerNexus"):
+def launch (nexus = "MessengerNexus", install_flows = False):
+  table = VMLocationTable()
+  core.register("cms_locations", table)
+
   def start (nexus):
     real_nexus = core.components[nexus]
-    CMSBot(real_nexus.get_channel('CMS'))
+    CMSBot(real_nexus.get_channel('CMS'),
+           extra={"table": table, "install_flows": bool(install_flows)})
 
   core.call_when_ready(start, nexus, args=[nexus])
-
@@ -99,6 +99,7 @@
 from mininet.link import Link, Intf
 from mininet.util import quietRun, fixLimits, numCores, ensureRoot
 from mininet.util import macColonHex, ipStr, ipParse, netParse, ipAdd
+from mininet.util import parallelMap
 from mininet.term import cleanUpScreens, makeTerms
 
 # Mininet version: should be consistent with README and LICENSE
@@ -155,6 +156,10 @@ def __init__( self, topo=None, switch=OVSKernelSwitch, host=Host,
 
         self.nameToNode = {}  # name to Node (Host/Switch) objects
 
+        # Adjacency index, maintained by addLink()/indexLink()
+        self.nodePairToLinks = {}  # frozenset( nodes ) to list of Links
+        self.intfToPeer = {}  # Intf to Intf at the other end of its link
+
         self.terms = []  # list of spawned xterm processes
 
         Mininet.init()  # Initialize Mininet if necessary
@@ -163,13 +168,10 @@ def __init__( self, topo=None, switch=OVSKernelSwitch, host=Host,
         if topo and build:
             self.build()
 
-    def addHost( self, name, cls=None, **params ):
-        """Add host.
-           name: name of host to add
-           cls: custom host class/constructor (optional)
-           params: parameters for host
-           returns: added host"""
-        # Default IP and MAC addresses
+    def hostParams( self, params ):
+        """Return params for the next host, filled in with the default
+           IP and MAC addresses and CPU core.
+           params: parameters for host"""
         defaults = { 'ip': ipAdd( self.nextIP,
                                   ipBaseNum=self.ipBaseNum,
                                   prefixLen=self.prefixLen ) +
@@ -181,6 +183,15 @@ def addHost( self, name, cls=None, **params ):
             self.nextCore = ( self.nextCore + 1 ) % self.numCores
         self.nextIP += 1
         defaults.update( params )
+        return defaults
+
+    def addHost( self, name, cls=None, **params ):
+        """Add host.
+           name: name of host to add
+           cls: custom host class/constructor (optional)
+           params: parameters for host
+           returns: added host"""
+        defaults = self.hostParams( params )
         if not cls:
             cls = self.host
         h = cls( name, **defaults )
@@ -188,6 +199,36 @@ def addHost( self, name, cls=None, **params ):
         self.nameToNode[ name ] = h
         return h
 
+    def addHosts( self, hosts, cls=None, workers=None ):
+        """Add many hosts, starting their shells concurrently.
+           hosts: list of host names or ( name, params ) pairs;
+                  params may include a per-host 'cls'
+           cls: custom host class/constructor (optional)
+           workers: number of hosts to start at once (optional)
+           returns: list of added hosts, in order"""
+        if not cls:
+            cls = self.host
+        specs = []
+        # Default parameters are assigned in order, as in addHost()
+        for host in hosts:
+            if isinstance( host, basestring ):
+                name, params = host, {}
+            else:
+                name, params = host
+            specs.append( ( name, self.hostParams( params ) ) )
+
+        def makeHost( spec ):
+            "Start a single host"
+            name, params = spec
+            hostCls = params.pop( 'cls', None ) or cls
+            return hostCls( name, **params )
+
+        newHosts = parallelMap( makeHost, specs, workers )
+        for h in newHosts:
+            self.hosts.append( h )
+            self.nameToNode[ h.name ] = h
+        return newHosts
+
     def addSwitch( self, name, cls=None, **params ):
         """Add switch.
            name: name of switch to add
@@ -246,7 +287,7 @@ def __len__( self ):
 
     def __contains__( self, item ):
         "returns True if net contains named node"
-        return item in self.keys()
+        return item in self.nameToNode
 
     def keys( self ):
         "return a list of all node names or net's keys"
@@ -254,11 +295,11 @@ def keys( self ):
 
     def values( self ):
         "return a list of all nodes or net's values"
-        return [ self[name] for name in self.__iter__() ]
+        return list( chain( self.hosts, self.switches, self.controllers ) )
 
     def items( self ):
         "return (key,value) tuple list for every node in net"
-        return zip( self.keys(), self.values() )
+        return [ ( node.name, node ) for node in self.values() ]
 
     def addLink( self, node1, node2, port1=None, port2=None,
                  cls=None, **params ):
@@ -274,7 +315,60 @@ def addLink( self, node1, node2, port1=None, port2=None,
         defaults.update( params )
         if not cls:
             cls = self.link
-        return cls( node1, node2, **defaults )
+        link = cls( node1, node2, **defaults )
+        self.indexLink( link )
+        return link
+
+    # Adjacency index: lets us find links between nodes and the
+    # peer of an interface without scanning every interface of
+    # high-degree nodes. Code that rewires an existing link to
+    # another node must unindexLink() it first and indexLink()
+    # it again afterwards.
+
+    def indexLink( self, link ):
+        "Add link to the adjacency index."
+        intf1, intf2 = link.intf1, link.intf2
+        key = frozenset( ( intf1.node, intf2.node ) )
+        self.nodePairToLinks.setdefault( key, [] ).append( link )
+        self.intfToPeer[ intf1 ] = intf2
+        self.intfToPeer[ intf2 ] = intf1
+
+    def unindexLink( self, link ):
+        "Remove link from the adjacency index."
+        intf1, intf2 = link.intf1, link.intf2
+        key = frozenset( ( intf1.node, intf2.node ) )
+        links = self.nodePairToLinks.get( key, [] )
+        if link in links:
+            links.remove( link )
+            if not links:
+                del self.nodePairToLinks[ key ]
+        self.intfToPeer.pop( intf1, None )
+        self.intfToPeer.pop( intf2, None )
+
+    def unindexNode( self, node ):
+        "Remove the links of node (which is being deleted) from the index."
+        for intf in node.intfList():
+            if intf.link:
+                self.unindexLink( intf.link )
+
+    def linksBetween( self, node1, node2 ):
+        "Return list of links between node1 and node2."
+        return list( self.nodePairToLinks.get(
+            frozenset( ( node1, node2 ) ), [] ) )
+
+    def connectionsBetween( self, src, dst ):
+        "Return [ ( srcIntf, dstIntf ) ] for all links between src and dst."
+        connections = []
+        for link in self.linksBetween( src, dst ):
+            if link.intf1.node is src:
+                connections.append( ( link.intf1, link.intf2 ) )
+            else:
+                connections.append( ( link.intf2, link.intf1 ) )
+        return connections
+
+    def peerIntf( self, intf ):
+        "Return the interface at the other end of intf's link (or None)."
+        return self.intfToPeer.get( intf )
 
     def configHosts( self ):
         "Configure a set of hosts."
@@ -316,21 +410,22 @@ def buildFromTopo( self, topo=None ):
             for i, cls in enumerate( classes ):
                 self.addController( 'c%d' % i, cls )
 
+        # The *Entries() iterators let streaming topologies (see
+        # mininet.topofile) feed us without building a full Topo first
         info( '*** Adding hosts:\n' )
-        for hostName in topo.hosts():
-            self.addHost( hostName, **topo.nodeInfo( hostName ) )
+        for hostName, params in topo.hostEntries():
+            self.addHost( hostName, **params )
             info( hostName + ' ' )
 
         info( '\n*** Adding switches:\n' )
-        for switchName in topo.switches():
-            self.addSwitch( switchName, **topo.nodeInfo( switchName) )
+        for switchName, params in topo.switchEntries():
+            self.addSwitch( switchName, **params )
             info( switchName + ' ' )
 
         info( '\n*** Adding links:\n' )
-        for srcName, dstName in topo.links(sort=True):
+        for srcName, dstName, srcPort, dstPort, params in (
+                topo.linkEntries( sort=True ) ):
             src, dst = self.nameToNode[ srcName ], self.nameToNode[ dstName ]
-            params = topo.linkInfo( srcName, dstName )
-            srcPort, dstPort = topo.port( srcName, dstName )
             self.addLink( src, dst, srcPort, dstPort, **params )
             info( '(%s, %s) ' % ( src.name, dst.name ) )
 
@@ -411,6 +506,8 @@ def stop( self ):
         for controller in self.controllers:
             info( controller.name + ' ' )
             controller.stop()
+        self.nodePairToLinks.clear()
+        self.intfToPeer.clear()
         info( '\n*** Done\n' )
 
     def run( self, test, *args, **kwargs ):
@@ -699,7 +796,11 @@ def configLinkStatus( self, src, dst, status ):
                 src = self.nameToNode[ src ]
             if type( dst ) is str:
                 dst = self.nameToNode[ dst ]
-            connections = src.connectionsTo( dst )
+            connections = self.connectionsBetween( src, dst )
+            if not connections:
+                # Links made with Link() rather than addLink() are not
+                # in the index
+                connections = src.connectionsTo( dst )
             if len( connections ) == 0:
                 error( 'src and dst not connected: %s %s\n' % ( src, dst) )
             for srcIntf, dstIntf in connections:
@@ -775,6 +876,7 @@ def configureRoutedControlNetwork( self, ip='192.168.123.1',
         for switch in self.switches:
             info( ' ' + switch.name )
             link = self.link( switch, controller, port1=0 )
+            self.indexLink( link )
             sintf, cintf = link.intf1, link.intf2
             switch.controlIntf = sintf
             snum += 1
@@ -51,6 +51,7 @@
 from subprocess import Popen, PIPE, STDOUT
 from operator import or_
 from time import sleep
+from heapq import heappush, heappop
 
 from mininet.log import info, error, warn, debug
 from mininet.util import ( quietRun, errRun, errFail, moveIntf, isShellBuiltin,
@@ -63,6 +64,7 @@ class Node( object ):
        We communicate with it using pipes."""
 
     portBase = 0  # Nodes always start with eth0/port0, even in OF 1.0
+    reusePorts = False  # Reuse port numbers released by delIntf()?
 
     def __init__( self, name, inNamespace=True, **params ):
         """name: name of node
@@ -82,6 +84,9 @@ def __init__( self, name, inNamespace=True, **params ):
         self.ports = {}  # dict of interfaces to port numbers
                          # replace with Port objects, eventually ?
         self.nameToIntf = {}  # dict of interface names to Intfs
+        self.nextPort = self.portBase  # lowest never-allocated port
+        self.freePorts = []  # heap of released port numbers (may be stale)
+        self.freePortSet = set()  # released port numbers available for reuse
 
         # Make pylint happy
         ( self.shell, self.execed, self.pid, self.stdin, self.stdout,
@@ -333,25 +338,48 @@ def pexec( self, *args, **kwargs ):
     # make a single interface at a time.
 
     def newPort( self ):
-        "Return the next port number to allocate."
-        if len( self.ports ) > 0:
-            return max( self.ports.values() ) + 1
-        return self.portBase
-
-    def addIntf( self, intf, port=None ):
+        """Return the next port number to allocate (without allocating
+           it): the lowest released port if reusePorts is set, otherwise
+           the high-water mark."""
+        freePorts = self.freePorts
+        while freePorts and freePorts[ 0 ] not in self.freePortSet:
+            heappop( freePorts )  # discard stale entries
+        if freePorts:
+            return freePorts[ 0 ]
+        return self.nextPort
+
+    def addIntf( self, intf, port=None, moveIntfFn=moveIntf ):
         """Add an interface.
            intf: interface
-           port: port number (optional, typically OpenFlow port number)"""
+           port: port number (optional, typically OpenFlow port number)
+           moveIntfFn: function to move interface (optional)"""
         if port is None:
             port = self.newPort()
+        if port >= self.nextPort:
+            self.nextPort = port + 1
+        self.freePortSet.discard( port )
         self.intfs[ port ] = intf
         self.ports[ intf ] = port
         self.nameToIntf[ intf.name ] = intf
         debug( '\n' )
         debug( 'added intf %s:%d to node %s\n' % ( intf, port, self.name ) )
-        if self.inNamespace:
+        if self.inNamespace and moveIntfFn:
             debug( 'moving', intf, 'into namespace for', self.name, '\n' )
-            moveIntf( intf.name, self )
+            moveIntfFn( intf.name, self )
+
+    def delIntf( self, intf ):
+        """Remove an interface from this node without deleting it
+           (e.g. before moving it to another node). Its port number
+           is released for reuse if reusePorts is set.
+           intf: interface"""
+        port = self.ports.pop( intf )
+        del self.intfs[ port ]
+        if self.nameToIntf.get( intf.name ) is intf:
+            del self.nameToIntf[ intf.name ]
+        debug( 'removed intf %s:%d from node %s\n' % ( intf, port, self.name ) )
+        if self.reusePorts:
+            self.freePortSet.add( port )
+            heappush( self.freePorts, port )
 
     def defaultIntf( self ):
         "Return interface for lowest port"
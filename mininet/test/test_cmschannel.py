@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the CMSnet controller channel over loopback sockets
+   (does not require root)."""
+
+import json
+import socket
+import struct
+import unittest
+from threading import Event
+
+from cmsnet.cms_channel import ControllerChannel, EventCoalescer
+from cmsnet.cms_channel import MessageReader, EventJournal
+from cmsnet.cms_net import CMSnet
+
+
+def freePort():
+    "Return a loopback TCP port nothing listens on"
+    sock = socket.socket()
+    sock.bind( ( '127.0.0.1', 0 ) )
+    port = sock.getsockname()[ 1 ]
+    sock.close()
+    return port
+
+def listen( port ):
+    "Return a server socket listening on a loopback port"
+    server = socket.socket()
+    server.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+    server.bind( ( '127.0.0.1', port ) )
+    server.listen( 1 )
+    server.settimeout( 5 )
+    return server
+
+def vmEvent( cmd, host='vm1', new_hv=None, old_hv=None ):
+    "Return a VM event as CMSnet sends it, on hypervisors s<n>"
+    event = { 'cmd': cmd, 'host': host }
+    if new_hv:
+        event.update( new_hv=new_hv, dpid=new_hv[ 1: ] )
+    if old_hv:
+        event.update( old_hv=old_hv, old_dpid=old_hv[ 1: ] )
+    return event
+
+def readLines( conn, count ):
+    "Read count newline-framed JSON messages from a connection"
+    data = ''
+    conn.settimeout( 5 )
+    while data.count( '\n' ) < count:
+        chunk = conn.recv( 65536 )
+        if not chunk:
+            break
+        data += chunk
+    return [ json.loads( line ) for line in data.splitlines() ]
+
+
+class testControllerChannel( unittest.TestCase ):
+    "Framing, batching, dropping and reconnecting."
+
+    def testFrame( self ):
+        "Newline and length framing"
+        msg = { 'cmd': 'ping' }
+        data = json.dumps( msg )
+        self.assertEqual( ControllerChannel( 'x', 0 ).frame( msg ),
+                          data + '\n' )
+        self.assertEqual( ControllerChannel( 'x', 0, framing='length' )
+                          .frame( msg ),
+                          struct.pack( '!I', len( data ) ) + data )
+
+    def testDropWhenFull( self ):
+        "Messages beyond the queue size are dropped and counted"
+        channel = ControllerChannel( '127.0.0.1', freePort(), max_queue=2 )
+        self.assertTrue( channel.send( { 'n': 1 } ) )
+        self.assertTrue( channel.send( { 'n': 2 } ) )
+        self.assertFalse( channel.send( { 'n': 3 } ) )
+        stats = channel.stats()
+        self.assertEqual( ( stats[ 'queued' ], stats[ 'dropped' ],
+                            stats[ 'depth' ] ), ( 2, 1, 2 ) )
+
+    def testBackoff( self ):
+        "Failed connections back off exponentially, up to the maximum"
+        channel = ControllerChannel( '127.0.0.1', freePort(),
+                                     backoff_min=0.1, backoff_max=0.5 )
+        delays = []
+        for _i in range( 5 ):
+            channel.next_connect = 0.0      # Do not wait for the test
+            self.assertFalse( channel._ensure_connected() )
+            delays.append( channel.backoff )
+        self.assertEqual( delays, [ 0.2, 0.4, 0.5, 0.5, 0.5 ] )
+        self.assertEqual( channel.stats()[ 'failures' ], 5 )
+
+    def testBatchAndReconnect( self ):
+        "Messages queued while the controller is away go in a few writes"
+        port = freePort()
+        channel = ControllerChannel( '127.0.0.1', port, backoff_min=0.05 )
+        for n in range( 1000 ):
+            channel.send( { 'n': n } )
+        channel.start()
+        try:
+            server = listen( port )
+            conn, _addr = server.accept()
+            msgs = readLines( conn, 1000 )
+            self.assertEqual( [ msg[ 'n' ] for msg in msgs ], range( 1000 ) )
+            self.assertTrue( channel.flush( 5 ) )
+            stats = channel.stats()
+            self.assertEqual( stats[ 'sent' ], 1000 )
+            self.assertTrue( stats[ 'writes' ] < 10 )
+            # The controller goes away and comes back: reconnect.
+            conn.close()
+            conn, _addr = server.accept()
+            channel.send( { 'n': 1000 } )
+            self.assertEqual( readLines( conn, 1 ), [ { 'n': 1000 } ] )
+            self.assertTrue( channel.stats()[ 'connects' ] >= 2 )
+            conn.close()
+            server.close()
+        finally:
+            channel.stop( timeout=0 )
+
+
+class testEventCoalescer( unittest.TestCase ):
+    "Net change of every pair of events of a VM."
+
+    def merge( self, first, second ):
+        "Return the coalesced event as (cmd, old_hv, old_dpid, new_hv)"
+        event = EventCoalescer.merge( first, second )
+        if event is None:
+            return None
+        return ( event[ 'cmd' ], event.get( 'old_hv' ),
+                 event.get( 'old_dpid' ), event.get( 'new_hv' ) )
+
+    def testPairs( self ):
+        "Consistent pairs give the change from where the VM first was"
+        I = vmEvent( 'instantiated', new_hv='s1' )
+        M = vmEvent( 'migrated', new_hv='s2', old_hv='s1' )
+        D = vmEvent( 'destroyed', old_hv='s2' )
+        cases = [
+            ( I, M, ( 'instantiated', None, None, 's2' ) ),
+            ( I, vmEvent( 'destroyed', old_hv='s1' ), None ),
+            ( M, vmEvent( 'migrated', new_hv='s3', old_hv='s2' ),
+              ( 'migrated', 's1', '1', 's3' ) ),
+            ( M, D, ( 'destroyed', 's1', '1', None ) ),
+            ( vmEvent( 'destroyed', old_hv='s1' ),
+              vmEvent( 'instantiated', new_hv='s3' ),
+              ( 'migrated', 's1', '1', 's3' ) ),
+            ( vmEvent( 'migrated', new_hv='s2' ),       # Old unknown
+              vmEvent( 'migrated', new_hv='s3', old_hv='s2' ),
+              ( 'migrated', None, None, 's3' ) ) ]
+        for first, second, merged in cases:
+            self.assertEqual( self.merge( first, second ), merged,
+                              '%s then %s' % ( first, second ) )
+
+    def testInconsistentPairs( self ):
+        "Pairs that cannot happen leave the later event as it is"
+        I = vmEvent( 'instantiated', new_hv='s1' )
+        M = vmEvent( 'migrated', new_hv='s2', old_hv='s1' )
+        D = vmEvent( 'destroyed', old_hv='s2' )
+        for first, second in ( ( I, I ), ( M, I ), ( D, M ), ( D, D ) ):
+            self.assertEqual( EventCoalescer.merge( first, second ), second )
+
+    def testWindow( self ):
+        "Held events are flushed once, in order of first event per VM"
+        flushed = []
+        done = Event()
+        def flush( events ):
+            flushed.append( events )
+            done.set()
+        coalescer = EventCoalescer( 0.5, flush )
+        coalescer.add( vmEvent( 'instantiated', 'vm2', new_hv='s1' ) )
+        coalescer.add( vmEvent( 'instantiated', 'vm1', new_hv='s1' ) )
+        coalescer.add( vmEvent( 'destroyed', 'vm2', old_hv='s1' ) )
+        coalescer.add( vmEvent( 'instantiated', 'vm3', new_hv='s2' ) )
+        coalescer.add( vmEvent( 'migrated', 'vm1', new_hv='s2',
+                                old_hv='s1' ) )
+        self.assertTrue( done.wait( 5 ) )
+        self.assertEqual( [ [ ( e[ 'host' ], e[ 'cmd' ], e[ 'new_hv' ] )
+                              for e in events ] for events in flushed ],
+                          [ [ ( 'vm1', 'instantiated', 's2' ),
+                              ( 'vm3', 'instantiated', 's2' ) ] ] )
+        self.assertEqual( ( coalescer.received, coalescer.flushed ), ( 5, 2 ) )
+        coalescer.stop()
+        self.assertEqual( len( flushed ), 1 )   # Nothing more held
+
+    def testUrgent( self ):
+        "Urgent events go at once, after the events held before them"
+        flushed = []
+        coalescer = EventCoalescer( 60, flushed.append )
+        coalescer.add( vmEvent( 'migrated', 'vm1', new_hv='s2',
+                                old_hv='s1' ) )
+        coalescer.flush( [ vmEvent( 'migrating', 'vm1', new_hv='s3',
+                                    old_hv='s2' ) ] )
+        self.assertEqual( [ [ ( e[ 'host' ], e[ 'cmd' ] ) for e in events ]
+                            for events in flushed ],
+                          [ [ ( 'vm1', 'migrated' ), ( 'vm1', 'migrating' ) ] ] )
+        self.assertEqual( ( coalescer.received, coalescer.flushed ), ( 2, 2 ) )
+        self.assertEqual( coalescer.timer, None )
+
+
+class testMessageReader( unittest.TestCase ):
+    "JSON messages from the controller, however the bytes arrive."
+
+    def setUp( self ):
+        self.sock, self.peer = socket.socketpair()
+        self.reader = MessageReader( self.sock )
+
+    def tearDown( self ):
+        self.sock.close()
+        self.peer.close()
+
+    def testPartialReads( self ):
+        "Messages split across reads, or several in one read"
+        self.peer.sendall( '{"cmd": "sy' )
+        self.assertEqual( self.reader.read( 0.05 ), None )
+        self.peer.sendall( 'nc", "last_seq": 4}\n{"cmd": "ack", ' )
+        self.assertEqual( self.reader.read( 1 ),
+                          { 'cmd': 'sync', 'last_seq': 4 } )
+        self.peer.sendall( '"seq": 5}{"cmd": "ack", "seq": 6}  \n' )
+        self.assertEqual( self.reader.read( 1 ), { 'cmd': 'ack', 'seq': 5 } )
+        self.assertEqual( self.reader.read( 1 ), { 'cmd': 'ack', 'seq': 6 } )
+        self.assertEqual( self.reader.read( 0.05 ), None )
+
+    def testClosed( self ):
+        "A closed connection raises socket.error"
+        self.peer.sendall( '{"cmd": "ack"' )
+        self.peer.close()
+        self.assertRaises( socket.error, self.reader.read, 1 )
+
+
+class testEventJournal( unittest.TestCase ):
+    "Sequence numbers, acknowledgments and what is left to replay."
+
+    def record( self, journal, count ):
+        events = [ { 'n': n } for n in range( count ) ]
+        journal.record( events )
+        return events
+
+    def testSince( self ):
+        "Events after an acknowledged sequence number"
+        journal = EventJournal()
+        events = self.record( journal, 5 )
+        self.assertEqual( [ e[ 'seq' ] for e in events ], [ 1, 2, 3, 4, 5 ] )
+        self.assertEqual( journal.since( 2 ), events[ 2: ] )
+        journal.ack( 3 )
+        self.assertEqual( journal.since( 3 ), events[ 3: ] )
+        self.assertEqual( journal.since( 5 ), [] )
+        self.assertEqual( journal.since( 2 ), None )    # Forgotten
+        self.assertEqual( journal.since( None ), None )  # New controller
+        self.assertEqual( journal.since( 9 ), None )     # Our restart
+
+    def testOverflow( self ):
+        "A controller missing more than the journal holds needs a snapshot"
+        journal = EventJournal( max_len=3 )
+        events = self.record( journal, 5 )
+        self.assertEqual( journal.since( 2 ), events[ 2: ] )
+        self.assertEqual( journal.since( 1 ), None )
+        journal.ack( 99 )                                # Capped
+        self.assertEqual( ( journal.acked, journal.since( 5 ) ), ( 5, [] ) )
+
+
+class FakeCMSnet( object ):
+    "Just what CMSnet._controller_handshake uses"
+    sync_timeout = 1.0
+    msg_level = 'all'
+
+    def __init__( self ):
+        self.journal = EventJournal()
+
+    def _vm_locations( self ):
+        return [ { 'host': 'vm1', 'hv': 's1' } ]
+
+    handshake = CMSnet._controller_handshake.im_func
+
+
+class testCatchUp( unittest.TestCase ):
+    "What a (re)connecting controller is sent, given its last_seq."
+
+    def handshake( self, cn, replies ):
+        "Run the handshake with a controller sending replies"
+        sent = []
+        replies = list( replies )
+        def read( timeout ):
+            return replies.pop( 0 ) if replies else None
+        cn.handshake( sent.append, read )
+        self.assertEqual( sent[ 0 ], { 'CHANNEL': 'CMS', 'cmd': 'hello',
+                                       'seq': cn.journal.seq } )
+        return sent[ 1: ]
+
+    def setUp( self ):
+        self.cn = FakeCMSnet()
+        self.events = [ { 'cmd': 'instantiated', 'host': 'vm%d' % n }
+                        for n in range( 1, 6 ) ]
+        self.cn.journal.record( self.events )
+        self.cn.journal.ack( 2 )
+
+    def testReplay( self ):
+        "Events after last_seq are replayed from the journal"
+        sent = self.handshake( self.cn, [ { 'cmd': 'welcome' },
+                                          { 'cmd': 'sync', 'last_seq': 3 } ] )
+        self.assertEqual( sent, [ { 'CHANNEL': 'CMS', 'cmd': 'batch',
+                                    'replay': True, 'msg_level': 'all',
+                                    'events': self.events[ 3: ] } ] )
+
+    def testCaughtUp( self ):
+        "Nothing is sent to a controller that has everything"
+        self.assertEqual( self.handshake(
+            self.cn, [ { 'cmd': 'sync', 'last_seq': 5 } ] ), [] )
+
+    def testSnapshot( self ):
+        "New controllers, and ones behind the journal, get a snapshot"
+        for last_seq in ( None, 1, 7 ):
+            sent = self.handshake(
+                self.cn, [ { 'cmd': 'sync', 'last_seq': last_seq } ] )
+            self.assertEqual( sent, [ { 'CHANNEL': 'CMS', 'cmd': 'snapshot',
+                                        'seq': 5, 'msg_level': 'all',
+                                        'vms': self.cn._vm_locations() } ] )
+            self.assertEqual( self.cn.journal.acked, 5 )
+
+    def testNoSync( self ):
+        "A controller not answering is not caught up"
+        self.assertEqual( self.handshake( self.cn, [] ), [] )
+
+
+if __name__ == '__main__':
+    unittest.main()
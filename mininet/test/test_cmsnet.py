@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test CMSnet commands on fake nodes (does not require root)."""
+
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from time import sleep
+
+from mininet.net import Mininet
+from mininet.node import Host, Switch, OVSSwitch
+from cmsnet.cms_comp import VirtualMachine, Hypervisor
+from cmsnet.cms_channel import EventCoalescer
+from cmsnet.cms_net import CMSnet, expandNames, rarpFrame
+from cmsnet.mininet_node_patch import OVSNormalSwitch, OVSMultipathSwitch
+
+
+class FakeShell( object ):
+    "Mixin for nodes without a shell, recording their commands"
+
+    def __init__( self, name ):
+        self.name = name
+        self.inNamespace = False
+        self.pid = 0
+        self.intfs, self.ports, self.nameToIntf = {}, {}, {}
+        self.nextPort = self.portBase
+        self.freePorts, self.freePortSet = [], set()
+        self.cmds = []
+
+    def cmd( self, *args ):
+        self.cmds.append( ' '.join( str( arg ) for arg in args ) )
+        return ''
+
+
+class FakeHost( FakeShell, Host ):
+    "Host without a shell"
+
+    def IP( self ):
+        return '10.0.0.1'
+
+    def MAC( self ):
+        return '00:00:00:00:00:01'
+
+
+class FakeSwitch( FakeShell, Switch ):
+    "Switch without a shell, recording the intfs attached to it"
+
+    def attach( self, intf ):
+        self.cmds.append( 'attach %s' % intf )
+
+    def detach( self, intf ):
+        self.cmds.append( 'detach %s' % intf )
+
+
+class FakeOVSSwitch( FakeSwitch, OVSSwitch ):
+    "Open vSwitch bridge without a shell"
+    pass
+
+
+class FakeNormalSwitch( FakeSwitch, OVSNormalSwitch ):
+    "Learning switch without a shell"
+    pass
+
+
+class FakeMultipathSwitch( FakeSwitch, OVSMultipathSwitch ):
+    "Multipath fabric switch without a shell"
+    pass
+
+
+class FakeChannel( object ):
+    "Controller channel recording the messages sent on it"
+
+    def __init__( self ):
+        self.sent = []
+
+    def send( self, msg ):
+        self.sent.append( msg )
+
+
+class FakeIntf( object ):
+    "Interface known only by name"
+
+    def __init__( self, node, name ):
+        self.node = node
+        self.name = name
+        self.link = None
+        node.addIntf( self, moveIntfFn=None )
+
+    def __repr__( self ):
+        return self.name
+
+
+class FakeLink( object ):
+    "Link between two fake nodes"
+
+    def __init__( self, node1, node2 ):
+        self.intf1 = FakeIntf( node1, '%s-eth%d' % ( node1.name,
+                                                     node1.newPort() ) )
+        self.intf2 = FakeIntf( node2, '%s-eth%d' % ( node2.name,
+                                                     node2.newPort() ) )
+        self.intf1.link = self.intf2.link = self
+
+
+class FakeMininet( Mininet ):
+    "Just what CMSnet reads of Mininet, without starting anything"
+
+    def __init__( self, **params ):
+        self.topo = None
+        self.nameToNode = {}
+        self.switches = []
+        self.hosts = []
+        self.nodePairToLinks = {}
+        self.intfToPeer = {}
+
+
+class CMSnetCase( unittest.TestCase ):
+    "CMSnet on a fake Mininet, with hypervisors and VMs added by hand."
+
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+        self.cn = CMSnet( new_config=True, config_folder=self.folder,
+                          net_cls=FakeMininet )
+        self.cn.debug_flag1 = False
+
+    def tearDown( self ):
+        self.cn.store.close()
+        shutil.rmtree( self.folder )
+
+    def addHV( self, name, **capacity ):
+        "Add a hypervisor with the given resource capacity"
+        cn = self.cn
+        node = self.addSwitch( name )
+        hv = Hypervisor( node, self.folder, store=cn.store,
+                         capacity=capacity )
+        cn.HVs.append( hv )
+        cn.nameToComp[ name ] = hv
+        cn.placement.add( hv )
+        return hv
+
+    def addSwitch( self, name, cls=FakeSwitch ):
+        "Add a fabric switch"
+        node = cls( name )
+        self.cn.mn.nameToNode[ name ] = node
+        self.cn.mn.switches.append( node )
+        return node
+
+    def addLink( self, name1, name2 ):
+        "Add a link, as Mininet.addLink does"
+        nameToNode = self.cn.mn.nameToNode
+        link = FakeLink( nameToNode[ name1 ], nameToNode[ name2 ] )
+        self.cn.mn.indexLink( link )
+        return link
+
+    def addVM( self, name, **demand ):
+        "Add a created (not running) VM with the given resource demand"
+        cn = self.cn
+        node = FakeHost( name )
+        cn.mn.nameToNode[ name ] = node
+        cn.mn.hosts.append( node )
+        vm = VirtualMachine( node, self.folder, store=cn.store )
+        vm.demand = demand
+        cn.VMs.append( vm )
+        cn.nameToComp[ name ] = vm
+        cn._indexVM( vm )
+        return vm
+
+
+class testExpandNames( unittest.TestCase ):
+    "Name ranges, globs and malformed patterns."
+
+    names = [ 'vm10', 'vm2', 'web1', 'vm1', 'db1' ]
+
+    def testRanges( self ):
+        "Ranges with and without the repeated prefix"
+        self.assertEqual( expandNames( 'vm1..vm3' ), [ 'vm1', 'vm2', 'vm3' ] )
+        self.assertEqual( expandNames( 'vm8..10' ), [ 'vm8', 'vm9', 'vm10' ] )
+        self.assertEqual( expandNames( 'h2..h2' ), [ 'h2' ] )
+
+    def testGlobs( self ):
+        "Globs match existing names only, in natural order"
+        self.assertEqual( expandNames( 'vm*', self.names ),
+                          [ 'vm1', 'vm2', 'vm10' ] )
+        self.assertEqual( expandNames( 'vm?', self.names ), [ 'vm1', 'vm2' ] )
+        self.assertEqual( expandNames( '[dw]*1', self.names ),
+                          [ 'db1', 'web1' ] )
+        self.assertEqual( expandNames( 'x*', self.names ), [] )
+
+    def testLists( self ):
+        "Strings are split on spaces; lists are taken as they are"
+        self.assertEqual( expandNames( 'db1 vm1..2 web*', self.names ),
+                          [ 'db1', 'vm1', 'vm2', 'web1' ] )
+        self.assertEqual( expandNames( [ 'a', 'b1..b2' ] ),
+                          [ 'a', 'b1', 'b2' ] )
+
+    def testBadPatterns( self ):
+        "Malformed or empty ranges are rejected"
+        for pattern in ( 'vm1..web3', 'vm..vm3', 'vm1..', 'vm3..vm1' ):
+            self.assertRaises( ValueError, expandNames, pattern )
+
+
+class testResources( CMSnetCase ):
+    "Resource demands of running VMs."
+
+    def testSetDemand( self ):
+        "A new demand is checked without the old one, and refused if over"
+        s1 = self.addHV( 's1', cpu=4, mem=1024 )
+        vm1, vm2 = self.addVM( 'vm1', cpu=2 ), self.addVM( 'vm2', cpu=1 )
+        vm1.launch( s1, run_script=False )
+        vm2.launch( s1, run_script=False )
+        self.cn.setVMDemand( 'vm1', cpu=3, mem=512 )
+        self.assertEqual( ( vm1.demand, s1.usage[ 'cpu' ] ),
+                          ( { 'cpu': 3, 'mem': 512 }, 4 ) )
+        self.cn.setVMDemand( 'vm2', cpu=2 )
+        self.assertEqual( ( vm2.demand, s1.usage[ 'cpu' ] ),
+                          ( { 'cpu': 1 }, 4 ) )
+        self.cn.setVMDemand( 'vm1', mem=2048 )
+        self.assertEqual( s1.usage, { 'cpu': 4, 'mem': 512, 'bw': 0 } )
+        # VMs that are not running are not checked
+        vm3 = self.addVM( 'vm3' )
+        self.cn.setVMDemand( 'vm3', cpu=8 )
+        self.assertEqual( vm3.demand, { 'cpu': 8 } )
+
+
+class testHopTable( CMSnetCase ):
+    "Hop table built from the links of the running network."
+
+    def testBuild( self ):
+        "Only switch-to-switch links count, duplicates only once"
+        s1, s2, s3, s4 = [ self.addHV( 's%d' % i ) for i in range( 1, 5 ) ]
+        self.addSwitch( 'l1' )
+        self.addSwitch( 'sp1' )
+        self.addVM( 'vm1' )
+        for name1, name2 in ( ( 's1', 'l1' ), ( 's2', 'l1' ), ( 's1', 'l1' ),
+                              ( 'l1', 'sp1' ), ( 'sp1', 's3' ),
+                              ( 'vm1', 's1' ), ( 'vm1', 's4' ) ):
+            self.addLink( name1, name2 )
+        self.cn.build_hop_table()
+        distance = self.cn.hop_table.distance
+        self.assertEqual( distance( s1, s2 ), 2 )
+        self.assertEqual( distance( s3, s1 ), 3 )
+        self.assertEqual( distance( s2, s2 ), 0 )
+        self.assertTrue( distance( s1, s4 ) > 3 )
+
+
+class testRebalancer( CMSnetCase ):
+    "Migrations planned by one rebalancing round."
+
+    def place( self, hv, num, **demand ):
+        "Run num new VMs with the given demand on hv"
+        for _i in range( num ):
+            vm = self.addVM( 'vm%d' % ( len( self.cn.VMs ) + 1 ), **demand )
+            vm.launch( hv, run_script=False )
+        self.cn.placement.update( hv )
+
+    def plan( self ):
+        "Return the planned moves as ( old HV name, new HV name ) pairs"
+        return [ ( src.name, dst.name )
+                 for _vm, src, dst in self.cn.rebalancer.plan() ]
+
+    def testBalanced( self ):
+        "Loads within the threshold of each other are left alone"
+        s1, s2, s3 = [ self.addHV( 's%d' % i ) for i in range( 1, 4 ) ]
+        self.place( s1, 2 )
+        self.place( s2, 2 )
+        self.place( s3, 1 )
+        self.assertEqual( self.plan(), [] )
+
+    def testOverloaded( self ):
+        "VMs move off the most loaded HV until the loads are even"
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2' )
+        self.place( s1, 6 )
+        self.assertEqual( self.plan(), [ ( 's1', 's2' ) ] * 3 )
+        self.cn.rebalancer.max_moves = 2
+        self.assertEqual( len( self.plan() ), 2 )
+
+    def testCountLimit( self ):
+        "The VM count limit caps destinations only in packed mode"
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2' )
+        self.cn.vm_dist_limit = 2
+        self.place( s1, 6 )
+        self.assertEqual( len( self.plan() ), 3 )
+        self.cn.vm_dist_mode = 'packed'
+        self.assertEqual( len( self.plan() ), 2 )
+
+    def testNoDestination( self ):
+        "Nothing moves when no other HV has room or is enabled"
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2', cpu=1 )
+        s3 = self.addHV( 's3' )
+        self.place( s1, 6, cpu=2 )
+        s3.disable()
+        self.cn.placement.update( s3 )
+        self.assertEqual( self.plan(), [] )
+
+
+class testEviction( CMSnetCase ):
+    "Targets chosen by evictVMs and drainHV."
+
+    def setUp( self ):
+        CMSnetCase.setUp( self )
+        self.moves = []
+        self.cn._migrateLink = self.migrateLink
+
+    def migrateLink( self, vm, hv ):
+        "Record a link move instead of moving interfaces"
+        self.moves.append( ( vm.name, hv.name ) )
+        return 0.01
+
+    def place( self, hv, names, **demand ):
+        "Run new VMs with the given demand on hv"
+        for name in names.split():
+            self.addVM( name, **demand ).launch( hv, run_script=False )
+        self.cn.placement.update( hv )
+
+    def testEvict( self ):
+        "VMs are spread by the policy, and the HV stays enabled"
+        s1, s2, s3 = [ self.addHV( 's%d' % i ) for i in range( 1, 4 ) ]
+        self.place( s1, 'vm1 vm2 vm10 vm3' )
+        report = self.cn.evictVMs( 's1', policy='sparse' )
+        self.assertEqual( report[ 'vms' ], [ 'vm1', 'vm2', 'vm3', 'vm10' ] )
+        self.assertEqual( report[ 'stranded' ], [] )
+        self.assertEqual( sorted( self.moves ),
+                          [ ( 'vm1', 's2' ), ( 'vm10', 's3' ),
+                            ( 'vm2', 's3' ), ( 'vm3', 's2' ) ] )
+        self.assertEqual( report[ 'downtime' ],
+                          dict.fromkeys( report[ 'vms' ], 0.01 ) )
+        self.assertEqual( ( len( s2.nameToVMs ), len( s3.nameToVMs ) ),
+                          ( 2, 2 ) )
+        self.assertTrue( s1.is_enabled() )
+        self.assertEqual( s1.nameToVMs, {} )
+
+    def testEvictTogether( self ):
+        "HVs evicted together are never targets of each other"
+        s1, s2, s3 = [ self.addHV( 's%d' % i ) for i in range( 1, 4 ) ]
+        self.place( s1, 'vm1 vm2' )
+        self.place( s2, 'vm3' )
+        report = self.cn.evictVMs( 's1..s2', policy='sparse' )
+        self.assertEqual( sorted( self.moves ),
+                          [ ( 'vm1', 's3' ), ( 'vm2', 's3' ),
+                            ( 'vm3', 's3' ) ] )
+        self.assertEqual( report[ 'stranded' ], [] )
+
+    def testStranded( self ):
+        "VMs that fit nowhere stay where they are"
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2', cpu=1 )
+        self.place( s1, 'vm1', cpu=2 )
+        self.place( s1, 'vm2', cpu=1 )
+        report = self.cn.evictVMs( 's1', policy='ffd' )
+        self.assertEqual( ( report[ 'vms' ], report[ 'stranded' ] ),
+                          ( [ 'vm2' ], [ 'vm1' ] ) )
+        self.assertEqual( self.moves, [ ( 'vm2', 's2' ) ] )
+        self.assertEqual( self.cn.nameToComp[ 'vm1' ].hv, s1 )
+        self.assertEqual( s2.usage[ 'cpu' ], 1 )
+
+    def testDrain( self ):
+        "A drained HV is left disabled and empty"
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2' )
+        self.cn.vm_dist_mode = 'packed'
+        self.place( s1, 'vm1 vm2' )
+        report = self.cn.drainHV( 's1' )
+        self.assertEqual( report[ 'vms' ], [ 'vm1', 'vm2' ] )
+        self.assertEqual( sorted( self.moves ),
+                          [ ( 'vm1', 's2' ), ( 'vm2', 's2' ) ] )
+        self.assertFalse( s1.is_enabled() )
+        self.assertEqual( self.cn.placement.packed(), s2 )
+
+
+class testLinkMoves( CMSnetCase ):
+    "Interface names and tables after moving VM links."
+
+    def testFastStableName( self ):
+        "In fast mode the switch-side intf is renamed once, then kept"
+        self.cn.migration_mode = 'fast'
+        s1, s2 = self.addHV( 's1' ), self.addHV( 's2' )
+        vm1 = self.addVM( 'vm1' )
+        link = self.addLink( 'vm1', 's1' )
+        self.cn._moveLink( vm1.node, s2.node )
+        self.assertEqual( link.intf2.name, 'hv-vm1-eth0' )
+        self.assertTrue( any( 'name hv-vm1-eth0' in cmd
+                              for cmd in s1.node.cmds ) )
+        s1.node.cmds, s2.node.cmds = [], []
+        self.cn._moveLink( vm1.node, s1.node )
+        self.assertEqual( link.intf2.name, 'hv-vm1-eth0' )
+        self.assertFalse( any( ' name ' in cmd for cmd in s2.node.cmds ) )
+        self.assertEqual( s1.node.cmds, [ 'attach hv-vm1-eth0' ] )
+        self.assertEqual( s1.node.nameToIntf, { 'hv-vm1-eth0': link.intf2 } )
+        self.assertEqual( s2.node.nameToIntf, {} )
+        self.assertEqual( self.cn.mn.peerIntf( link.intf1 ), link.intf2 )
+        self.assertEqual( self.cn.mn.linksBetween( vm1.node, s1.node ),
+                          [ link ] )
+
+
+class testLearningSwitches( CMSnetCase ):
+    "Which switches forget a moved VM, and when the VM announces itself."
+
+    def setUp( self ):
+        CMSnetCase.setUp( self )
+        self.cn.migration_mode = 'fast'
+        self.addHV( 's1' )
+        self.addHV( 's2' )
+        self.vm1 = self.addVM( 'vm1' )
+        self.addLink( 'vm1', 's1' )
+
+    def migrate( self ):
+        "Move vm1 to s2 and return the commands it ran"
+        self.cn.find_learning_switches()
+        self.cn._migrateLink( self.vm1, self.cn.nameToComp[ 's2' ] )
+        return self.vm1.node.cmds
+
+    def testNoLearning( self ):
+        "Without learning switches nothing is forgotten or announced"
+        self.assertEqual( self.migrate(), [] )
+        self.assertEqual( self.cn.forgetting, [] )
+
+    def testNormal( self ):
+        "Normal switches forget nothing, but the VM announces itself"
+        normal = self.addSwitch( 'f1', cls=FakeNormalSwitch )
+        self.assertEqual( len( self.migrate() ), 2 )
+        self.assertEqual( self.cn.forgetting, [] )
+        self.assertEqual( normal.cmds, [] )
+
+    def testMultipath( self ):
+        "Multipath switches delete the MAC of the moved VM"
+        normal = self.addSwitch( 'f1', cls=FakeNormalSwitch )
+        multipath = self.addSwitch( 'f2', cls=FakeMultipathSwitch )
+        self.assertEqual( len( self.migrate() ), 2 )
+        self.assertEqual( self.cn.forgetting, [ multipath ] )
+        self.assertEqual( normal.cmds, [] )
+        ( cmd, ) = multipath.cmds
+        self.assertTrue( cmd.startswith( 'ovs-ofctl del-flows f2' ) )
+        self.assertTrue( 'dl_dst=%s' % self.vm1.MAC in cmd )
+
+
+class testMakeBeforeBreak( CMSnetCase ):
+    "Flows, announcements and controller messages of mbb migrations."
+
+    def testRARP( self ):
+        "The RARP request has the VM MAC as sender and target"
+        frame = rarpFrame( '00:00:00:00:00:0a' )
+        mac = '\x00' * 5 + '\x0a'
+        self.assertEqual( len( frame ), 60 )
+        self.assertEqual( frame[ :14 ], '\xff' * 6 + mac + '\x80\x35' )
+        self.assertEqual( frame[ 20:22 ], '\x00\x03' )
+        self.assertEqual( ( frame[ 22:28 ], frame[ 32:38 ] ), ( mac, mac ) )
+        self.assertEqual( frame[ 42: ], '\x00' * 18 )
+
+    def testAnnounce( self ):
+        "A moved VM sends RARP and gratuitous ARP"
+        self.addHV( 's1' )
+        vm1 = self.addVM( 'vm1' )
+        self.addLink( 'vm1', 's1' )
+        self.cn._announceVM( vm1 )
+        rarp, garp = vm1.node.cmds
+        self.assertTrue( rarpFrame( vm1.MAC ).encode( 'hex' ) in rarp )
+        self.assertTrue( "bind(('vm1-eth0', 0))" in rarp )
+        self.assertTrue( garp.startswith( 'arping -q -U -c 2 -I vm1-eth0 '
+                                          '10.0.0.1' ) )
+
+    def testStagedFlowsExpire( self ):
+        "Staged flows have a hard timeout; non-OVS switches get none"
+        vm1 = self.addVM( 'vm1' )
+        ovs, other = FakeOVSSwitch( 's1' ), FakeSwitch( 's2' )
+        self.cn._stageFlows( vm1, ovs, 3 )
+        self.cn._stageFlows( vm1, other, 3 )
+        self.assertEqual( ovs.cmds, [ 'ovs-ofctl add-flow s1 priority=65520,'
+                                      'hard_timeout=10,dl_dst=%s,'
+                                      'actions=output:3' % vm1.MAC ] )
+        self.assertEqual( other.cmds, [] )
+
+    def testSeqOrder( self ):
+        "Messages from several threads reach the channel in seq order"
+        class SlowChannel( FakeChannel ):
+            def send( self, msg ):
+                sleep( 0.001 )
+                FakeChannel.send( self, msg )
+        cn = self.cn
+        cn.controller_channel = SlowChannel()
+        def send():
+            for i in range( 10 ):
+                cn._send_events( [ { 'cmd': 'migrated', 'host': 'vm1' } ] )
+        threads = [ Thread( target=send ) for i in range( 4 ) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seqs = [ msg[ 'seq' ] for msg in cn.controller_channel.sent ]
+        self.assertEqual( seqs, range( 1, 41 ) )
+
+    def testMigratingOrder( self ):
+        "Migrating events follow the events held by the coalescer"
+        cn = self.cn
+        cn.controller_channel = FakeChannel()
+        cn.coalescer = EventCoalescer( 60, cn._send_events )
+        cn._queue_events( [ { 'cmd': 'migrated', 'host': 'vm1' },
+                            { 'cmd': 'instantiated', 'host': 'vm2' } ] )
+        self.assertEqual( cn.controller_channel.sent, [] )
+        cn._queue_events( [ { 'cmd': 'migrating', 'host': 'vm1' } ] )
+        ( msg, ) = cn.controller_channel.sent
+        self.assertEqual( [ ( e[ 'seq' ], e[ 'cmd' ] )
+                            for e in msg[ 'events' ] ],
+                          [ ( 1, 'migrated' ), ( 2, 'instantiated' ),
+                            ( 3, 'migrating' ) ] )
+        cn.coalescer.stop()
+
+
+class testBulkCommands( CMSnetCase ):
+    "Validation and rollback of the bulk VM commands."
+
+    def testLaunchRollback( self ):
+        "A batch that does not fit leaves no VM placed and no capacity used"
+        self.cn.vm_dist_mode = 'ffd'
+        s1 = self.addHV( 's1', cpu=2 )
+        vms = [ self.addVM( 'vm%d' % i, cpu=1 ) for i in range( 1, 4 ) ]
+        self.assertEqual( self.cn.launchVMs( 'vm1..vm3' ), [] )
+        self.assertEqual( ( s1.usage[ 'cpu' ], s1.nameToVMs ), ( 0, {} ) )
+        self.assertFalse( any( vm.is_running() for vm in vms ) )
+        self.assertEqual( sorted( self.cn.inactiveVMs ),
+                          [ 'vm1', 'vm2', 'vm3' ] )
+        self.assertEqual( self.cn.last_HV, None )
+        self.assertEqual( self.cn.placement.sparse(), s1 )
+        self.assertEqual( self.cn._getNextDefaultHVName( vms[ 0 ] ), 's1' )
+
+    def testBadNames( self ):
+        "Unknown or repeated names fail before anything is changed"
+        self.addHV( 's1' )
+        self.addVM( 'vm1' )
+        self.assertRaises( AssertionError, self.cn.launchVMs, 'vm1 vm9' )
+        self.assertRaises( AssertionError, self.cn.launchVMs, 'vm1 vm1' )
+        self.assertRaises( ValueError, self.cn.launchVMs, 'vm2..vm1' )
+        self.assertFalse( self.cn.nameToComp[ 'vm1' ].is_running() )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the CMSnet placement indexes (does not require root)."""
+
+import unittest
+
+from cmsnet.cms_placement import PlacementEngine, HopTable
+
+
+class FakeHV( object ):
+    "Just what the placement engine reads of a hypervisor"
+
+    def __init__( self, name, vms=0 ):
+        self.name = name
+        self.node = name
+        self.enabled = True
+        self.nameToVMs = {}
+        self.setLoad( vms )
+
+    def setLoad( self, vms ):
+        self.nameToVMs = dict( ( '%s-vm%d' % ( self.name, i ), None )
+                               for i in range( vms ) )
+
+    def is_enabled( self ):
+        return self.enabled
+
+    def __repr__( self ):
+        return self.name
+
+
+class testPlacementEngine( unittest.TestCase ):
+    "Placement order of the distribution modes as loads change."
+
+    def setUp( self ):
+        self.limit = 3
+        self.engine = PlacementEngine(
+            is_full=lambda hv: len( hv.nameToVMs ) >= self.limit )
+        self.hvs = [ FakeHV( 'h%d' % i ) for i in range( 4 ) ]
+        for hv in self.hvs:
+            self.engine.add( hv )
+
+    def place( self, hv, vms ):
+        "Give hv a new load and tell the engine"
+        hv.setLoad( vms )
+        self.engine.update( hv )
+
+    def testSparse( self ):
+        "Least loaded first, first added on ties; stale entries skipped"
+        h0, h1, h2, h3 = self.hvs
+        self.assertEqual( self.engine.sparse(), h0 )
+        self.place( h0, 1 )
+        self.place( h1, 1 )
+        self.assertEqual( self.engine.sparse(), h2 )
+        self.place( h2, 2 )
+        self.place( h3, 2 )
+        self.assertEqual( self.engine.sparse(), h0 )
+        self.place( h0, 0 )
+        self.place( h0, 5 )       # h0's entries for 1 and 0 are stale
+        self.assertEqual( self.engine.sparse(), h1 )
+
+    def testPacked( self ):
+        "Most loaded first, never a full one"
+        h0, h1, h2, h3 = self.hvs
+        self.place( h1, 2 )
+        self.place( h2, 1 )
+        self.assertEqual( self.engine.packed(), h1 )
+        self.place( h1, 3 )       # Full
+        self.assertEqual( self.engine.packed(), h2 )
+        self.place( h1, 2 )       # Room again
+        self.assertEqual( self.engine.packed(), h1 )
+        for hv in self.hvs:
+            self.place( hv, 3 )
+        self.assertEqual( self.engine.packed(), None )
+
+    def testDisabled( self ):
+        "Disabled hypervisors are never chosen, in any mode"
+        h0, h1, h2, h3 = self.hvs
+        h0.enabled = h2.enabled = False
+        self.engine.update( h0, h2 )
+        self.assertEqual( list( self.engine.enabled_HVs() ), [ h1, h3 ] )
+        self.assertEqual( self.engine.sparse(), h1 )
+        self.assertEqual( self.engine.packed(), h1 )
+        self.assertEqual( self.engine.next( h1 ), h3 )
+        self.assertEqual( self.engine.next( h3 ), h1 )
+        self.assertEqual( self.engine.next( h2 ), h3 )
+        self.assertEqual( self.engine.previous( h1 ), h3 )
+        self.assertEqual( self.engine.previous( h2 ), h1 )
+        for _i in range( 20 ):
+            self.assertTrue( self.engine.random() in ( h1, h3 ) )
+            self.assertEqual( self.engine.different( h1 ), h3 )
+        h3.enabled = False
+        self.engine.update( h3 )
+        self.assertEqual( self.engine.different( h1 ), None )
+        h1.enabled = False
+        self.engine.update( h1 )
+        self.assertEqual( ( self.engine.sparse(), self.engine.packed(),
+                            self.engine.random(), self.engine.next( h0 ) ),
+                          ( None, None, None, None ) )
+
+    def testRebuild( self ):
+        "Heaps stay bounded, and give the same choices after rebuilds"
+        h0, h1, h2, h3 = self.hvs
+        limit = 4 * len( self.hvs ) + 64
+        for i in range( 3 * limit ):
+            self.place( self.hvs[ i % 4 ], i % 3 )
+            self.assertTrue( len( self.engine.sparse_heap ) <= limit )
+            self.assertTrue( len( self.engine.packed_heap ) <= limit )
+        loads = [ len( hv.nameToVMs ) for hv in self.hvs ]
+        self.assertEqual( self.engine.sparse(),
+                          self.hvs[ loads.index( min( loads ) ) ] )
+        self.limit = 1            # Capacity change: rebuild needed
+        self.engine.rebuild()
+        self.assertEqual( self.engine.packed(),
+                          self.hvs[ loads.index( 0 ) ] )
+
+
+class testHopTable( unittest.TestCase ):
+    "Hop distances found by breadth-first search over the fabric."
+
+    def testLeafSpine( self ):
+        "Hypervisors under leaves of two spines, and one disconnected"
+        h1, h2, h3, h4 = [ FakeHV( 'h%d' % i ) for i in range( 1, 5 ) ]
+        links = [ ( 'h1', 'l1' ), ( 'l1', 'h2' ), ( 'h3', 'l2' ),
+                  ( 'l1', 'sp1' ), ( 'l1', 'sp2' ),
+                  ( 'sp1', 'l2' ), ( 'sp2', 'l2' ) ]
+        table = HopTable()
+        table.build( [ h1, h2, h3, h4 ], links )
+        self.assertEqual( table.distance( h1, h1 ), 0 )
+        self.assertEqual( table.distance( h1, h2 ), 2 )
+        self.assertEqual( table.distance( h2, h1 ), 2 )
+        self.assertEqual( table.distance( h1, h3 ), 4 )
+        # Farther than any reachable hypervisor
+        self.assertTrue( table.distance( h1, h4 ) > 4 )
+        self.assertEqual( table.distance( h4, h1 ), table.unreachable )
+        self.assertEqual( table.distance( h4, h4 ), 0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the CMS controller component against coalesced CMS events
+   (the component needs POX; the coalescing alone does not)."""
+
+import imp
+import unittest
+from os.path import dirname, join
+
+from cmsnet.cms_channel import EventCoalescer
+
+try:
+    import pox.openflow.libopenflow_01 as of
+    service = imp.load_source( 'mininet_service',
+                               join( dirname( __file__ ), '..', '..',
+                                     'json', 'mininet_service.py' ) )
+except ImportError:
+    of = service = None
+
+
+def vmEvent( cmd, new_hv=None, old_hv=None ):
+    "Return an event of vm1 as CMSnet sends it, on hypervisors s<n>"
+    event = { 'cmd': cmd, 'host': 'vm1', 'mac': '00:00:00:00:00:01',
+              'ip': '10.0.0.1' }
+    if new_hv:
+        event[ 'new_hv' ] = new_hv
+        event[ 'dpid' ] = new_hv[ 1: ]
+    if old_hv:
+        event[ 'old_hv' ] = old_hv
+        event[ 'old_dpid' ] = old_hv[ 1: ]
+    return event
+
+
+def coalesce( *events ):
+    "Return the events collapsed by an EventCoalescer"
+    flushed = []
+    coalescer = EventCoalescer( 60, flushed.extend )
+    for event in events:
+        coalescer.add( event )
+    coalescer.stop()
+    return flushed
+
+
+class FakeConnection( object ):
+    "OpenFlow connection recording the messages sent on it"
+
+    def __init__( self, dpid ):
+        self.dpid = dpid
+        self.sent = []
+
+    def send( self, msg ):
+        self.sent.append( msg )
+
+
+class testCoalescedEvents( unittest.TestCase ):
+    "A VM moved A->B->C within a window is seen as moved A->C."
+
+    def testMigratedMigrated( self ):
+        "Old location comes from the first event"
+        ( event, ) = coalesce( vmEvent( 'migrated', 's2', 's1' ),
+                               vmEvent( 'migrated', 's3', 's2' ) )
+        self.assertEqual( ( event[ 'cmd' ], event[ 'old_hv' ],
+                            event[ 'old_dpid' ], event[ 'dpid' ] ),
+                          ( 'migrated', 's1', '1', '3' ) )
+
+    def testMigratedDestroyed( self ):
+        "A destroyed VM was last seen where it was before migrating"
+        ( event, ) = coalesce( vmEvent( 'migrated', 's2', 's1' ),
+                               vmEvent( 'destroyed', None, 's2' ) )
+        self.assertEqual( ( event[ 'cmd' ], event[ 'old_hv' ],
+                            event[ 'old_dpid' ] ),
+                          ( 'destroyed', 's1', '1' ) )
+
+    def testInstantiatedMigrated( self ):
+        "A VM the controller never saw has no old location"
+        ( event, ) = coalesce( vmEvent( 'instantiated', 's1' ),
+                               vmEvent( 'migrated', 's2', 's1' ) )
+        self.assertEqual( event[ 'cmd' ], 'instantiated' )
+        self.assertFalse( 'old_hv' in event or 'old_dpid' in event )
+
+
+@unittest.skipIf( service is None, 'requires POX' )
+class testCMSBot( unittest.TestCase ):
+    "Flows deleted by CMSBot for coalesced events."
+
+    def setUp( self ):
+        self.bot = service.CMSBot.__new__( service.CMSBot )
+        self.bot._init( {} )
+        self.cons = {}
+        self.bot._connection = lambda dpid: self.cons.setdefault(
+            dpid, FakeConnection( dpid ) )
+
+    def deletes( self ):
+        "Return the dpids that got flow deletes"
+        return sorted( dpid for dpid, con in self.cons.items()
+                       if any( msg.command == of.OFPFC_DELETE
+                               for msg in con.sent ) )
+
+    def testMigratedTwice( self ):
+        "A->B->C deletes the flows of A, not B"
+        self.bot._apply( vmEvent( 'instantiated', 's1' ) )
+        for event in coalesce( vmEvent( 'migrated', 's2', 's1' ),
+                               vmEvent( 'migrated', 's3', 's2' ) ):
+            self.bot._apply( event )
+        self.assertEqual( self.deletes(), [ '1' ] )
+        self.assertEqual( self.bot.table.lookup( 'vm1' )[ 'dpid' ], '3' )
+
+    def testTableFirst( self ):
+        "The table, not the event, says where the old flows are"
+        self.bot._apply( vmEvent( 'instantiated', 's1' ) )
+        self.bot._apply( vmEvent( 'destroyed', None, 's2' ) )
+        self.assertEqual( self.deletes(), [ '1' ] )
+        self.assertEqual( len( self.bot.table ), 0 )
+
+    def testEventFallback( self ):
+        "Without a table entry, the event says where the old flows are"
+        self.bot._apply( vmEvent( 'migrated', 's3', 's2' ) )
+        self.assertEqual( self.deletes(), [ '2' ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the journaled CMSnet state store (does not require root)."""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cmsnet.cms_store import CMSStore
+
+
+class testCMSStore( unittest.TestCase ):
+    "Journal replay, write coalescing, compaction and legacy import."
+
+    def setUp( self ):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.folder )
+
+    def open( self, **params ):
+        "Open the store of the test folder"
+        return CMSStore( self.folder, **params )
+
+    def journal( self ):
+        "Return the records of the journal"
+        with open( os.path.join( self.folder, 'cms.journal' ) ) as f:
+            return [ json.loads( line ) for line in f ]
+
+    def testCrashReplay( self ):
+        "A journal without a snapshot is replayed, skipping a torn record"
+        store = self.open()
+        store.put( 'vm/vm1', { 'hv': 's1' } )
+        store.put( 'vm/vm2', { 'hv': 's2' } )
+        store.put( 'vm/vm1', { 'hv': 's3' } )
+        store.delete( 'vm/vm2' )
+        # Crash: no close(), and a half-written last record.
+        store.journal.write( '{"op": "put", "key": "vm/vm3", "va' )
+        store.journal.flush()
+        self.assertFalse( os.path.exists(
+            os.path.join( self.folder, 'cms.snapshot' ) ) )
+        store = self.open()
+        self.assertEqual( store.keys(), [ 'vm/vm1' ] )
+        self.assertEqual( store.get( 'vm/vm1' ), { 'hv': 's3' } )
+        self.assertEqual( store.journal_len, 4 )
+
+    def testBatch( self ):
+        "A batch writes only the final value of each key, in one append"
+        store = self.open()
+        store.put( 'vm/vm1', { 'hv': 's1' } )
+        with store.batch():
+            store.put( 'vm/vm1', { 'hv': 's2' } )
+            with store.batch():
+                store.put( 'vm/vm1', { 'hv': 's3' } )
+                store.put( 'vm/vm2', { 'hv': 's1' } )
+                store.delete( 'vm/vm2' )
+            self.assertEqual( len( self.journal() ), 1 )   # Not yet
+            self.assertEqual( store.get( 'vm/vm1' ), { 'hv': 's3' } )
+            self.assertFalse( 'vm/vm2' in store )
+        self.assertEqual( self.journal()[ 1: ],
+                          [ { 'op': 'put', 'key': 'vm/vm1',
+                              'value': { 'hv': 's3' } } ] )
+        store.put( 'vm/vm1', { 'hv': 's3' } )              # Unchanged
+        self.assertEqual( len( self.journal() ), 2 )
+
+    def testCompact( self ):
+        "A journal longer than the state is compacted into a snapshot"
+        store = self.open( compact_min=3 )
+        for i in range( 4 ):
+            store.put( 'cmsnet', { 'round': i } )
+        self.assertEqual( store.journal_len, 0 )
+        self.assertEqual( self.journal(), [] )
+        store.put( 'hv/s1', { 'enabled': True } )
+        store.close()
+        store = self.open( compact_min=3 )
+        self.assertEqual( store.get( 'cmsnet' ), { 'round': 3 } )
+        self.assertEqual( store.get( 'hv/s1' ), { 'enabled': True } )
+        self.assertEqual( store.journal_len, 1 )
+
+    def testMigrateLegacy( self ):
+        "Legacy config files are imported once, into a snapshot"
+        files = { 'cn.config_cmsnet': { 'vm_dist_mode': 'random' },
+                  'vm1.config_vm': { 'hv_name': 's1' },
+                  'h1.config_hv': { 'enabled': False } }
+        for name, config in files.items():
+            with open( os.path.join( self.folder, name ), 'w' ) as f:
+                json.dump( config, f )
+        with open( os.path.join( self.folder, 'notes.txt' ), 'w' ) as f:
+            f.write( 'not a config\n' )
+        store = self.open()
+        self.assertEqual( store.keys(), [ 'cmsnet', 'hv/h1', 'vm/vm1' ] )
+        self.assertEqual( store.get( 'vm/vm1' ), { 'hv_name': 's1' } )
+        self.assertEqual( store.journal_len, 0 )
+        store.close()
+        # Changes to a legacy file are not imported again.
+        with open( os.path.join( self.folder, 'vm1.config_vm' ), 'w' ) as f:
+            json.dump( { 'hv_name': 's9' }, f )
+        store = self.open()
+        self.assertEqual( store.get( 'vm/vm1' ), { 'hv_name': 's1' } )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the CMSnet multipath topologies (does not require root)."""
+
+import unittest
+
+from cmsnet.cms_topo import CMSLeafSpineTopo, CMSFatTreeTopo
+from cmsnet.mininet_node_patch import OVSNormalSwitch, OVSMultipathSwitch
+
+
+class MultipathTopoCase( unittest.TestCase ):
+    "Checks shared by the multipath topologies."
+
+    def assertPorts( self, topo ):
+        "Every switch numbers its ports 1..degree, both ends agreeing"
+        degree = dict.fromkeys( topo.nodes(), 0 )
+        for src, dst in topo.links():
+            degree[ src ] += 1
+            degree[ dst ] += 1
+        for node in topo.nodes():
+            ports = sorted( topo.ports[ node ].values() )
+            self.assertEqual( ports, range( 1, degree[ node ] + 1 ) )
+        for src, dst in topo.links():
+            sport, dport = topo.port( src, dst )
+            self.assertEqual( topo.port( dst, src ), ( dport, sport ) )
+
+    def assertUplinks( self, topo, name, uplinks ):
+        "A fabric switch has the given uplinks, on its first ports"
+        info = topo.nodeInfo( name )
+        self.assertEqual( info[ 'cls' ], OVSMultipathSwitch )
+        self.assertEqual( info[ 'uplinks' ], uplinks )
+        self.assertEqual( sorted( topo.port( name, up )[ 0 ]
+                                  for up in uplinks ),
+                          range( 1, len( uplinks ) + 1 ) )
+
+
+class testLeafSpine( MultipathTopoCase ):
+    "Leaf-spine fabrics."
+
+    def testCounts( self ):
+        "Spines, leaves, HV-switches and their links"
+        topo = CMSLeafSpineTopo( spine_num=2, leaf_num=3, hv_num=4 )
+        self.assertEqual( topo.fabricSwitches(),
+                          [ 'leaf7', 'leaf8', 'leaf9', 'spine5', 'spine6' ] )
+        self.assertEqual( topo.hvSwitches(), [ 's1', 's2', 's3', 's4' ] )
+        self.assertEqual( topo.fb_num, 5 )
+        self.assertEqual( len( topo.links() ), 3 * 2 + 4 )
+        self.assertPorts( topo )
+
+    def testPorts( self ):
+        "Leaves have their spines as uplinks; HV-switches round robin"
+        topo = CMSLeafSpineTopo( spine_num=2, leaf_num=3, hv_num=4 )
+        for leaf in 'leaf7', 'leaf8', 'leaf9':
+            self.assertUplinks( topo, leaf, [ 'spine5', 'spine6' ] )
+        self.assertUplinks( topo, 'spine5', [] )
+        self.assertEqual( topo.port( 's1', 'leaf7' ), ( 1, 3 ) )
+        self.assertEqual( topo.port( 's4', 'leaf7' ), ( 1, 4 ) )
+        self.assertEqual( topo.port( 's3', 'leaf9' ), ( 1, 3 ) )
+        self.assertEqual( topo.port( 'spine6', 'leaf9' ), ( 3, 2 ) )
+
+    def testSpanningTree( self ):
+        "With multipath=stp the fabric is learning switches with STP"
+        topo = CMSLeafSpineTopo( multipath='stp' )
+        info = topo.nodeInfo( 'leaf5' )
+        self.assertEqual( info[ 'cls' ], OVSNormalSwitch )
+        self.assertTrue( info[ 'stp' ] )
+        self.assertEqual( topo.topoOpts()[ 'multipath' ], 'stp' )
+
+
+class testFatTree( MultipathTopoCase ):
+    "k-ary fat-tree fabrics."
+
+    def testCounts( self ):
+        "k=4: 4 cores, 8 aggregation and 8 edge switches, 16 HV-switches"
+        topo = CMSFatTreeTopo( k=4 )
+        fabric = topo.fabricSwitches()
+        for prefix, count in ( 'core', 4 ), ( 'agg', 8 ), ( 'edge', 8 ):
+            self.assertEqual( len( [ n for n in fabric
+                                     if n.startswith( prefix ) ] ), count )
+        self.assertEqual( topo.fb_num, 20 )
+        self.assertEqual( len( topo.hvSwitches() ), 16 )
+        self.assertEqual( len( topo.links() ), 16 + 16 + 16 )
+        self.assertPorts( topo )
+
+    def testSmallest( self ):
+        "k=2: one core, one pod switch of each kind per pod"
+        topo = CMSFatTreeTopo( k=2 )
+        self.assertEqual( topo.fabricSwitches(),
+                          [ 'agg4', 'agg6', 'core3', 'edge5', 'edge7' ] )
+        self.assertEqual( topo.links(),
+                          [ ( 'agg4', 'core3' ), ( 'agg4', 'edge5' ),
+                            ( 'agg6', 'core3' ), ( 'agg6', 'edge7' ),
+                            ( 'edge5', 's1' ), ( 'edge7', 's2' ) ] )
+        self.assertPorts( topo )
+
+    def testPorts( self ):
+        "Pod switches have the switches above as uplinks, on ports 1..k/2"
+        topo = CMSFatTreeTopo( k=4, hv_num=8 )
+        # Cores core9..core12; first pod: agg13, agg14, edge15, edge16.
+        self.assertUplinks( topo, 'agg13', [ 'core9', 'core10' ] )
+        self.assertUplinks( topo, 'agg14', [ 'core11', 'core12' ] )
+        self.assertUplinks( topo, 'edge15', [ 'agg13', 'agg14' ] )
+        self.assertUplinks( topo, 'core9', [] )
+        self.assertEqual( topo.port( 'agg13', 'edge16' ), ( 4, 1 ) )
+        # Every edge switch gets one HV-switch, on port k/2 + 1.
+        self.assertEqual( topo.port( 's1', 'edge15' ), ( 1, 3 ) )
+        self.assertEqual( topo.port( 's2', 'edge16' ), ( 1, 3 ) )
+        self.assertEqual( len( topo.hvSwitches() ), 8 )
+        self.assertPorts( topo )
+
+    def testBadK( self ):
+        "k must be even, and HV-switches fit on the edge switches"
+        self.assertRaises( AssertionError, CMSFatTreeTopo, k=3 )
+        self.assertRaises( AssertionError, CMSFatTreeTopo, k=2, hv_num=3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the link adjacency index of Mininet (does not require root)."""
+
+import unittest
+
+from mininet.net import Mininet
+from mininet.node import Node
+
+
+class FakeIntf( object ):
+    "Interface recording its status changes"
+
+    def __init__( self, node ):
+        self.node = node
+        self.link = None
+        self.status = []
+        node.intfs.append( self )
+
+    def ifconfig( self, status ):
+        self.status.append( status )
+        return ''
+
+
+class FakeNode( object ):
+    "Just what the index and configLinkStatus read of a node"
+
+    connectionsTo = Node.connectionsTo.im_func
+
+    def __init__( self, name ):
+        self.name = name
+        self.intfs = []
+
+    def intfList( self ):
+        return list( self.intfs )
+
+
+class FakeLink( object ):
+    "Link between two nodes, made without Mininet.addLink()"
+
+    def __init__( self, node1, node2 ):
+        self.intf1, self.intf2 = FakeIntf( node1 ), FakeIntf( node2 )
+        self.intf1.link = self.intf2.link = self
+
+
+class testLinkIndex( unittest.TestCase ):
+    "Lookups through the index, and with links the index does not know."
+
+    def setUp( self ):
+        self.net = Mininet.__new__( Mininet )
+        self.net.nameToNode = {}
+        self.net.nodePairToLinks = {}
+        self.net.intfToPeer = {}
+        self.h1, self.s1, self.s2 = [ self.addNode( name )
+                                      for name in 'h1', 's1', 's2' ]
+
+    def addNode( self, name ):
+        node = FakeNode( name )
+        self.net.nameToNode[ name ] = node
+        return node
+
+    def testIndexed( self ):
+        "Indexed links are found from either end"
+        link = FakeLink( self.h1, self.s1 )
+        self.net.indexLink( link )
+        self.assertEqual( self.net.connectionsBetween( self.s1, self.h1 ),
+                          [ ( link.intf2, link.intf1 ) ] )
+        self.assertEqual( self.net.peerIntf( link.intf1 ), link.intf2 )
+        self.net.configLinkStatus( 'h1', 's1', 'down' )
+        self.assertEqual( ( link.intf1.status, link.intf2.status ),
+                          ( [ 'down' ], [ 'down' ] ) )
+
+    def testUnindexed( self ):
+        "Links made with Link() are still found by configLinkStatus"
+        link = FakeLink( self.s1, self.s2 )
+        self.assertEqual( self.net.connectionsBetween( self.s1, self.s2 ),
+                          [] )
+        self.net.configLinkStatus( 's2', 's1', 'down' )
+        self.assertEqual( ( link.intf1.status, link.intf2.status ),
+                          ( [ 'down' ], [ 'down' ] ) )
+
+    def testUnindexNode( self ):
+        "A deleted node's links leave the index"
+        link1 = FakeLink( self.h1, self.s1 )
+        link2 = FakeLink( self.s1, self.s2 )
+        self.net.indexLink( link1 )
+        self.net.indexLink( link2 )
+        self.net.unindexNode( self.h1 )
+        self.assertEqual( self.net.linksBetween( self.h1, self.s1 ), [] )
+        self.assertEqual( self.net.peerIntf( link1.intf2 ), None )
+        self.assertEqual( self.net.linksBetween( self.s2, self.s1 ),
+                          [ link2 ] )
+
+
+if __name__ == '__main__':
+    unittest.main()
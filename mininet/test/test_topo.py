@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test topology storage (does not require root or a running network)."""
+
+import unittest
+from StringIO import StringIO
+
+from mininet.topo import Topo, CompactTopo, LinearTopo
+from mininet.topolib import TreeTopo
+from mininet.topofile import writeTopo, writeNet, loadTopo, StreamTopo
+from mininet.link import TCLink
+
+
+class CompactLinearTopo( CompactTopo, LinearTopo ):
+    "LinearTopo with compact storage"
+    pass
+
+
+class CompactTreeTopo( CompactTopo, TreeTopo ):
+    "TreeTopo with compact storage"
+    pass
+
+
+def buildSample( topo ):
+    "Add a small topology with custom ports, options and a duplicate link"
+    s1 = topo.addSwitch( 's1' )
+    s2 = topo.addSwitch( 's2', dpid='2' )
+    h1 = topo.addHost( 'h1' )
+    h2 = topo.addHost( 'h2', ip='10.0.0.22' )
+    topo.addLink( h1, s1 )
+    topo.addLink( s1, s2, bw=10 )
+    topo.addLink( h2, s2, port1=3, port2=7 )
+    topo.addLink( s2, s1, bw=10 )
+    return topo
+
+
+class FakeIntf( object ):
+    "Just what writeNet reads of an interface"
+    prefixLen = None
+
+    def __init__( self, node, port, **params ):
+        self.node, self.link, self.params = node, None, params
+        node.ports[ self ] = port
+        node.intfs.append( self )
+
+    def IP( self ):
+        return None
+
+    def MAC( self ):
+        return None
+
+
+class FakeNode( object ):
+    "Just what writeNet reads of a node"
+
+    def __init__( self, name, dpid=None ):
+        self.name, self.dpid, self.params = name, dpid, {}
+        self.ports, self.intfs = {}, []
+
+    def intfList( self ):
+        return self.intfs
+
+    def defaultIntf( self ):
+        return self.intfs[ 0 ] if self.intfs else None
+
+
+class FakeNet( object ):
+    "Nodes and links for writeNet, without creating them"
+
+    def __init__( self ):
+        self.hosts, self.switches = [], []
+
+    def addHost( self, name ):
+        self.hosts.append( FakeNode( name ) )
+        return self.hosts[ -1 ]
+
+    def addSwitch( self, name ):
+        self.switches.append( FakeNode( name, dpid='1' ) )
+        return self.switches[ -1 ]
+
+    def addLink( self, node1, node2, cls, **params ):
+        link = cls.__new__( cls )    # A real link needs root.
+        link.intf1 = FakeIntf( node1, len( node1.ports ), **params )
+        link.intf2 = FakeIntf( node2, len( node2.ports ) + 1, **params )
+        link.intf1.link = link.intf2.link = link
+        return link
+
+
+class testCompactTopo( unittest.TestCase ):
+    "Compare CompactTopo against the reference Topo storage."
+
+    def assertSameTopo( self, ref, compact ):
+        "Check that both topologies answer the Topo API identically"
+        self.assertEqual( ref.nodes(), compact.nodes() )
+        self.assertEqual( ref.switches(), compact.switches() )
+        self.assertEqual( ref.hosts(), compact.hosts() )
+        self.assertEqual( ref.links(), compact.links() )
+        for name in ref.nodes():
+            self.assertEqual( ref.nodeInfo( name ),
+                              compact.nodeInfo( name ) )
+        for src, dst in ref.links():
+            self.assertEqual( ref.port( src, dst ),
+                              compact.port( src, dst ) )
+            self.assertEqual( ref.port( dst, src ),
+                              compact.port( dst, src ) )
+            self.assertEqual( ref.linkInfo( src, dst ),
+                              compact.linkInfo( src, dst ) )
+
+    def testSample( self ):
+        "Custom ports, options and duplicate links"
+        self.assertSameTopo( buildSample( Topo() ),
+                             buildSample( CompactTopo() ) )
+
+    def testLinear( self ):
+        "LinearTopo with several hosts per switch"
+        self.assertSameTopo( LinearTopo( k=4, n=3 ),
+                             CompactLinearTopo( k=4, n=3 ) )
+
+    def testTree( self ):
+        "TreeTopo"
+        self.assertSameTopo( TreeTopo( depth=3, fanout=3 ),
+                             CompactTreeTopo( depth=3, fanout=3 ) )
+
+    def testInterning( self ):
+        "Nodes and links with equal options share one dict"
+        topo = CompactTopo()
+        for i in range( 1, 101 ):
+            topo.addHost( 'h%d' % i, cpu=0.1 )
+            topo.addLink( 'h%d' % i, topo.addSwitch( 's%d' % i ), bw=5 )
+        ids = topo.g.ids
+        self.assertEqual( topo.nodeOpts[ ids[ 'h1' ] ],
+                          topo.nodeOpts[ ids[ 'h100' ] ] )
+        self.assertEqual( topo.linkOpts[ topo._edge( 'h1', 's1' ) ],
+                          topo.linkOpts[ topo._edge( 'h50', 's50' ) ] )
+        # {}, host opts, switch opts and link opts
+        self.assertEqual( len( topo.optsPool ), 4 )
+        # Changing a returned dict changes no node or link
+        topo.nodeInfo( 'h1' )[ 'cpu' ] = 0.5
+        topo.linkInfo( 'h1', 's1' )[ 'bw' ] = 1
+        self.assertEqual( topo.nodeInfo( 'h100' ), { 'cpu': 0.1 } )
+        self.assertEqual( topo.nodeInfo( 'h1' ), { 'cpu': 0.1 } )
+        self.assertEqual( topo.linkInfo( 'h50', 's50' ), { 'bw': 5 } )
+
+    def testNeighbors( self ):
+        "g[ node ] lists the neighbors of node on both ends of its links"
+        topo = buildSample( CompactTopo() )
+        for node in topo.nodes():
+            self.assertEqual(
+                sorted( topo.g[ node ] ),
+                sorted( [ dst for src, dst in topo.g.edges()
+                          if src == node ] +
+                        [ src for src, dst in topo.g.edges()
+                          if dst == node and src != node ] ) )
+        self.assertEqual( sorted( topo.g[ 's1' ] ), [ 'h1', 's2', 's2' ] )
+
+    def testSetInfo( self ):
+        "setNodeInfo and setlinkInfo replace shared dicts"
+        topo = buildSample( CompactTopo() )
+        topo.setNodeInfo( 'h1', { 'ip': '10.1.1.1' } )
+        topo.setlinkInfo( 's2', 'h2', { 'delay': '1ms' } )
+        self.assertEqual( topo.nodeInfo( 'h1' ), { 'ip': '10.1.1.1' } )
+        self.assertEqual( topo.linkInfo( 'h2', 's2' ), { 'delay': '1ms' } )
+        self.assertFalse( topo.isSwitch( 'h1' ) )
+
+
+class testTopoFile( unittest.TestCase ):
+    "Round-trip topologies through the streaming topology file format."
+
+    def roundTrip( self, topo ):
+        "Return a seekable file holding topo"
+        out = StringIO()
+        writeTopo( topo, out, sort=True )
+        out.seek( 0 )
+        return out
+
+    def testLoad( self ):
+        "loadTopo reproduces nodes, links, ports and options"
+        ref = buildSample( Topo() )
+        for topo in ( loadTopo( self.roundTrip( ref ) ),
+                      loadTopo( self.roundTrip( ref ), CompactTopo() ) ):
+            testCompactTopo( 'testSample' ).assertSameTopo( ref, topo )
+
+    def testStream( self ):
+        "StreamTopo yields the same entries as the source topology"
+        ref = LinearTopo( k=3, n=2 )
+        topo = StreamTopo( self.roundTrip( ref ) )
+        self.assertEqual( list( ref.hostEntries() ),
+                          list( topo.hostEntries() ) )
+        self.assertEqual( list( ref.switchEntries() ),
+                          list( topo.switchEntries() ) )
+        self.assertEqual( list( ref.linkEntries() ),
+                          list( topo.linkEntries() ) )
+        self.assertEqual( ref.links(), topo.links() )
+        self.assertTrue( topo.isSwitch( 's1' ) )
+
+    def testDefaultPorts( self ):
+        "Missing ports are numbered per node in file order"
+        lines = [ '# comment', '',
+                  '{"type": "switch", "name": "s1"}',
+                  '{"type": "host", "name": "h1"}',
+                  '{"type": "host", "name": "h2"}',
+                  '{"type": "link", "node1": "h1", "node2": "s1"}',
+                  '{"type": "link", "node1": "h2", "node2": "s1", '
+                  '"opts": {"cls": "MyLink", "bw": 1}}' ]
+        topo = StreamTopo( StringIO( '\n'.join( lines ) ) )
+        self.assertEqual( [ entry[ :4 ] for entry in topo.linkEntries() ],
+                          [ ( 'h1', 's1', 0, 1 ), ( 'h2', 's1', 0, 2 ) ] )
+        # Unknown class names are dropped
+        self.assertEqual( topo.linkInfo( 'h2', 's1' ), { 'bw': 1 } )
+        self.assertEqual( loadTopo( StringIO( '\n'.join( lines ) ),
+                                    classes={ 'MyLink': str } )
+                          .linkInfo( 'h2', 's1' ), { 'cls': str, 'bw': 1 } )
+
+    def testMixedPorts( self ):
+        "Explicit and missing ports number the same whichever way loaded"
+        lines = [ '{"type": "switch", "name": "s1"}',
+                  '{"type": "switch", "name": "s2"}',
+                  '{"type": "host", "name": "h1"}',
+                  '{"type": "host", "name": "h2"}',
+                  '{"type": "link", "node1": "h1", "node2": "s1", '
+                  '"port2": 5}',
+                  '{"type": "link", "node1": "h2", "node2": "s1"}',
+                  '{"type": "link", "node1": "s1", "node2": "s2", '
+                  '"port2": 7}' ]
+        text = '\n'.join( lines )
+        stream = list( StreamTopo( StringIO( text ) ).linkEntries() )
+        for topo in ( loadTopo( StringIO( text ) ),
+                      loadTopo( StringIO( text ), CompactTopo() ) ):
+            self.assertEqual( [ entry[ :4 ] for entry in stream ],
+                              [ ( src, dst ) + topo.port( src, dst )
+                                for src, dst, _sp, _dp, _opts in stream ] )
+        self.assertEqual( [ entry[ :4 ] for entry in stream ],
+                          [ ( 'h1', 's1', 0, 5 ), ( 'h2', 's1', 0, 2 ),
+                            ( 's1', 's2', 3, 7 ) ] )
+
+    def testWriteNetLinkClass( self ):
+        "writeNet keeps the link class, and with it the link options"
+        net = FakeNet()
+        h1, s1 = net.addHost( 'h1' ), net.addSwitch( 's1' )
+        net.addLink( h1, s1, TCLink, bw=10, delay='1ms' )
+        out = StringIO()
+        writeNet( net, out )
+        out.seek( 0 )
+        topo = loadTopo( out )
+        self.assertEqual( topo.linkInfo( 'h1', 's1' ),
+                          { 'cls': TCLink, 'bw': 10, 'delay': '1ms' } )
+        # The classes dict overrides the standard classes
+        out.seek( 0 )
+        topo = loadTopo( out, classes={ 'TCLink': str } )
+        self.assertEqual( topo.linkInfo( 'h1', 's1' )[ 'cls' ], str )
+
+    def testBadRecord( self ):
+        "Unknown record types and nodes are rejected"
+        self.assertRaises( Exception, loadTopo,
+                           StringIO( '{"type": "router", "name": "r1"}' ) )
+        topo = StreamTopo( StringIO(
+            '{"type": "link", "node1": "h1", "node2": "s1"}' ) )
+        self.assertRaises( Exception, list, topo.linkEntries() )
+
+
+if __name__ == '__main__':
+    unittest.main()
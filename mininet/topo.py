@@ -11,6 +11,8 @@
 setup for testing, and can even be emulated with the Mininet package.
 '''
 
+from array import array
+
 from mininet.util import irange, natural, naturalSeq
 
 class MultiGraph( object ):
@@ -45,6 +47,63 @@ def __getitem__( self, node ):
         return self.data[node]
 
 
+class ArrayGraph( object ):
+    """Compact replacement for MultiGraph: nodes are mapped to integer
+       ids, edges are kept in two parallel arrays of ids, and each node
+       keeps an array of the ids of its neighbors."""
+
+    def __init__( self ):
+        self.names = []  # node id -> node name
+        self.ids = {}  # node name -> node id
+        self.src = array( 'l' )
+        self.dst = array( 'l' )
+        self.adj = []  # node id -> array of neighbor ids, one per edge
+
+    def nodeId( self, node ):
+        "Return integer id of node, adding node if necessary"
+        nid = self.ids.get( node )
+        if nid is None:
+            nid = len( self.names )
+            self.ids[ node ] = nid
+            self.names.append( node )
+            self.adj.append( array( 'l' ) )
+        return nid
+
+    def add_node( self, node ):
+        "Add node to graph"
+        self.nodeId( node )
+
+    def add_edge( self, src, dest ):
+        "Add edge to graph; returns edge index"
+        src, dest = sorted( ( src, dest ) )
+        sid, did = self.nodeId( src ), self.nodeId( dest )
+        self.src.append( sid )
+        self.dst.append( did )
+        self.adj[ sid ].append( did )
+        if did != sid:
+            self.adj[ did ].append( sid )
+        return len( self.src ) - 1
+
+    def nodes( self ):
+        "Return list of graph nodes"
+        return list( self.names )
+
+    def edges( self ):
+        "Iterator: return graph edges"
+        names, src, dst = self.names, self.src, self.dst
+        for i in xrange( len( src ) ):
+            yield ( names[ src[ i ] ], names[ dst[ i ] ] )
+
+    def numEdges( self ):
+        "Return number of edges"
+        return len( self.src )
+
+    def __getitem__( self, node ):
+        "Return list of nodes linked to the given node, one per edge"
+        names = self.names
+        return [ names[ nid ] for nid in self.adj[ self.ids[ node ] ] ]
+
+
 class Topo(object):
     "Data center network representation for structured multi-trees."
 
@@ -53,12 +112,16 @@ def __init__(self, hopts=None, sopts=None, lopts=None):
            hinfo: default host options
            sopts: default switch options
            lopts: default link options"""
-        self.g = MultiGraph()
-        self.node_info = {}
-        self.link_info = {}  # (src, dst) tuples hash to EdgeInfo objects
         self.hopts = {} if hopts is None else hopts
         self.sopts = {} if sopts is None else sopts
         self.lopts = {} if lopts is None else lopts
+        self.initStorage()
+
+    def initStorage( self ):
+        "Create the graph and metadata containers (override to change them)"
+        self.g = MultiGraph()
+        self.node_info = {}
+        self.link_info = {}  # (src, dst) tuples hash to EdgeInfo objects
         self.ports = {}  # ports[src][dst] is port on src that connects to dst
 
     def addNode(self, name, **opts):
@@ -107,6 +170,7 @@ def addPort(self, src, dst, sport=None, dport=None):
         '''Generate port mapping for new edge.
         @param src source switch name
         @param dst destination switch name
+        @return tuple (sport, dport)
         '''
         self.ports.setdefault(src, {})
         self.ports.setdefault(dst, {})
@@ -119,6 +183,7 @@ def addPort(self, src, dst, sport=None, dport=None):
             dport = len(self.ports[dst]) + dst_base
         self.ports[src][dst] = sport
         self.ports[dst][src] = dport
+        return sport, dport
 
     def nodes(self, sort=True):
         "Return nodes in graph"
@@ -157,6 +222,23 @@ def links(self, sort=True):
             links = [tuple(self.sorted(e)) for e in self.g.edges()]
             return sorted( links, key=naturalSeq )
 
+    def hostEntries(self, sort=True):
+        "Iterator: return ( name, info ) for each host"
+        for name in self.hosts(sort):
+            yield name, self.nodeInfo(name)
+
+    def switchEntries(self, sort=True):
+        "Iterator: return ( name, info ) for each switch"
+        for name in self.switches(sort):
+            yield name, self.nodeInfo(name)
+
+    def linkEntries(self, sort=True):
+        """Iterator: return ( src, dst, srcPort, dstPort, info ) for each
+           link; this is what Mininet.buildFromTopo() consumes."""
+        for src, dst in self.links(sort):
+            srcPort, dstPort = self.port(src, dst)
+            yield src, dst, srcPort, dstPort, self.linkInfo(src, dst)
+
     def port(self, src, dst):
         '''Get port number.
 
@@ -194,6 +276,171 @@ def sorted( items ):
         "Items sorted in natural (i.e. alphabetical) order"
         return sorted(items, key=natural)
 
+
+class CompactTopo(Topo):
+    """Topo with compact storage for very large topologies.
+
+       Nodes get integer ids, edges and ports live in arrays, and equal
+       option dicts are interned so that all nodes/links with the same
+       options share one dict. The Topo API is unchanged, except that
+       nodeInfo() and linkInfo() return copies of the shared dicts, so
+       changes must be stored back with setNodeInfo/setlinkInfo.
+
+       Mix it in front of an existing Topo subclass to get compact
+       storage for it, e.g. class BigTree(CompactTopo, TreeTopo): pass"""
+
+    def initStorage( self ):
+        "Create array-backed graph and metadata containers"
+        self.g = ArrayGraph()
+        self.optsPool = []  # shared option dicts
+        self.optsIndex = {}  # hashable opts key -> index in optsPool
+        self.nodeOpts = array( 'l' )  # node id -> index in optsPool
+        self.switchFlags = array( 'b' )  # node id -> isSwitch
+        self.portCounts = array( 'l' )  # node id -> number of peers
+        self.linkOpts = array( 'l' )  # edge -> index in optsPool
+        self.srcPorts = array( 'l' )  # edge -> port on g.src node
+        self.dstPorts = array( 'l' )  # edge -> port on g.dst node
+        self.pairs = {}  # pairKey(id1, id2) -> latest edge between them
+
+    def internOpts( self, opts ):
+        "Return the optsPool index of a shared dict equal to opts"
+        if opts is None:
+            opts = {}
+        try:
+            key = tuple( sorted( opts.items() ) )
+            hash( key )
+        except TypeError:
+            key = None  # unhashable values: keep a private copy
+        if key is not None:
+            index = self.optsIndex.get( key )
+            if index is not None:
+                return index
+        index = len( self.optsPool )
+        self.optsPool.append( opts )
+        if key is not None:
+            self.optsIndex[ key ] = index
+        return index
+
+    @staticmethod
+    def pairKey( id1, id2 ):
+        "Return a single int key for an unordered pair of node ids"
+        if id1 > id2:
+            id1, id2 = id2, id1
+        return ( id1 << 32 ) | id2
+
+    def _nodeId( self, name ):
+        "Return id of node name, growing per-node arrays if it is new"
+        nid = self.g.nodeId( name )
+        if nid == len( self.nodeOpts ):
+            self.nodeOpts.append( self.internOpts( {} ) )
+            self.switchFlags.append( 0 )
+            self.portCounts.append( 0 )
+        return nid
+
+    def addNode(self, name, **opts):
+        """Add Node to graph.
+           name: name
+           opts: node options
+           returns: node name"""
+        nid = self._nodeId( name )
+        self.nodeOpts[ nid ] = self.internOpts( opts )
+        self.switchFlags[ nid ] = 1 if opts.get( 'isSwitch' ) else 0
+        return name
+
+    def addLink(self, node1, node2, port1=None, port2=None,
+                **opts):
+        """node1, node2: nodes to link together
+           port1, port2: ports (optional)
+           opts: link options (optional)
+           returns: link info key"""
+        if not opts and self.lopts:
+            opts = self.lopts
+        port1, port2 = self.addPort(node1, node2, port1, port2)
+        key = tuple(self.sorted([node1, node2]))
+        edge = self.g.add_edge(*key)
+        if self.g.names[ self.g.src[ edge ] ] != node1:
+            port1, port2 = port2, port1
+        self.srcPorts.append( port1 )
+        self.dstPorts.append( port2 )
+        self.linkOpts.append( self.internOpts( opts ) )
+        self.pairs[ self.pairKey( self.g.src[ edge ],
+                                  self.g.dst[ edge ] ) ] = edge
+        return key
+
+    def addPort(self, src, dst, sport=None, dport=None):
+        '''Generate port numbers for new edge (called by addLink).
+        @param src source switch name
+        @param dst destination switch name
+        @return tuple (sport, dport)
+        '''
+        sid, did = self._nodeId( src ), self._nodeId( dst )
+        if sport is None:
+            sport = self.portCounts[ sid ] + self.switchFlags[ sid ]
+        if dport is None:
+            dport = self.portCounts[ did ] + self.switchFlags[ did ]
+        if self.pairKey( sid, did ) not in self.pairs:
+            self.portCounts[ sid ] += 1
+            if did != sid:
+                self.portCounts[ did ] += 1
+        return sport, dport
+
+    def nodes(self, sort=True):
+        "Return nodes in graph"
+        if sort:
+            return self.sorted( self.g.names )
+        else:
+            return self.g.nodes()
+
+    def isSwitch(self, n):
+        '''Returns true if node is a switch.'''
+        return bool( self.switchFlags[ self.g.ids[ n ] ] )
+
+    def _edge( self, src, dst ):
+        "Return latest edge index between src and dst, or None"
+        ids = self.g.ids
+        if src not in ids or dst not in ids:
+            return None
+        return self.pairs.get( self.pairKey( ids[ src ], ids[ dst ] ) )
+
+    def port(self, src, dst):
+        '''Get port number.
+
+        @param src source switch name
+        @param dst destination switch name
+        @return tuple (src_port, dst_port)
+        '''
+        edge = self._edge( src, dst )
+        if edge is None:
+            return None
+        if self.g.names[ self.g.src[ edge ] ] == src:
+            return ( self.srcPorts[ edge ], self.dstPorts[ edge ] )
+        return ( self.dstPorts[ edge ], self.srcPorts[ edge ] )
+
+    def linkInfo( self, src, dst ):
+        "Return a copy of link metadata"
+        edge = self._edge( src, dst )
+        if edge is None:
+            raise KeyError( ( src, dst ) )
+        return dict( self.optsPool[ self.linkOpts[ edge ] ] )
+
+    def setlinkInfo( self, src, dst, info ):
+        "Set link metadata"
+        edge = self._edge( src, dst )
+        if edge is None:
+            raise KeyError( ( src, dst ) )
+        self.linkOpts[ edge ] = self.internOpts( info )
+
+    def nodeInfo( self, name ):
+        "Return a copy of metadata for node"
+        return dict( self.optsPool[ self.nodeOpts[ self.g.ids[ name ] ] ] )
+
+    def setNodeInfo( self, name, info ):
+        "Set metadata (dict) for node"
+        nid = self._nodeId( name )
+        info = info if info is not None else {}
+        self.nodeOpts[ nid ] = self.internOpts( info )
+        self.switchFlags[ nid ] = 1 if info.get( 'isSwitch' ) else 0
+
 class SingleSwitchTopo(Topo):
     '''Single switch connected to k hosts.'''
 
@@ -0,0 +1,337 @@
+"""
+topofile.py: streaming topology files for Mininet
+
+A topology file is a JSON Lines file: one JSON object (record) per line.
+Blank lines and lines starting with '#' are ignored. Every record has a
+"type" field:
+
+  {"type": "topo", "version": 1}
+      optional header; if present it must be the first record
+  {"type": "host", "name": "h1", "opts": {"ip": "10.0.0.1/8"}}
+  {"type": "switch", "name": "s1", "opts": {"dpid": "1"}}
+  {"type": "link", "node1": "h1", "node2": "s1",
+   "port1": 0, "port2": 1, "opts": {"bw": 10}}
+
+"opts" is optional and holds the same options that would be passed to
+Topo.addHost/addSwitch/addLink. "port1"/"port2" are optional as well;
+missing ports are numbered per node in file order as Topo.addPort does:
+the number of distinct neighbors the node has so far, plus 1 for
+switches. A node must appear before any link that uses it, so that a
+file can be consumed in a single pass.
+
+Class-valued options such as "cls" are written as class names. When
+reading, they are resolved through an optional classes dict (name ->
+class), and then through the standard classes of mininet.node and
+mininet.link (CLASSES); names that cannot be resolved are dropped with
+a warning, and the corresponding Mininet default class is used instead.
+
+writeTopo(): write a Topo as a topology file.
+
+writeNet(): write the nodes and links of a running Mininet.
+
+loadTopo(): stream a topology file into a Topo (or CompactTopo).
+
+StreamTopo: a Topo which re-reads its file on each iteration instead of
+    storing it, so that Mininet.buildFromTopo() can build a network from a
+    large file incrementally.
+"""
+
+import json
+from itertools import chain
+
+import mininet.node
+import mininet.link
+from mininet.log import warn
+from mininet.topo import Topo
+from mininet.util import naturalSeq
+
+VERSION = 1
+
+RECORDTYPES = ( 'topo', 'host', 'switch', 'link' )
+
+# Standard classes, resolved by name without a classes dict
+CLASSES = dict( ( obj.__name__, obj )
+                for module in ( mininet.node, mininet.link )
+                for obj in vars( module ).values()
+                if isinstance( obj, type ) and
+                obj.__module__ == module.__name__ )
+
+
+def _str( obj ):
+    "Convert unicode strings (recursively) to str, as Mininet expects"
+    if isinstance( obj, unicode ):
+        return str( obj )
+    if isinstance( obj, list ):
+        return [ _str( o ) for o in obj ]
+    if isinstance( obj, dict ):
+        return dict( ( _str( k ), _str( v ) ) for k, v in obj.iteritems() )
+    return obj
+
+def _jsonOpts( opts ):
+    "Return a JSON-safe copy of opts; classes are replaced by their names"
+    result = {}
+    for key, value in opts.iteritems():
+        if isinstance( value, type ):
+            value = value.__name__
+        try:
+            json.dumps( value )
+        except ( TypeError, ValueError ):
+            warn( 'topofile: skipping option %s=%r\n' % ( key, value ) )
+            continue
+        result[ key ] = value
+    return result
+
+def _classes( classes ):
+    "Return the standard classes, overridden by the classes dict"
+    result = dict( CLASSES )
+    result.update( classes or {} )
+    return result
+
+def _resolveOpts( opts, classes ):
+    "Resolve class names in opts using the dict returned by _classes()"
+    for key in [ k for k in opts if k == 'cls' or k.endswith( 'cls' ) ]:
+        value = opts[ key ]
+        if not isinstance( value, str ):
+            continue
+        if value in classes:
+            opts[ key ] = classes[ value ]
+        else:
+            warn( 'topofile: unknown class %s for %s; using default\n' %
+                  ( value, key ) )
+            del opts[ key ]
+    return opts
+
+def _writeRecord( out, record ):
+    "Write a single record"
+    out.write( json.dumps( record, sort_keys=True ) + '\n' )
+
+def writeTopo( topo, out, sort=False ):
+    """Write topology to a topology file.
+       topo: Topo object
+       out: writable file object
+       sort: write nodes and links in sorted order?"""
+    _writeRecord( out, { 'type': 'topo', 'version': VERSION } )
+    for kind, entries in ( ( 'host', topo.hostEntries( sort ) ),
+                           ( 'switch', topo.switchEntries( sort ) ) ):
+        for name, opts in entries:
+            opts = dict( opts )
+            opts.pop( 'isSwitch', None )
+            _writeRecord( out, { 'type': kind, 'name': name,
+                                 'opts': _jsonOpts( opts ) } )
+    for src, dst, srcPort, dstPort, opts in topo.linkEntries( sort ):
+        _writeRecord( out, { 'type': 'link', 'node1': src, 'node2': dst,
+                             'port1': srcPort, 'port2': dstPort,
+                             'opts': _jsonOpts( opts ) } )
+
+def writeNet( net, out ):
+    """Write the hosts, switches and links of a running network.
+       net: Mininet object
+       out: writable file object
+       Controllers and links to nodes outside net.hosts and net.switches
+       (e.g. control network links) are not written."""
+    _writeRecord( out, { 'type': 'topo', 'version': VERSION } )
+    nodes = net.hosts + net.switches
+    exported = set( nodes )
+    for kind, nodeList in ( ( 'host', net.hosts ),
+                            ( 'switch', net.switches ) ):
+        for node in nodeList:
+            opts = dict( node.params )
+            opts[ 'cls' ] = node.__class__
+            if kind == 'switch':
+                opts[ 'dpid' ] = node.dpid
+            else:
+                intf = node.defaultIntf()
+                if intf and intf.IP():
+                    opts[ 'ip' ] = ( '%s/%s' % ( intf.IP(), intf.prefixLen )
+                                     if intf.prefixLen else intf.IP() )
+                if intf and intf.MAC():
+                    opts[ 'mac' ] = intf.MAC()
+            _writeRecord( out, { 'type': kind, 'name': node.name,
+                                 'opts': _jsonOpts( opts ) } )
+    for node in nodes:
+        for intf in node.intfList():
+            link = intf.link
+            # Write each link once, from the node holding its intf1
+            if not link or link.intf1 is not intf:
+                continue
+            peer = link.intf2
+            if peer.node not in exported:
+                continue
+            opts = dict( intf.params )
+            opts[ 'cls' ] = link.__class__   # e.g. TCLink, for bw/delay
+            _writeRecord( out, { 'type': 'link',
+                                 'node1': node.name,
+                                 'node2': peer.node.name,
+                                 'port1': node.ports[ intf ],
+                                 'port2': peer.node.ports[ peer ],
+                                 'opts': _jsonOpts( opts ) } )
+
+def readRecords( source ):
+    """Iterator: return each record of a topology file as a dict.
+       source: file name or readable file object"""
+    if isinstance( source, basestring ):
+        f = open( source )
+    else:
+        f = source
+    try:
+        for lineno, line in enumerate( f, 1 ):
+            line = line.strip()
+            if not line or line.startswith( '#' ):
+                continue
+            try:
+                record = _str( json.loads( line ) )
+            except ValueError, e:
+                raise Exception( 'topofile: line %d: %s' % ( lineno, e ) )
+            kind = record.get( 'type' ) if type( record ) is dict else None
+            if kind not in RECORDTYPES:
+                raise Exception( 'topofile: line %d: bad record type %r' %
+                                 ( lineno, kind ) )
+            if kind == 'topo' and record.get( 'version', 1 ) > VERSION:
+                raise Exception( 'topofile: unsupported version %s' %
+                                 record.get( 'version' ) )
+            yield record
+    finally:
+        if f is not source:
+            f.close()
+
+def loadTopo( source, topo=None, classes=None ):
+    """Stream a topology file into a Topo.
+       source: file name or readable file object
+       topo: Topo (e.g. CompactTopo) to add to; a new Topo if None
+       classes: optional dict of class names to classes
+       returns: topo"""
+    if topo is None:
+        topo = Topo()
+    classes = _classes( classes )
+    for record in readRecords( source ):
+        kind = record[ 'type' ]
+        opts = _resolveOpts( record.get( 'opts' ) or {}, classes )
+        if kind == 'host':
+            topo.addNode( record[ 'name' ], **opts )
+        elif kind == 'switch':
+            opts.pop( 'isSwitch', None )
+            topo.addNode( record[ 'name' ], isSwitch=True, **opts )
+        elif kind == 'link':
+            topo.addLink( record[ 'node1' ], record[ 'node2' ],
+                          record.get( 'port1' ), record.get( 'port2' ),
+                          **opts )
+    return topo
+
+
+class StreamTopo( Topo ):
+    """Topology backed by a topology file which is re-read on every
+       iteration rather than stored. Only the per-node neighbor sets
+       needed to number unspecified ports are kept in memory.
+       Supports the iteration API (hostEntries, switchEntries,
+       linkEntries, hosts, switches, links, nodes) used by
+       Mininet.buildFromTopo(); per-node lookups scan the file."""
+
+    def __init__( self, source, classes=None, **opts ):
+        """source: file name or seekable file object
+           classes: optional dict of class names to classes
+           opts: Topo options"""
+        self.source = source
+        self.classes = _classes( classes )
+        super( StreamTopo, self ).__init__( **opts )
+
+    def records( self, *kinds ):
+        "Iterator: return records of the given types"
+        if not isinstance( self.source, basestring ):
+            self.source.seek( 0 )
+        for record in readRecords( self.source ):
+            if record[ 'type' ] in kinds:
+                yield record
+
+    def _opts( self, record ):
+        "Return resolved options of a record"
+        return _resolveOpts( record.get( 'opts' ) or {}, self.classes )
+
+    def hostEntries( self, sort=True ):
+        "Iterator: return ( name, info ) for each host, in file order"
+        for record in self.records( 'host' ):
+            yield record[ 'name' ], self._opts( record )
+
+    def switchEntries( self, sort=True ):
+        "Iterator: return ( name, info ) for each switch, in file order"
+        for record in self.records( 'switch' ):
+            opts = self._opts( record )
+            opts[ 'isSwitch' ] = True
+            yield record[ 'name' ], opts
+
+    def linkEntries( self, sort=True ):
+        """Iterator: return ( src, dst, srcPort, dstPort, info ) for each
+           link, in file order"""
+        base = {}       # node name -> first port number
+        neighbors = {}  # node name -> names of its neighbors so far
+        for record in self.records( 'host', 'switch', 'link' ):
+            kind = record[ 'type' ]
+            if kind != 'link':
+                base[ record[ 'name' ] ] = 1 if kind == 'switch' else 0
+                neighbors[ record[ 'name' ] ] = set()
+                continue
+            src, dst = record[ 'node1' ], record[ 'node2' ]
+            ports = []
+            # Same numbering as Topo.addPort
+            for name, port in ( ( src, record.get( 'port1' ) ),
+                                ( dst, record.get( 'port2' ) ) ):
+                if name not in base:
+                    raise Exception( 'topofile: link %s-%s uses unknown '
+                                     'node %s' % ( src, dst, name ) )
+                if port is None:
+                    port = len( neighbors[ name ] ) + base[ name ]
+                ports.append( port )
+            neighbors[ src ].add( dst )
+            neighbors[ dst ].add( src )
+            yield src, dst, ports[ 0 ], ports[ 1 ], self._opts( record )
+
+    def hosts( self, sort=True ):
+        "Return host names"
+        names = [ name for name, _opts in self.hostEntries() ]
+        return self.sorted( names ) if sort else names
+
+    def switches( self, sort=True ):
+        "Return switch names"
+        names = [ name for name, _opts in self.switchEntries() ]
+        return self.sorted( names ) if sort else names
+
+    def nodes( self, sort=True ):
+        "Return node names"
+        names = self.hosts( sort=False ) + self.switches( sort=False )
+        return self.sorted( names ) if sort else names
+
+    def links( self, sort=True ):
+        "Return links as name pairs"
+        links = [ ( src, dst ) for src, dst, _sp, _dp, _opts in
+                  self.linkEntries() ]
+        if not sort:
+            return links
+        links = [ tuple( self.sorted( link ) ) for link in links ]
+        return sorted( links, key=naturalSeq )
+
+    def isSwitch( self, n ):
+        "Returns true if node is a switch (scans the file)."
+        return any( record[ 'name' ] == n
+                    for record in self.records( 'switch' ) )
+
+    def nodeInfo( self, name ):
+        "Return metadata (dict) for node (scans the file)."
+        for entryName, opts in chain( self.hostEntries(),
+                                      self.switchEntries() ):
+            if entryName == name:
+                return opts
+        raise KeyError( name )
+
+    def port( self, src, dst ):
+        "Return ( srcPort, dstPort ) of the first src-dst link (scans)."
+        for s, d, sp, dp, _opts in self.linkEntries():
+            if ( s, d ) == ( src, dst ):
+                return sp, dp
+            if ( s, d ) == ( dst, src ):
+                return dp, sp
+
+    def linkInfo( self, src, dst ):
+        "Return metadata for the first src-dst link (scans the file)."
+        for s, d, _sp, _dp, opts in self.linkEntries():
+            if ( s, d ) in ( ( src, dst ), ( dst, src ) ):
+                return opts
+        raise KeyError( ( src, dst ) )
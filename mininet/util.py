@@ -9,6 +9,7 @@
 import re
 from fcntl import fcntl, F_GETFL, F_SETFL
 from os import O_NONBLOCK
+from multiprocessing.pool import ThreadPool
 import os
 
 # Command execution support
@@ -433,6 +434,27 @@ def numCores():
         return 0
     return numCores.ncores
 
+def parallelMap( fn, items, workers=None ):
+    """Apply fn to each item using a pool of threads. This is useful
+       for operations that mostly wait on subprocesses or node shells,
+       e.g. starting many hosts.
+       fn: function of one argument
+       items: iterable of arguments
+       workers: number of threads (default: 4 per core)
+       returns: list of results, in the order of items"""
+    items = list( items )
+    if workers is None:
+        workers = 4 * max( numCores(), 1 )
+    workers = min( workers, len( items ) )
+    if workers <= 1:
+        return map( fn, items )
+    pool = ThreadPool( workers )
+    try:
+        return pool.map( fn, items )
+    finally:
+        pool.close()
+        pool.join()
+
 def irange(start, end):
     """Inclusive range from start to end (vs. Python insanity.)
        irange(1,5) -> 1, 2, 3, 4, 5"""